@@ -8,10 +8,24 @@ import numpy as np
 from datetime import datetime, timedelta
 from typing import Optional, Dict, List, Any
 import base64
+import hmac
+import logging
+import os
+import secrets
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
 
+logger = logging.getLogger(__name__)
 
 try:
     from PIL import Image as PILImage
+    from PIL import ImageOps
+    from PIL import features as pil_features
 except Exception:
     PILImage = None
     st.error("Pillow is missing. Add 'Pillow' to requirements.txt")
@@ -20,14 +34,22 @@ except Exception:
 try:
     from google.oauth2 import service_account
     from googleapiclient.discovery import build
-    from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
+    from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload, MediaUpload
 except Exception:
     service_account = None
     build = None
     MediaIoBaseUpload = None
+    MediaUpload = object
     st.error("Google API packages missing. Add these to requirements.txt: "
              "google-auth, google-auth-oauthlib, google-auth-httplib2, google-api-python-client")
 
+from shared_services import (
+    IMAGE_CACHE_DIR, get_http_session, get_google_client_cache, get_resolved_resources,
+    is_not_found_error, GenerationLog, get_metadata_index, ContentDigests, content_digests,
+    find_live_duplicate, get_library_index, get_image_cache, get_single_flight, download_drive_bytes,
+    get_log_buffer, get_state_store
+)
+
 st.set_page_config(
     page_title="AI Image Editor Pro - Complete Edition",
     page_icon="🎨",
@@ -268,17 +290,116 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-
 BASE_URL = "https://api.kie.ai/api/v1/jobs"
 SCOPES = [
     'https://www.googleapis.com/auth/drive.file',
     'https://www.googleapis.com/auth/spreadsheets'
 ]
+BATCH_MAX_CONCURRENCY = 4
+ACTIVE_TASK_STATUSES = ('queued', 'submitting', 'waiting', 'pending', 'queuing', 'generating', 'uploading')
+POLL_BASE_INTERVALS = {'waiting': 5, 'pending': 5, 'queuing': 4, 'generating': 2}
+POLL_MAX_INTERVAL = 30
+TASK_MONITOR_REFRESH_SECONDS = 2
+# Loopback by default; expose the receiver through a reverse proxy or set the env var to bind wider
+CALLBACK_RECEIVER_HOST = os.environ.get("CALLBACK_RECEIVER_HOST", "127.0.0.1")
+CALLBACK_RECEIVER_PORT = 8765
+CALLBACK_PATH = "/kie-callback"
+CALLBACK_TEST_PATH = "/kie-callback-test"
+CALLBACK_FALLBACK_DELAY = 30
+CALLBACK_STORE_MAX_ENTRIES = 10000
+JOB_RUNNER_MAX_WORKERS = 8
+UPLOAD_MAX_CONCURRENCY = 4
+UPLOAD_POOL_WORKERS = 16
+DRIVE_STREAMING_UPLOADS = True
+DRIVE_UPLOAD_CHUNK_GRANULARITY = 256 * 1024
+DRIVE_UPLOAD_CHUNK_SIZE = 4 * DRIVE_UPLOAD_CHUNK_GRANULARITY
+HTTP_STREAM_READ_SIZE = 64 * 1024
+DRIVE_BATCH_MAX_REQUESTS = 100
+PUBLIC_READ_PERMISSION = {'type': 'anyone', 'role': 'reader'}
+LIBRARY_FILE_FIELDS = 'id, name, webViewLink, thumbnailLink, createdTime, modifiedTime, mimeType, size, md5Checksum, parents, trashed'
+STATE_DB_PATH = os.path.join(IMAGE_CACHE_DIR, "app_state.sqlite3")
+PERSISTENCE_PROFILE = os.environ.get("APP_PROFILE", "default")
+# Session keys restored on connect and written back row by row: list, dict, single value or
+# counters (one row per profile that each session adds its changes to)
+PERSISTED_STATE = {
+    'session_owner_id': 'value',
+    'task_history': 'list',
+    'stats': 'counters',
+    'comparison_images': 'list'
+}
+SHEETS_VIEW_POLL_SECONDS = 15
+SHEETS_LOG_RANGE = 'Image Log!A:H'
+SHEETS_LOG_COLUMNS = ['Timestamp', 'Model', 'Prompt', 'Image URL', 'Drive Link', 'Task ID', 'Status', 'Tags']
+GENERATION_LOG_COLUMNS = ['timestamp', 'model', 'prompt', 'image_url', 'drive_link', 'task_id', 'status', 'tags']
+GENERATION_LOG_REQUIRED_COLUMNS = GENERATION_LOG_COLUMNS
+THUMBNAIL_MAX_SIZE = (320, 320)
+THUMBNAIL_FORMAT = 'WEBP'
+THUMBNAIL_QUALITY = 80
+LIBRARY_GRID_PAGE_SIZES = [12, 24, 48, 96]
+LIBRARY_GRID_COLUMNS = 3
+LIBRARY_PREFETCH_WORKERS = 4
+LIBRARY_SORT_OPTIONS = {
+    'date_desc': "Newest first",
+    'date_asc': "Oldest first",
+    'name': "Name"
+}
+LIBRARY_FILTER_TYPES = {
+    'all': "All types",
+    'image/png': "PNG",
+    'image/jpeg': "JPEG",
+    'image/webp': "WebP"
+}
+JOB_RUNNER_TICK_SECONDS = 1
+JOB_TIMEOUT_SECONDS = 600
+JOB_RETENTION_SECONDS = 3600
+JOB_PROGRESS = {
+    'queued': 0.0,
+    'submitting': 0.05,
+    'waiting': 0.1,
+    'queuing': 0.2,
+    'generating': 0.5,
+    'uploading': 0.8,
+    'success': 1.0,
+    'fail': 1.0
+}
+
+
+def google_identity():
+    """Identity of the connected service account, used to key resolved resources."""
+    return getattr(st.session_state.get('credentials'), 'cache_identity', None)
+
+
+def get_verified_resource(service, name):
+    """Return the cached ID of a named Drive resource, checked once per session.
+
+    The first lookup in each session confirms the file still exists and is
+    not trashed; otherwise the entry is forgotten and None is returned so the
+    caller resolves the resource again.
+    """
+    resolved = get_resolved_resources()
+    resource_id = resolved.get(google_identity(), name)
+    if not resource_id:
+        return None
+    verified = st.session_state.setdefault('verified_resources', set())
+    if resource_id in verified:
+        return resource_id
+    try:
+        trashed = service.files().get(fileId=resource_id, fields='id, trashed').execute().get('trashed')
+    except Exception as e:
+        if not is_not_found_error(e):
+            return resource_id
+        trashed = True
+    if trashed:
+        resolved.forget(resource_id)
+        return None
+    verified.add(resource_id)
+    return resource_id
 
 def init_session_state():
     """Initialize all session state variables with comprehensive defaults."""
     defaults = {
         'api_key': "",
+        'session_owner_id': uuid.uuid4().hex,
         'task_history': [],
         'current_task': None,
         'authenticated': False,
@@ -291,7 +412,12 @@ def init_session_state():
         'spreadsheet_id': None,
         'auto_upload': True,
         'auto_log_sheets': True,
+        'upload_concurrency': UPLOAD_MAX_CONCURRENCY,
         'polling_active': False,
+        'task_poll_state': {},
+        'pending_results': {},
+        'callback_enabled': False,
+        'callback_public_url': "",
         'service_account_info': None,
         'upload_queue': [],
         'stats': {
@@ -310,11 +436,16 @@ def init_session_state():
         'library_sort_by': 'date_desc',
         'library_search_query': '',
         'library_filter_type': 'all',
+        'library_page': 1,
+        'library_page_size': LIBRARY_GRID_PAGE_SIZES[0],
         'selected_images': [],
         'show_image_modal': False,
         'modal_image_data': None,
         'needs_rerun': False,
-        'csv_data': [],
+        'sheets_view_cache': None,
+        'csv_data': GenerationLog(GENERATION_LOG_COLUMNS, GENERATION_LOG_REQUIRED_COLUMNS),
+        'csv_export_cache': None,
+        'imported_csv_uploads': set(),
         'favorites': [],
         'tags': {},
         'comparison_mode': False,
@@ -358,16 +489,13 @@ def init_session_state():
 
 init_session_state()
 
-
 def authenticate_with_service_account(service_account_json):
     """Authenticate with Google Drive and Sheets using service account."""
     try:
-        credentials = service_account.Credentials.from_service_account_info(
-            service_account_json,
-            scopes=SCOPES
-        )
-        service = build('drive', 'v3', credentials=credentials)
-        sheets_service = build('sheets', 'v4', credentials=credentials)
+        client_cache = get_google_client_cache()
+        credentials = client_cache.credentials_for(service_account_json, SCOPES)
+        service = client_cache.build('drive', 'v3', credentials)
+        sheets_service = client_cache.build('sheets', 'v4', credentials)
         
         st.session_state.credentials = credentials
         st.session_state.service = service
@@ -382,6 +510,12 @@ def create_app_folder():
     if not st.session_state.service:
         return None
     
+    resolved = get_resolved_resources()
+    cached_id = get_verified_resource(st.session_state.service, 'folder:AI_Image_Editor_Pro')
+    if cached_id:
+        st.session_state.gdrive_folder_id = cached_id
+        return cached_id
+    
     try:
         results = st.session_state.service.files().list(
             q="name='AI_Image_Editor_Pro' and mimeType='application/vnd.google-apps.folder' and trashed=false",
@@ -393,6 +527,7 @@ def create_app_folder():
         files = results.get('files', [])
         if files:
             st.session_state.gdrive_folder_id = files[0]['id']
+            resolved.set(google_identity(), 'folder:AI_Image_Editor_Pro', files[0]['id'])
             return files[0]['id']
         
         file_metadata = {
@@ -406,84 +541,230 @@ def create_app_folder():
         
         folder_id = folder.get('id')
         st.session_state.gdrive_folder_id = folder_id
+        resolved.set(google_identity(), 'folder:AI_Image_Editor_Pro', folder_id)
         return folder_id
     except Exception as e:
         st.error(f"Error creating folder: {str(e)}")
         return None
 
-def upload_to_gdrive(image_url: str, file_name: str, task_id: str = None):
-    """Download image from URL and upload to Google Drive with public access."""
-    if not st.session_state.service:
-        return None
+def build_google_services(credentials):
+    """Build Drive and Sheets clients for use outside the script thread.
+
+    googleapiclient services are not thread-safe, so background workers build
+    their own instead of sharing the ones stored in session state. Both share
+    the calling thread's connection from the process-wide client cache.
+    """
+    client_cache = get_google_client_cache()
+    drive_service = client_cache.build('drive', 'v3', credentials)
+    sheets_service = client_cache.build('sheets', 'v4', credentials)
+    return drive_service, sheets_service
+
+_thread_services = threading.local()
+
+def get_thread_google_services(credentials):
+    """Return Drive and Sheets clients owned by the current thread, built once per credentials."""
+    cached = getattr(_thread_services, 'entry', None)
+    if cached is None or cached[0] is not credentials:
+        cached = (credentials, *build_google_services(credentials))
+        _thread_services.entry = cached
+    return cached[1], cached[2]
+
+class StreamingUrlUpload(MediaUpload):
+    """Resumable upload body that streams an HTTP response chunk by chunk.
+
+    Only the bytes from the last requested offset up to one chunk ahead are
+    buffered, so peak memory per upload is bounded by the chunk size rather
+    than the image size. Reading a chunk ahead lets the uploader learn the
+    total size before it sends the final chunk.
+    """
+    
+    def __init__(self, response, mimetype, chunksize=DRIVE_UPLOAD_CHUNK_SIZE, on_piece=None):
+        granularity = DRIVE_UPLOAD_CHUNK_GRANULARITY
+        self._chunksize = max(granularity, -(-chunksize // granularity) * granularity)
+        self._pieces = response.iter_content(chunk_size=HTTP_STREAM_READ_SIZE)
+        self._mimetype = mimetype
+        self._buffer = bytearray()
+        self._buffer_start = 0
+        self._size = None
+        self._on_piece = on_piece
+        self._fill(self._chunksize + 1)
+    
+    def _fill(self, length):
+        while self._size is None and len(self._buffer) < length:
+            piece = next(self._pieces, None)
+            if piece is None:
+                self._size = self._buffer_start + len(self._buffer)
+            else:
+                self._buffer.extend(piece)
+                if self._on_piece is not None:
+                    self._on_piece(piece)
     
-    try:
-        folder_id = st.session_state.gdrive_folder_id or create_app_folder()
-        if not folder_id:
-            return None
-        
-        response = requests.get(image_url, timeout=30)
+    def chunksize(self):
+        return self._chunksize
+    
+    def mimetype(self):
+        return self._mimetype
+    
+    def size(self):
+        return self._size
+    
+    def resumable(self):
+        return True
+    
+    def getbytes(self, begin, length):
+        if begin < self._buffer_start:
+            raise ValueError("Cannot rewind a streaming upload")
+        del self._buffer[:begin - self._buffer_start]
+        self._buffer_start = begin
+        self._fill(2 * length + 1)
+        return bytes(self._buffer[:length])
+
+def upload_url_to_drive(service, folder_id, image_url: str, file_name: str, task_id: str = None, timings=None,
+                        streaming=DRIVE_STREAMING_UPLOADS, chunk_size=DRIVE_UPLOAD_CHUNK_SIZE, grant_permission=True,
+                        thumbnail=True, owner=None):
+    """Download an image from URL and upload it to a Drive folder with public access.
+
+    Does not touch session state and raises on failure, so it can run in
+    background workers. With ``streaming`` the response body is piped into the
+    resumable upload ``chunk_size`` bytes at a time instead of being buffered
+    whole. When a ``timings`` dict is given, the seconds spent on each step
+    are recorded in it. Pass ``grant_permission=False`` when the caller grants
+    public access for several files at once with ``grant_public_read_batch``.
+    With ``thumbnail`` a preview is rendered from the transferred bytes and
+    stored in the disk image cache for the library grid under ``owner``. The
+    bytes are looked up in the content hash index, and a file already in the
+    folder is returned instead of keeping a copy: without ``streaming`` before
+    uploading, with it once the transfer has hashed them, deleting the new copy.
+    """
+    timings = timings if timings is not None else {}
+    thumbnail_builder = ThumbnailBuilder() if thumbnail else None
+    
+    mime_type = 'image/png'
+    if file_name.lower().endswith('.jpg') or file_name.lower().endswith('.jpeg'):
+        mime_type = 'image/jpeg'
+    elif file_name.lower().endswith('.webp'):
+        mime_type = 'image/webp'
+    
+    file_metadata = {
+        'name': file_name,
+        'parents': [folder_id]
+    }
+    fields = 'id, name, webViewLink, webContentLink, mimeType, createdTime, modifiedTime, md5Checksum'
+    deduplicated = False
+    
+    if streaming:
+        digests = ContentDigests()
+        
+        def on_piece(piece):
+            digests.update(piece)
+            if thumbnail_builder:
+                thumbnail_builder.feed(piece)
+        
+        started = time.perf_counter()
+        with get_http_session().get(image_url, timeout=30, stream=True) as response:
+            response.raise_for_status()
+            media = StreamingUrlUpload(response, mime_type, chunk_size, on_piece=on_piece)
+            file = service.files().create(
+                body=file_metadata,
+                media_body=media,
+                fields=fields
+            ).execute()
+        timings['transfer'] = time.perf_counter() - started
+        
+        sha256, md5_checksum = digests.hexdigests()
+        duplicate = find_live_duplicate(service, folder_id, sha256, md5_checksum)
+        if duplicate:
+            # The bytes were already stored; keep that file and drop the copy just made
+            service.files().delete(fileId=file.get('id')).execute()
+            file = duplicate
+            deduplicated = True
+            thumbnail_builder = None
+        else:
+            get_metadata_index().record_content_hash(
+                folder_id, file.get('id'), sha256, file.get('md5Checksum') or md5_checksum
+            )
+    else:
+        started = time.perf_counter()
+        response = get_http_session().get(image_url, timeout=30)
         response.raise_for_status()
         image_data = response.content
-        
-        mime_type = 'image/png'
-        if file_name.lower().endswith('.jpg') or file_name.lower().endswith('.jpeg'):
-            mime_type = 'image/jpeg'
-        elif file_name.lower().endswith('.webp'):
-            mime_type = 'image/webp'
-        
-        file_metadata = {
-            'name': file_name,
-            'parents': [folder_id]
-        }
-        
-        media = MediaIoBaseUpload(
-            io.BytesIO(image_data),
-            mimetype=mime_type,
-            resumable=True
-        )
-        
-        file = st.session_state.service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id, name, webViewLink, webContentLink, mimeType'
-        ).execute()
-        
-        file_id = file.get('id')
-        
-        permission = {
-            'type': 'anyone',
-            'role': 'reader'
-        }
-        st.session_state.service.permissions().create(
+        timings['download'] = time.perf_counter() - started
+        
+        sha256, md5_checksum = content_digests(image_data)
+        file = find_live_duplicate(service, folder_id, sha256, md5_checksum)
+        if file:
+            # Already stored by an earlier upload; sharing it again below is idempotent
+            deduplicated = True
+            thumbnail_builder = None
+        else:
+            if thumbnail_builder:
+                thumbnail_builder.feed(image_data)
+            
+            media = MediaIoBaseUpload(
+                io.BytesIO(image_data),
+                mimetype=mime_type,
+                resumable=True
+            )
+            
+            started = time.perf_counter()
+            file = service.files().create(
+                body=file_metadata,
+                media_body=media,
+                fields=fields
+            ).execute()
+            timings['upload'] = time.perf_counter() - started
+            get_metadata_index().record_content_hash(
+                folder_id, file.get('id'), sha256, file.get('md5Checksum') or md5_checksum
+            )
+    
+    file_id = file.get('id')
+    
+    if thumbnail_builder:
+        started = time.perf_counter()
+        thumb_bytes = thumbnail_builder.build()
+        if thumb_bytes:
+            get_image_cache().put('thumb', owner, file_id, file.get('modifiedTime'), thumb_bytes)
+        timings['thumbnail'] = time.perf_counter() - started
+    
+    if grant_permission:
+        started = time.perf_counter()
+        service.permissions().create(
             fileId=file_id,
-            body=permission
+            body=PUBLIC_READ_PERMISSION
         ).execute()
-        
-        public_image_url = f"https://drive.google.com/uc?export=view&id={file_id}"
-        thumbnail_url = f"https://drive.google.com/thumbnail?id={file_id}&sz=w400"
-        
-        st.session_state.stats['uploaded_images'] += 1
-        
-        return {
-            'file_id': file_id,
-            'file_name': file.get('name'),
-            'web_link': file.get('webViewLink'),
-            'content_link': file.get('webContentLink'),
-            'public_image_url': public_image_url,
-            'thumbnail_url': thumbnail_url,
-            'mime_type': file.get('mimeType'),
-            'uploaded_at': datetime.now().isoformat(),
-            'task_id': task_id,
-            'original_url': image_url,
-            'id': file_id,
-            'name': file.get('name')
-        }
-    except Exception as e:
-        st.error(f"Error uploading to Google Drive: {str(e)}")
-        return None
+        timings['permission'] = time.perf_counter() - started
+    
+    public_image_url = f"https://drive.google.com/uc?export=view&id={file_id}"
+    thumbnail_url = f"https://drive.google.com/thumbnail?id={file_id}&sz=w400"
+    
+    return {
+        'file_id': file_id,
+        'file_name': file.get('name'),
+        'web_link': file.get('webViewLink'),
+        'content_link': file.get('webContentLink'),
+        'public_image_url': public_image_url,
+        'thumbnail_url': thumbnail_url,
+        'mime_type': file.get('mimeType'),
+        'mimeType': file.get('mimeType'),
+        'createdTime': file.get('createdTime'),
+        'modifiedTime': file.get('modifiedTime'),
+        'webViewLink': file.get('webViewLink'),
+        'md5Checksum': file.get('md5Checksum'),
+        'deduplicated': deduplicated,
+        'uploaded_at': datetime.now().isoformat(),
+        'task_id': task_id,
+        'original_url': image_url,
+        'id': file_id,
+        'name': file.get('name')
+    }
+
+def list_gdrive_images(folder_id=None, full_refresh=False):
+    """List all images in the Google Drive folder.
 
-def list_gdrive_images(folder_id=None):
-    """List all images in the Google Drive folder."""
+    Reads from the folder's sync index, which fetches only changes since the
+    last sync unless ``full_refresh`` is set. Sessions that ask for the same
+    folder at the same time share one sync.
+    """
     if not st.session_state.service:
         return []
     
@@ -492,68 +773,245 @@ def list_gdrive_images(folder_id=None):
         return []
     
     try:
-        results = st.session_state.service.files().list(
-            q=f"'{folder_id}' in parents and mimeType contains 'image/' and trashed=false",
-            spaces='drive',
-            fields='files(id, name, webViewLink, thumbnailLink, createdTime, mimeType, size)',
-            orderBy='createdTime desc',
-            pageSize=100
-        ).execute()
-        
-        files = results.get('files', [])
-        
-        # Add public_image_url and direct_link for compatibility
-        for f in files:
-            f['public_image_url'] = f"https://drive.google.com/uc?export=view&id={f['id']}"
-            f['direct_link'] = f"https://lh3.googleusercontent.com/d/{f['id']}"
-            f['webViewLink'] = f['webViewLink'] # Ensure webViewLink exists
-            f['thumbnailLink'] = f.get('thumbnailLink', f"https://drive.google.com/thumbnail?id={f['id']}&sz=w400")
-            f['uploaded_at'] = f.get('createdTime')
-            f['file_id'] = f['id']
-            f['file_name'] = f['name']
-            
-        return files
+        service = st.session_state.service
+        synced = get_single_flight().do(
+            ('library', google_identity(), folder_id, full_refresh),
+            lambda: get_library_index(folder_id, LIBRARY_FILE_FIELDS).sync(service, full=full_refresh)
+        )
+        # Waiters share the synced list, so each caller decorates its own copies
+        return [library_file_info(f) for f in synced]
     except Exception as e:
         st.error(f"Error listing images: {str(e)}")
         return []
 
-def get_gdrive_image_bytes(file_id):
-    """Download image bytes from Google Drive."""
+def library_file_info(f):
+    """Return a copy of a Drive file dict with the public and direct links the library expects."""
+    f = dict(f)
+    f['public_image_url'] = f"https://drive.google.com/uc?export=view&id={f['id']}"
+    f['direct_link'] = f"https://lh3.googleusercontent.com/d/{f['id']}"
+    f['webViewLink'] = f.get('webViewLink', f"https://drive.google.com/file/d/{f['id']}/view")
+    f['thumbnailLink'] = f.get('thumbnailLink', f"https://drive.google.com/thumbnail?id={f['id']}&sz=w400")
+    f['uploaded_at'] = f.get('createdTime')
+    f['file_id'] = f['id']
+    f['file_name'] = f['name']
+    return f
+
+def encode_thumbnail(image):
+    """Downscale a PIL image into WebP (or JPEG when WebP is unavailable) preview bytes.
+
+    JPEGs are decoded at a reduced scale close to the thumbnail size, so
+    the full-resolution pixels are never held in memory for them.
+    """
+    image.draft('RGB', THUMBNAIL_MAX_SIZE)
+    thumb = ImageOps.exif_transpose(image)
+    thumb.thumbnail(THUMBNAIL_MAX_SIZE)
+    image_format = THUMBNAIL_FORMAT if pil_features.check('webp') else 'JPEG'
+    if image_format == 'JPEG':
+        thumb = thumb.convert('RGB')
+    elif thumb.mode not in ('RGB', 'RGBA'):
+        thumb = thumb.convert('RGBA' if 'A' in thumb.getbands() or 'transparency' in thumb.info else 'RGB')
+    
+    buffered = io.BytesIO()
+    thumb.save(buffered, format=image_format, quality=THUMBNAIL_QUALITY)
+    return buffered.getvalue()
+
+def create_thumbnail(image_bytes):
+    """Return thumbnail bytes for an encoded image, or None if it cannot be decoded."""
+    if PILImage is None:
+        return None
+    try:
+        with PILImage.open(io.BytesIO(image_bytes)) as image:
+            return encode_thumbnail(image)
+    except Exception:
+        return None
+
+class ThumbnailBuilder:
+    """Collects an image as it streams past and renders its thumbnail afterwards.
+
+    Fed the same pieces that are uploaded, so a thumbnail is produced on
+    upload without downloading the image again. The pieces are spooled to a
+    temporary file once they exceed one upload chunk, keeping memory bounded
+    by the chunk size while the upload is in flight.
+    """
+    
+    def __init__(self, max_memory=DRIVE_UPLOAD_CHUNK_SIZE):
+        self._spool = tempfile.SpooledTemporaryFile(max_size=max_memory) if PILImage is not None else None
+    
+    def feed(self, data):
+        if self._spool is not None:
+            self._spool.write(data)
+    
+    def build(self):
+        if self._spool is None:
+            return None
+        try:
+            self._spool.seek(0)
+            with PILImage.open(self._spool) as image:
+                return encode_thumbnail(image)
+        except Exception:
+            return None
+        finally:
+            self._spool.close()
+            self._spool = None
+
+def get_gdrive_image_bytes(file_id, modified_time=None):
+    """Download image bytes from Google Drive, served from the disk cache after the first fetch."""
     if not st.session_state.service:
         return None
     
     try:
-        request = st.session_state.service.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            _, done = downloader.next_chunk()
-        
-        fh.seek(0)
-        return fh.read()
+        return download_drive_bytes(st.session_state.service, file_id, modified_time, google_identity())
     except Exception as e:
         st.error(f"Error downloading image: {str(e)}")
         return None
 
-def delete_gdrive_file(file_id):
-    """Delete a file from Google Drive."""
+def fetch_drive_thumbnail(service, file_info, owner=None):
+    """Return thumbnail bytes for a Drive file, rendering and caching them on first use.
+
+    Does not touch session state and raises on download errors, so it can run
+    in prefetch workers. Falls back to the original bytes when the image
+    cannot be decoded.
+    """
+    file_id = file_info['id']
+    modified_time = file_info.get('modifiedTime')
+    cache = get_image_cache()
+    thumb_bytes = cache.get('thumb', owner, file_id, modified_time)
+    if thumb_bytes is not None:
+        return thumb_bytes
+    
+    image_bytes = download_drive_bytes(service, file_id, modified_time, owner)
+    thumb_bytes = create_thumbnail(image_bytes)
+    if thumb_bytes is None:
+        return image_bytes
+    cache.put('thumb', owner, file_id, modified_time, thumb_bytes)
+    return thumb_bytes
+
+def get_gdrive_thumbnail(file_info):
+    """Return cached thumbnail bytes for a Drive file, rendering them on first use."""
     if not st.session_state.service:
-        return False
+        return None
     
     try:
-        st.session_state.service.files().delete(fileId=file_id).execute()
-        return True
+        return fetch_drive_thumbnail(st.session_state.service, file_info, google_identity())
     except Exception as e:
-        st.error(f"Error deleting file: {str(e)}")
-        return False
+        st.error(f"Error downloading image: {str(e)}")
+        return None
+
+class ThumbnailPrefetcher:
+    """Warms the thumbnail cache for library tiles that are about to be shown.
+
+    Requests are deduplicated while in flight and run on a small shared pool
+    with per-thread Drive clients, so the next library page renders from disk.
+    """
+    
+    def __init__(self, max_workers=LIBRARY_PREFETCH_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumb-prefetch")
+        self._pending = set()
+        self._lock = threading.Lock()
+    
+    def prefetch(self, credentials, file_infos):
+        owner = getattr(credentials, 'cache_identity', None)
+        for file_info in file_infos:
+            key = (owner, file_info['id'], file_info.get('modifiedTime'))
+            with self._lock:
+                if key in self._pending:
+                    continue
+                self._pending.add(key)
+            self._executor.submit(self._fetch, credentials, file_info, key)
+    
+    def _fetch(self, credentials, file_info, key):
+        try:
+            drive_service, _ = get_thread_google_services(credentials)
+            fetch_drive_thumbnail(drive_service, file_info, key[0])
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+@st.cache_resource
+def get_thumbnail_prefetcher():
+    """Return the process-wide thumbnail prefetcher."""
+    return ThumbnailPrefetcher()
 
+def execute_drive_batch(service, requests_by_key):
+    """Execute Drive API requests through the batch endpoint.
+
+    ``requests_by_key`` maps a string key (usually a file ID) to an
+    unexecuted request; up to ``DRIVE_BATCH_MAX_REQUESTS`` share one round
+    trip. Returns ``{key: (response, error)}`` so that partial failures are
+    handled per item.
+    """
+    results = {}
+    
+    def on_response(request_id, response, exception):
+        results[request_id] = (response, exception)
+    
+    items = list(requests_by_key.items())
+    for start in range(0, len(items), DRIVE_BATCH_MAX_REQUESTS):
+        batch = service.new_batch_http_request(callback=on_response)
+        for key, request in items[start:start + DRIVE_BATCH_MAX_REQUESTS]:
+            batch.add(request, request_id=key)
+        try:
+            batch.execute()
+        except Exception as e:
+            for key, _ in items[start:start + DRIVE_BATCH_MAX_REQUESTS]:
+                results.setdefault(key, (None, e))
+    return results
+
+def grant_public_read_batch(service, file_ids):
+    """Give 'anyone with the link' read access to many files in batched round trips.
+
+    Returns ``{file_id: error}`` with ``None`` for files that were shared.
+    """
+    results = execute_drive_batch(service, {
+        file_id: service.permissions().create(fileId=file_id, body=PUBLIC_READ_PERMISSION)
+        for file_id in file_ids
+    })
+    return {file_id: results.get(file_id, (None, None))[1] for file_id in file_ids}
+
+def delete_gdrive_files(file_ids):
+    """Delete several files from Google Drive in batched round trips.
+
+    Returns ``(deleted_ids, errors)`` where ``errors`` maps each file that
+    could not be deleted to its error message.
+    """
+    if not st.session_state.service or not file_ids:
+        return [], {}
+    
+    service = st.session_state.service
+    results = execute_drive_batch(service, {
+        file_id: service.files().delete(fileId=file_id) for file_id in file_ids
+    })
+    deleted_ids = [file_id for file_id in file_ids if results.get(file_id, (None, None))[1] is None]
+    get_metadata_index().forget(deleted_ids)
+    errors = {
+        file_id: str(results[file_id][1])
+        for file_id in file_ids if file_id not in deleted_ids
+    }
+    return deleted_ids, errors
+
+def delete_gdrive_file(file_id):
+    """Delete a file from Google Drive."""
+    if not st.session_state.service:
+        return False
+    
+    deleted_ids, errors = delete_gdrive_files([file_id])
+    if errors:
+        st.error(f"Error deleting file: {errors[file_id]}")
+    return bool(deleted_ids)
 
 def create_or_get_spreadsheet():
     """Create or get the tracking spreadsheet."""
     if not st.session_state.sheets_service or not st.session_state.service:
         return None
     
+    resolved = get_resolved_resources()
+    cached_id = get_verified_resource(st.session_state.service, 'spreadsheet:AI_Image_Generation_Log')
+    if cached_id:
+        st.session_state.spreadsheet_id = cached_id
+        return cached_id
+    
     try:
         folder_id = st.session_state.gdrive_folder_id or create_app_folder()
         
@@ -567,6 +1025,7 @@ def create_or_get_spreadsheet():
         files = results.get('files', [])
         if files:
             st.session_state.spreadsheet_id = files[0]['id']
+            resolved.set(google_identity(), 'spreadsheet:AI_Image_Generation_Log', files[0]['id'])
             return files[0]['id']
         
         spreadsheet = {
@@ -640,14 +1099,20 @@ def create_or_get_spreadsheet():
         ).execute()
         
         st.session_state.spreadsheet_id = spreadsheet_id
+        resolved.set(google_identity(), 'spreadsheet:AI_Image_Generation_Log', spreadsheet_id)
         return spreadsheet_id
         
     except Exception as e:
         st.error(f"Error creating spreadsheet: {str(e)}")
         return None
 
+def build_log_row(model: str, prompt: str, image_url: str, drive_link: str = "", task_id: str = "", status: str = "success", tags: str = ""):
+    """Build one 'Image Log' row in column order A:H."""
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return [timestamp, model, prompt, image_url, drive_link, task_id, status, tags]
+
 def log_to_sheets(model: str, prompt: str, image_url: str, drive_link: str = "", task_id: str = "", status: str = "success", tags: str = ""):
-    """Log image generation to Google Sheets."""
+    """Queue an image generation log row for Google Sheets through the write-behind buffer."""
     if not st.session_state.sheets_service:
         return False
     
@@ -656,16 +1121,8 @@ def log_to_sheets(model: str, prompt: str, image_url: str, drive_link: str = "",
         if not spreadsheet_id:
             return False
         
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        row = [[timestamp, model, prompt, image_url, drive_link, task_id, status, tags]]
-        
-        st.session_state.sheets_service.spreadsheets().values().append(
-            spreadsheetId=spreadsheet_id,
-            range='Image Log!A:H',
-            valueInputOption='RAW',
-            insertDataOption='INSERT_ROWS',
-            body={'values': row}
-        ).execute()
+        row = build_log_row(model, prompt, image_url, drive_link, task_id, status, tags)
+        get_log_buffer().add(st.session_state.credentials, spreadsheet_id, SHEETS_LOG_RANGE, [row])
         
         st.session_state.stats['sheets_entries'] += 1
         return True
@@ -674,24 +1131,67 @@ def log_to_sheets(model: str, prompt: str, image_url: str, drive_link: str = "",
         st.error(f"Error logging to sheets: {str(e)}")
         return False
 
-def get_sheets_data():
-    """Retrieve all data from the spreadsheet."""
+def get_sheets_data(start_row=2, last_column='H'):
+    """Retrieve data rows from the spreadsheet, starting at sheet row ``start_row`` (row 1 is the header).
+
+    Only columns A to ``last_column`` are read. Returns None when the read fails.
+    """
     if not st.session_state.sheets_service or not st.session_state.spreadsheet_id:
         return []
     
     try:
         result = st.session_state.sheets_service.spreadsheets().values().get(
             spreadsheetId=st.session_state.spreadsheet_id,
-            range='Image Log!A:H'
+            range=f"Image Log!A{start_row}:{last_column}"
         ).execute()
         
-        values = result.get('values', [])
-        return values[1:] if len(values) > 1 else []
+        return result.get('values', [])
         
     except Exception as e:
+        if is_not_found_error(e):
+            get_resolved_resources().forget(st.session_state.spreadsheet_id)
+            st.session_state.spreadsheet_id = None
         st.error(f"Error reading sheets data: {str(e)}")
-        return []
+        return None
 
+def get_sheets_log_frame(refresh=False):
+    """Return the 'Image Log' as a DataFrame kept in session state across reruns.
+
+    Every ``SHEETS_VIEW_POLL_SECONDS``, or as soon as this process's log
+    buffer has written rows, column A below the known rows is read to see
+    whether any process or client appended rows. Only then are the new rows
+    fetched. ``refresh`` drops the cache and reads the whole sheet again,
+    picking up edits made elsewhere.
+    """
+    import pandas as pd
+    
+    cache = st.session_state.sheets_view_cache
+    if refresh or cache is None or cache['spreadsheet_id'] != st.session_state.spreadsheet_id:
+        cache = {
+            'spreadsheet_id': st.session_state.spreadsheet_id,
+            'row_count': 0,
+            'flushed_rows': None,
+            'checked_at': 0,
+            'df': pd.DataFrame(columns=SHEETS_LOG_COLUMNS)
+        }
+        st.session_state.sheets_view_cache = cache
+    
+    now = time.time()
+    flushed_rows = get_log_buffer().flushed_rows
+    if cache['flushed_rows'] != flushed_rows or now - cache['checked_at'] >= SHEETS_VIEW_POLL_SECONDS:
+        appended = get_sheets_data(start_row=cache['row_count'] + 2, last_column='A')
+        new_rows = get_sheets_data(start_row=cache['row_count'] + 2) if appended else appended
+        if new_rows is not None:
+            if new_rows:
+                width = len(SHEETS_LOG_COLUMNS)
+                padded = [(row + [''] * width)[:width] for row in new_rows]
+                new_df = pd.DataFrame(padded, columns=SHEETS_LOG_COLUMNS)
+                cache['df'] = new_df if cache['df'].empty else pd.concat([cache['df'], new_df], ignore_index=True)
+                cache['row_count'] += len(new_rows)
+            cache['flushed_rows'] = flushed_rows
+            cache['checked_at'] = now
+    
+    return cache['df']
 
 def add_to_csv_data(model: str, prompt: str, image_url: str, drive_link: str = "", task_id: str = "", status: str = "success", tags: str = ""):
     """Add entry to CSV data in session state."""
@@ -710,42 +1210,49 @@ def add_to_csv_data(model: str, prompt: str, image_url: str, drive_link: str = "
     st.session_state.stats['csv_entries'] += 1
 
 def export_to_csv():
-    """Export all CSV data to downloadable file."""
-    if not st.session_state.csv_data:
+    """Export all CSV data to downloadable file, reusing the last export until new rows arrive."""
+    log = st.session_state.csv_data
+    if not log:
         return None
     
+    cache_key = (id(log), len(log))
+    cached = st.session_state.csv_export_cache
+    if cached and cached[0] == cache_key:
+        return cached[1]
+    
     try:
-        output = io.StringIO()
-        fieldnames = ['timestamp', 'model', 'prompt', 'image_url', 'drive_link', 'task_id', 'status', 'tags']
-        writer = csv.DictWriter(output, fieldnames=fieldnames)
-        
-        writer.writeheader()
-        writer.writerows(st.session_state.csv_data)
-        
-        return output.getvalue()
+        output = io.BytesIO()
+        log.write_csv(output)
+        data = output.getvalue()
+        st.session_state.csv_export_cache = (cache_key, data)
+        return data
         
     except Exception as e:
         st.error(f"Error creating CSV: {str(e)}")
         return None
 
 def load_csv_file(uploaded_file):
-    """Load existing CSV file into session state."""
+    """Stream an existing CSV log into session state, skipping rows that are already logged."""
+    progress_bar = st.progress(0.0, text="Importing CSV...")
+    
+    def on_progress(bytes_read, rows_read):
+        fraction = min(1.0, bytes_read / uploaded_file.size) if uploaded_file.size else 0.0
+        progress_bar.progress(fraction, text=f"Imported {rows_read:,} rows...")
+    
     try:
-        content = uploaded_file.getvalue().decode('utf-8')
-        csv_reader = csv.DictReader(io.StringIO(content))
-        
-        loaded_entries = list(csv_reader)
-        st.session_state.csv_data.extend(loaded_entries)
-        st.session_state.stats['csv_entries'] += len(loaded_entries)
+        report = st.session_state.csv_data.import_csv(uploaded_file, on_progress)
+        st.session_state.stats['csv_entries'] += report['added']
         
-        return True, f"Loaded {len(loaded_entries)} entries from CSV"
+        return True, (f"Loaded {report['added']} entries from CSV "
+                      f"({report['duplicates']} duplicates and {report['invalid']} invalid rows skipped)")
         
     except Exception as e:
         return False, f"Error loading CSV: {str(e)}"
+    finally:
+        progress_bar.empty()
 
-
-def create_task(api_key, model, input_params, callback_url=None):
-    """Create a generation task."""
+def submit_task_request(api_key, model, input_params, callback_url=None):
+    """Send a createTask request without touching session state (safe to call from worker threads)."""
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
@@ -760,7 +1267,7 @@ def create_task(api_key, model, input_params, callback_url=None):
         payload["callBackUrl"] = callback_url
     
     try:
-        response = requests.post(
+        response = get_http_session().post(
             f"{BASE_URL}/createTask",
             headers=headers,
             json=payload,
@@ -770,7 +1277,6 @@ def create_task(api_key, model, input_params, callback_url=None):
         data = response.json()
         if response.status_code == 200:
             if data.get("code") == 200:
-                st.session_state.stats['total_tasks'] += 1
                 return {"success": True, "task_id": data["data"]["taskId"]}
             else:
                 return {"success": False, "error": data.get('msg', 'Unknown error')}
@@ -779,6 +1285,13 @@ def create_task(api_key, model, input_params, callback_url=None):
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+def create_task(api_key, model, input_params, callback_url=None):
+    """Create a generation task."""
+    result = submit_task_request(api_key, model, input_params, callback_url or get_callback_url())
+    if result["success"]:
+        st.session_state.stats['total_tasks'] += 1
+    return result
+
 def check_task_status(api_key, task_id):
     """Check task status."""
     headers = {
@@ -786,7 +1299,7 @@ def check_task_status(api_key, task_id):
     }
     
     try:
-        response = requests.get(
+        response = get_http_session().get(
             f"{BASE_URL}/recordInfo",
             headers=headers,
             params={"taskId": task_id},
@@ -804,70 +1317,878 @@ def check_task_status(api_key, task_id):
     except Exception as e:
         return {"success": False, "error": str(e)}
 
-def poll_task_until_complete(api_key, task_id, max_attempts=60, delay=2):
-    """Poll task status until completion or timeout."""
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    for attempt in range(max_attempts):
-        result = check_task_status(api_key, task_id)
+class TaskCompletionStore:
+    """Thread-safe store of completion payloads received by callback, keyed by task ID."""
+    
+    def __init__(self, max_entries=CALLBACK_STORE_MAX_ENTRIES):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+    
+    def record(self, task_id, task_data):
+        with self._lock:
+            self._entries[task_id] = task_data
+            self._entries.move_to_end(task_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def get(self, task_id):
+        with self._lock:
+            return self._entries.get(task_id)
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+@st.cache_resource
+def get_completion_store():
+    """Return the process-wide completion store shared by all sessions."""
+    return TaskCompletionStore()
+
+@st.cache_resource
+def get_callback_token():
+    """Return this process's secret callback token, sent in every callBackUrl."""
+    return secrets.token_urlsafe(24)
+
+class CallbackRequestHandler(BaseHTTPRequestHandler):
+    """Accept KIE.ai callBackUrl POSTs and record them in the completion store.
+
+    Requests must carry the process's callback token in the ``token`` query
+    parameter. Posts to ``CALLBACK_TEST_PATH`` go to a separate test store so
+    test payloads never reach real tasks.
+    """
+    
+    max_body_bytes = 1024 * 1024
+    
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path not in (CALLBACK_PATH, CALLBACK_TEST_PATH):
+            self._respond(404, {"code": 404, "msg": "Not found"})
+            return
+        token = parse_qs(url.query).get('token', [''])[0]
+        if not hmac.compare_digest(token.encode('utf-8'), self.server.callback_token.encode('utf-8')):
+            self._respond(403, {"code": 403, "msg": "Forbidden"})
+            return
+        
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length <= 0 or length > self.max_body_bytes:
+                raise ValueError("Invalid body size")
+            payload = json.loads(self.rfile.read(length).decode('utf-8'))
+            task_data = payload.get("data") or {}
+            task_id = task_data.get("taskId")
+            if not task_id:
+                raise ValueError("Missing taskId")
+        except Exception as e:
+            self._respond(400, {"code": 400, "msg": str(e)})
+            return
+        
+        store = self.server.test_store if url.path == CALLBACK_TEST_PATH else self.server.completion_store
+        store.record(task_id, task_data)
+        self._respond(200, {"code": 200, "msg": "success"})
+    
+    def _respond(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def log_message(self, format, *args):
+        pass
+
+@st.cache_resource
+def start_callback_receiver(host=CALLBACK_RECEIVER_HOST, port=CALLBACK_RECEIVER_PORT):
+    """Start the local callback receiver once per process and return the server."""
+    server = ThreadingHTTPServer((host, port), CallbackRequestHandler)
+    server.daemon_threads = True
+    server.completion_store = get_completion_store()
+    server.test_store = TaskCompletionStore(max_entries=100)
+    server.callback_token = get_callback_token()
+    threading.Thread(target=server.serve_forever, name="kie-callback-receiver", daemon=True).start()
+    return server
+
+def get_callback_url():
+    """Return the public callback URL to send with new tasks, or None when callbacks are off."""
+    if st.session_state.get('callback_enabled') and st.session_state.get('callback_public_url'):
+        return with_callback_token(st.session_state.callback_public_url)
+    return None
+
+def with_callback_token(url):
+    """Append the process's callback token to a receiver URL."""
+    separator = '&' if '?' in url else '?'
+    return f"{url}{separator}{urlencode({'token': get_callback_token()})}"
+
+def displayed_task_status(task):
+    """Return a task's status for history views, preferring a callback that arrived since the last poll."""
+    if task.get('status') in ACTIVE_TASK_STATUSES:
+        task_data = get_completion_store().get(task['id'])
+        if task_data and task_data.get('state'):
+            return task_data['state']
+    return task.get('status', '')
+
+def send_test_callback(callback_url, task_id, state="success", result_urls=None):
+    """Post a KIE.ai-shaped completion payload to a callback receiver (local stand-in sender)."""
+    payload = {
+        "code": 200,
+        "msg": "success",
+        "data": {
+            "taskId": task_id,
+            "state": state,
+            "resultJson": json.dumps({"resultUrls": result_urls or []}),
+            "failMsg": "" if state == "success" else "Test failure"
+        }
+    }
+    try:
+        response = get_http_session().post(callback_url, json=payload, timeout=10)
+        return response.status_code == 200, f"HTTP {response.status_code}"
+    except Exception as e:
+        return False, str(e)
+
+def check_task_statuses(api_key, task_ids, executor, remote=True, store=None):
+    """Resolve the status of several tasks in one pass.
+
+    Tasks that already delivered a callback are answered from the completion
+    store. The rest are checked with recordInfo concurrently, unless
+    ``remote`` is False.
+    """
+    if store is None:
+        store = get_completion_store()
+    statuses = {}
+    remote_ids = []
+    for task_id in task_ids:
+        task_data = store.get(task_id)
+        if task_data is not None:
+            statuses[task_id] = {"success": True, "data": task_data}
+        elif remote:
+            remote_ids.append(task_id)
+    
+    futures = {executor.submit(check_task_status, api_key, task_id): task_id for task_id in remote_ids}
+    for future in as_completed(futures):
+        statuses[futures[future]] = future.result()
+    return statuses
+
+def extract_result_urls(task_data):
+    """Get the result image URLs from a recordInfo payload."""
+    result_urls = task_data.get("result") or []
+    if not result_urls and task_data.get("resultJson"):
+        try:
+            result_urls = json.loads(task_data["resultJson"]).get("resultUrls", [])
+        except (json.JSONDecodeError, TypeError, AttributeError):
+            result_urls = []
+    return result_urls
+
+def get_active_task_ids(include_jobs=True):
+    """Return the IDs of tasks in history that have not finished yet.
+
+    With ``include_jobs=False`` tasks owned by the background job runner are
+    left out.
+    """
+    return [
+        task['id'] for task in st.session_state.task_history
+        if task.get('status') in ACTIVE_TASK_STATUSES and (include_jobs or not task.get('job_id'))
+    ]
+
+def _next_poll_interval(state, previous_state, previous_interval):
+    """Pick the delay before the next status check of a task.
+
+    Each state has its own base interval; while a task stays in the same
+    state the interval backs off by 1.5x up to ``POLL_MAX_INTERVAL``.
+    """
+    base_interval = POLL_BASE_INTERVALS.get(state, POLL_BASE_INTERVALS['waiting'])
+    if state != previous_state or not previous_interval:
+        return base_interval
+    return min(previous_interval * 1.5, POLL_MAX_INTERVAL)
+
+@st.cache_resource
+def get_status_executor():
+    """Return the process-wide pool that checks task statuses for the session poller."""
+    return ThreadPoolExecutor(max_workers=BATCH_MAX_CONCURRENCY, thread_name_prefix="task-status")
+
+@st.cache_resource
+def get_result_executor():
+    """Return the process-wide pool that uploads the results of tasks finished by the session poller.
+
+    ``process_task_results`` waits on the upload pool, so it runs here rather
+    than in the upload pool itself.
+    """
+    return ThreadPoolExecutor(max_workers=JOB_RUNNER_MAX_WORKERS, thread_name_prefix="task-results")
+
+def collect_task_results():
+    """Apply the results of finished tasks whose upload completed since the last tick.
+
+    Returns the list of state changes.
+    """
+    pending = st.session_state.pending_results
+    changes = []
+    for task in st.session_state.task_history:
+        entry = pending.get(task['id'])
+        if entry is None or not entry[0].done():
+            continue
+        future, result_urls = pending.pop(task['id'])
+        previous_state = task.get('status')
+        try:
+            record_task_results(task, result_urls, future.result(), task.get('tags', ""))
+        except Exception as e:
+            task['status'] = 'fail'
+            task['error'] = f"Result upload failed: {str(e)}"
+            st.session_state.stats['failed_tasks'] += 1
+        changes.append({'task_id': task['id'], 'prompt': task['prompt'], 'old_state': previous_state, 'new_state': task['status']})
+    return changes
+
+def poll_active_tasks(api_key):
+    """Run one poller tick over in-flight tasks not owned by the job runner.
+
+    Only tasks whose backoff has expired are checked, and those checks run
+    concurrently, so status traffic follows the number of active jobs rather
+    than the number of script reruns. Tasks that delivered a callback are
+    resolved from the completion store without a request; while callbacks are
+    enabled, the rest are polled only every ``CALLBACK_FALLBACK_DELAY`` seconds.
+    Finished tasks are uploaded in the background and applied by a later
+    tick. Returns the list of state changes.
+    """
+    changes = collect_task_results()
+    poll_state = st.session_state.task_poll_state
+    pending = st.session_state.pending_results
+    active_ids = [task_id for task_id in get_active_task_ids(include_jobs=False) if task_id not in pending]
+    
+    for task_id in list(poll_state):
+        if task_id not in active_ids:
+            del poll_state[task_id]
+    
+    now = time.time()
+    callbacks_enabled = get_callback_url() is not None
+    if callbacks_enabled:
+        for task_id in active_ids:
+            poll_state.setdefault(task_id, {'state': None, 'interval': None, 'next_check': now + CALLBACK_FALLBACK_DELAY})
+    
+    store = get_completion_store()
+    due_ids = [
+        task_id for task_id in active_ids
+        if store.get(task_id) is not None or poll_state.get(task_id, {}).get('next_check', 0) <= now
+    ]
+    if not api_key or not due_ids:
+        return changes
+    
+    statuses = check_task_statuses(api_key, due_ids, get_status_executor())
+    
+    for task in st.session_state.task_history:
+        task_id = task['id']
+        if task_id not in statuses:
+            continue
+        
+        entry = poll_state.setdefault(task_id, {'state': task.get('status'), 'interval': None})
+        status = statuses[task_id]
+        if not status["success"]:
+            entry['interval'] = min((entry['interval'] or POLL_BASE_INTERVALS['waiting']) * 1.5, POLL_MAX_INTERVAL)
+            entry['next_check'] = now + max(entry['interval'], CALLBACK_FALLBACK_DELAY if callbacks_enabled else 0)
+            continue
+        
+        task_data = status["data"]
+        state = task_data.get("state", entry['state'])
+        previous_state = task.get('status')
+        
+        if state == "success":
+            result_urls = extract_result_urls(task_data)
+            future = get_result_executor().submit(
+                process_task_results, build_session_job_context(), task_id, task['model'], task['prompt'],
+                result_urls, task.get('tags', "")
+            )
+            pending[task_id] = (future, result_urls)
+            task['status'] = state = 'uploading'
+        elif state == "fail":
+            task['status'] = 'fail'
+            task['error'] = task_data.get('failMsg', 'Unknown error')
+            st.session_state.stats['failed_tasks'] += 1
+        else:
+            task['status'] = state
+            entry['interval'] = _next_poll_interval(state, entry['state'], entry['interval'])
+            entry['next_check'] = now + max(entry['interval'], CALLBACK_FALLBACK_DELAY if callbacks_enabled else 0)
         
-        if result["success"]:
-            task_data = result["data"]
-            state = task_data["state"]
-            
-            progress = min((attempt + 1) / max_attempts, 0.95)
-            progress_bar.progress(progress)
-            status_text.text(f"Status: {state} | Attempt {attempt + 1}/{max_attempts}")
-            
-            if state == "success":
-                progress_bar.progress(1.0)
-                status_text.text("✅ Task completed successfully!")
-                return {"success": True, "data": task_data}
-            elif state == "fail":
-                progress_bar.empty()
-                status_text.text("❌ Task failed")
+        entry['state'] = state
+        if state != previous_state:
+            changes.append({'task_id': task_id, 'prompt': task['prompt'], 'old_state': previous_state, 'new_state': state})
+    
+    return changes
+
+def process_task_result(context, task_id, model, prompt, index, result_url, tags=""):
+    """Download, upload and log a single task result.
+
+    Runs in an upload worker with that thread's own Drive/Sheets clients and
+    returns a record with the per-step timings and final status.
+    """
+    file_name = f"{model.replace('/', '_')}_{task_id}_{index+1}.png"
+    record = {
+        'result_url': result_url,
+        'file_name': file_name,
+        'upload_info': None,
+        'drive_link': "",
+        'logged': False,
+        'status': 'local',
+        'timings': {},
+        'elapsed': 0.0,
+        'errors': []
+    }
+    started = time.perf_counter()
+    
+    drive_service = None
+    if context.get('credentials') and context.get('auto_upload'):
+        try:
+            drive_service, _ = get_thread_google_services(context['credentials'])
+        except Exception as e:
+            record['errors'].append(f"Google services unavailable: {str(e)}")
+    
+    if context.get('auto_upload') and drive_service and context.get('folder_id'):
+        try:
+            record['upload_info'] = upload_url_to_drive(
+                drive_service, context['folder_id'], result_url, file_name, task_id, record['timings'], grant_permission=False,
+                owner=getattr(context['credentials'], 'cache_identity', None)
+            )
+            record['drive_link'] = record['upload_info'].get('web_link', '')
+            record['status'] = 'uploaded'
+        except Exception as e:
+            if is_not_found_error(e):
+                get_resolved_resources().forget(context['folder_id'])
+                record['missing_folder_id'] = context['folder_id']
+            record['errors'].append(f"Drive upload failed: {str(e)}")
+        
+        if record['upload_info']:
+            try:
+                get_metadata_index().record_upload(context['folder_id'], record['upload_info'], model, prompt)
+            except Exception as e:
+                record['errors'].append(f"Library index update failed: {str(e)}")
+    
+    if context.get('auto_log_sheets') and context.get('credentials') and context.get('spreadsheet_id'):
+        log_started = time.perf_counter()
+        try:
+            row = build_log_row(model, prompt, result_url, record['drive_link'], task_id, "success", tags)
+            get_log_buffer().add(context['credentials'], context['spreadsheet_id'], SHEETS_LOG_RANGE, [row])
+            record['logged'] = True
+        except Exception as e:
+            record['errors'].append(f"Sheets logging failed: {str(e)}")
+        record['timings']['log'] = time.perf_counter() - log_started
+    
+    if record['errors']:
+        record['status'] = 'failed'
+    record['elapsed'] = time.perf_counter() - started
+    return record
+
+@st.cache_resource
+def get_upload_executor():
+    """Return the process-wide pool that uploads task results.
+
+    Its threads live as long as the process, so the Drive and Sheets clients
+    they build with ``get_thread_google_services`` are reused across tasks.
+    """
+    return ThreadPoolExecutor(max_workers=UPLOAD_POOL_WORKERS, thread_name_prefix="drive-upload")
+
+def process_task_results(context, task_id, model, prompt, result_urls, tags=""):
+    """Upload and log every result of a finished task without touching session state.
+
+    Results are handled on the shared upload pool with at most
+    ``context['upload_concurrency']`` of them in flight, so downloads, uploads
+    and permission grants of different results overlap. Public read access for all uploaded files is then granted in
+    one Drive batch request. ``context`` carries the credentials and settings
+    of the session that owns the task. Returns one record per result URL, in
+    input order.
+    """
+    if not result_urls:
+        return []
+    
+    max_in_flight = max(1, min(context.get('upload_concurrency') or UPLOAD_MAX_CONCURRENCY, UPLOAD_POOL_WORKERS))
+    executor = get_upload_executor()
+    records = [None] * len(result_urls)
+    pending = {}
+    queued = list(enumerate(result_urls))
+    queued.reverse()
+    while queued or pending:
+        while queued and len(pending) < max_in_flight:
+            index, result_url = queued.pop()
+            future = executor.submit(process_task_result, context, task_id, model, prompt, index, result_url, tags)
+            pending[future] = index
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            records[pending.pop(future)] = future.result()
+    
+    uploaded = {record['upload_info']['file_id']: record for record in records if record['upload_info']}
+    if uploaded:
+        started = time.perf_counter()
+        try:
+            drive_service, _ = get_thread_google_services(context['credentials'])
+            errors = grant_public_read_batch(drive_service, list(uploaded))
+        except Exception as e:
+            errors = {file_id: e for file_id in uploaded}
+        elapsed = time.perf_counter() - started
+        
+        for file_id, record in uploaded.items():
+            record['timings']['permission'] = elapsed
+            if errors.get(file_id) is not None:
+                record['errors'].append(f"Sharing failed: {str(errors[file_id])}")
+                record['status'] = 'failed'
+    
+    return records
+
+def record_task_results(task, result_urls, records, tags=""):
+    """Apply processed results of a task to history, stats, library and CSV."""
+    task['status'] = 'success'
+    task['results'] = result_urls
+    task['result_report'] = [
+        {
+            'file_name': record['file_name'],
+            'status': record['status'],
+            'elapsed': record['elapsed'],
+            'timings': record['timings'],
+            'errors': record['errors']
+        }
+        for record in records
+    ]
+    st.session_state.stats['successful_tasks'] += 1
+    st.session_state.stats['total_images'] += len(result_urls)
+    
+    for record in records:
+        if record.get('missing_folder_id') and record['missing_folder_id'] == st.session_state.gdrive_folder_id:
+            # The app folder was deleted; resolve it again for the next task
+            st.session_state.gdrive_folder_id = None
+        if record['upload_info']:
+            st.session_state.library_images.insert(0, record['upload_info'])
+            st.session_state.stats['uploaded_images'] += 1
+        if record['logged']:
+            st.session_state.stats['sheets_entries'] += 1
+        add_to_csv_data(task['model'], task['prompt'], record['result_url'], record['drive_link'], task['id'], "success", tags)
+
+def build_session_job_context():
+    """Capture what a task needs from this session to be processed off the script thread."""
+    context = {
+        'api_key': st.session_state.api_key,
+        'callback_url': get_callback_url(),
+        'credentials': None,
+        'folder_id': None,
+        'spreadsheet_id': None,
+        'auto_upload': False,
+        'auto_log_sheets': False,
+        'upload_concurrency': st.session_state.upload_concurrency
+    }
+    if st.session_state.authenticated:
+        context['credentials'] = st.session_state.credentials
+        context['auto_upload'] = st.session_state.auto_upload
+        context['auto_log_sheets'] = st.session_state.auto_log_sheets
+        context['folder_id'] = st.session_state.gdrive_folder_id or create_app_folder()
+        if st.session_state.auto_log_sheets:
+            context['spreadsheet_id'] = st.session_state.spreadsheet_id or create_or_get_spreadsheet()
+    return context
+
+class JobRunner:
+    """Background worker that owns task submission, polling, Drive upload and Sheets logging.
+
+    Jobs live in the runner rather than in a session, so the Streamlit script
+    never blocks on them. A single poller thread checks every in-flight job
+    per tick with per-state backoff; sessions only read job snapshots through
+    ``jobs_for``.
+    """
+    
+    def __init__(self, completion_store, max_workers=JOB_RUNNER_MAX_WORKERS):
+        self.completion_store = completion_store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job-runner")
+        self._status_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_CONCURRENCY, thread_name_prefix="job-status")
+        self._jobs = {}
+        self._lock = threading.RLock()
+        self._poll_thread = None
+    
+    def submit(self, owner, model, prompt, input_params, context, tags=""):
+        """Queue a generation job and return its job ID."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'owner': owner,
+                'model': model,
+                'prompt': prompt,
+                'input_params': input_params,
+                'tags': tags,
+                'context': context,
+                'status': 'queued',
+                'progress': JOB_PROGRESS['queued'],
+                'task_id': None,
+                'results': [],
+                'records': [],
+                'error': None,
+                'interval': None,
+                'next_check': 0,
+                'created_at': now,
+                'updated_at': now
+            }
+            if self._poll_thread is None:
+                self._poll_thread = threading.Thread(target=self._poll_loop, name="job-runner-poller", daemon=True)
+                self._poll_thread.start()
+        self._executor.submit(self._submit_task, job_id)
+        return job_id
+    
+    def jobs_for(self, owner):
+        """Return snapshots of the jobs that belong to one session, without their context."""
+        with self._lock:
+            cutoff = time.time() - JOB_RETENTION_SECONDS
+            for job_id in [job_id for job_id, job in self._jobs.items() if job['status'] in ('success', 'fail') and job['updated_at'] < cutoff]:
+                del self._jobs[job_id]
+            return [self._snapshot(job) for job in self._jobs.values() if job['owner'] == owner]
+    
+    def job_for_task(self, task_id):
+        """Return a snapshot of the job that submitted a KIE task, or None if the runner has none."""
+        with self._lock:
+            job = next((job for job in self._jobs.values() if job['task_id'] == task_id), None)
+            return self._snapshot(job) if job else None
+    
+    def transfer(self, owner, new_owner):
+        """Hand every job of one owner to another."""
+        with self._lock:
+            for job in self._jobs.values():
+                if job['owner'] == owner:
+                    job['owner'] = new_owner
+    
+    @staticmethod
+    def _snapshot(job):
+        return {key: value for key, value in job.items() if key != 'context'}
+    
+    def _update(self, job_id, **changes):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(changes)
+            if 'status' in changes:
+                job['progress'] = JOB_PROGRESS.get(changes['status'], job['progress'])
+                if changes['status'] in ('success', 'fail'):
+                    # Finished jobs no longer need the session's API key and credentials
+                    job['context'] = None
+            job['updated_at'] = time.time()
+            return dict(job)
+    
+    def _submit_task(self, job_id):
+        job = self._update(job_id, status='submitting')
+        context = job['context']
+        result = submit_task_request(context['api_key'], job['model'], job['input_params'], context.get('callback_url'))
+        if not result["success"]:
+            self._update(job_id, status='fail', error=result['error'])
+            return
+        
+        first_delay = CALLBACK_FALLBACK_DELAY if context.get('callback_url') else POLL_BASE_INTERVALS['waiting']
+        self._update(job_id, status='waiting', task_id=result['task_id'], submitted_at=time.time(), next_check=time.time() + first_delay)
+    
+    def _poll_loop(self):
+        while True:
+            time.sleep(JOB_RUNNER_TICK_SECONDS)
+            try:
+                self._poll_tick()
+            except Exception:
+                logger.exception("Job runner poll tick failed")
+    
+    def _poll_tick(self):
+        now = time.time()
+        with self._lock:
+            polling = [dict(job) for job in self._jobs.values() if job['task_id'] and job['status'] in ('waiting', 'queuing', 'generating', 'uploading')]
+        
+        due = {}
+        for job in polling:
+            if job['status'] == 'uploading':
+                # Uploads get their own timeout, counted from when the task finished
+                if now - job['uploading_at'] > JOB_TIMEOUT_SECONDS:
+                    self._update(job['job_id'], status='fail', error="Upload timed out")
+            elif now - job['submitted_at'] > JOB_TIMEOUT_SECONDS:
+                self._update(job['job_id'], status='fail', error="Timeout reached")
+            elif job['next_check'] <= now or self.completion_store.get(job['task_id']) is not None:
+                due.setdefault(job['context']['api_key'], []).append(job)
+        
+        for api_key, jobs in due.items():
+            statuses = check_task_statuses(api_key, [job['task_id'] for job in jobs], self._status_executor, store=self.completion_store)
+            for job in jobs:
+                self._apply_status(job, statuses.get(job['task_id']), now)
+    
+    def _apply_status(self, job, status, now):
+        callback_floor = CALLBACK_FALLBACK_DELAY if job['context'].get('callback_url') else 0
+        if not status or not status["success"]:
+            interval = min((job['interval'] or POLL_BASE_INTERVALS['waiting']) * 1.5, POLL_MAX_INTERVAL)
+            self._update(job['job_id'], interval=interval, next_check=now + max(interval, callback_floor))
+            return
+        
+        task_data = status["data"]
+        state = task_data.get("state", job['status'])
+        if state == "success":
+            self._update(job['job_id'], status='uploading', uploading_at=time.time())
+            self._executor.submit(self._finish_job, job['job_id'], extract_result_urls(task_data))
+        elif state == "fail":
+            self._update(job['job_id'], status='fail', error=task_data.get('failMsg', 'Unknown error'))
+        else:
+            interval = _next_poll_interval(state, job['status'], job['interval'])
+            self._update(job['job_id'], status=state, interval=interval, next_check=now + max(interval, callback_floor))
+    
+    def _finish_job(self, job_id, result_urls):
+        with self._lock:
+            job = dict(self._jobs[job_id])
+        
+        try:
+            records = process_task_results(job['context'], job['task_id'], job['model'], job['prompt'], result_urls, job['tags'])
+        except Exception as exc:
+            logger.exception("Finishing job %s failed", job_id)
+            changes = {'status': 'fail', 'error': str(exc)}
+        else:
+            changes = {'status': 'success', 'results': result_urls, 'records': records}
+        with self._lock:
+            if self._jobs[job_id]['status'] == 'uploading':  # Otherwise it timed out meanwhile
+                self._update(job_id, **changes)
+
+@st.cache_resource
+def get_job_runner():
+    """Return the process-wide background job runner."""
+    return JobRunner(get_completion_store())
+
+def submit_background_job(model, prompt, input_params, tags="", extra=None):
+    """Queue a generation on the job runner and add it to this session's task history."""
+    job_id = get_job_runner().submit(
+        st.session_state.session_owner_id,
+        model,
+        prompt,
+        input_params,
+        build_session_job_context(),
+        tags
+    )
+    
+    task_entry = {
+        "id": job_id,
+        "job_id": job_id,
+        "model": model,
+        "prompt": prompt,
+        "status": "queued",
+        "progress": 0.0,
+        "created_at": datetime.now().isoformat(),
+        "results": [],
+        "tags": tags
+    }
+    task_entry.update(extra or {})
+    st.session_state.task_history.insert(0, task_entry)
+    return job_id
+
+def sync_background_jobs():
+    """Copy job runner state into this session's task history.
+
+    Finished jobs are applied to stats, library and CSV exactly once. Returns
+    the list of state changes since the last sync.
+    """
+    runner = get_job_runner()
+    jobs = {job['job_id']: job for job in runner.jobs_for(st.session_state.session_owner_id)}
+    changes = []
+    
+    for task in st.session_state.task_history:
+        job_id = task.get('job_id')
+        if not job_id or task.get('status') not in ACTIVE_TASK_STATUSES:
+            continue
+        
+        job = jobs.get(job_id)
+        if job is None and task['id'] != job_id:
+            job = runner.job_for_task(task['id'])
+        if job is None:
+            # The runner lost the job (e.g. the process restarted); hand real
+            # task IDs to the session poller and fail jobs never submitted.
+            if task['id'] != job_id:
+                task.pop('job_id')
+            else:
+                task['status'] = 'fail'
+                task['error'] = "Job was lost before it was submitted"
                 st.session_state.stats['failed_tasks'] += 1
-                return {"success": False, "error": task_data.get('failMsg', 'Unknown error'), "data": task_data}
-            
-            time.sleep(delay)
+            continue
+        
+        if job['task_id'] and task['id'] != job['task_id']:
+            if st.session_state.current_task == task['id']:
+                st.session_state.current_task = job['task_id']
+            task['id'] = job['task_id']
+            st.session_state.stats['total_tasks'] += 1
+        task['progress'] = job['progress']
+        
+        previous_status = task['status']
+        if job['status'] == previous_status:
+            continue
+        
+        if job['status'] == 'success':
+            record_task_results(task, job['results'], job['records'], job.get('tags', ""))
+        elif job['status'] == 'fail':
+            task['status'] = 'fail'
+            task['error'] = job['error']
+            st.session_state.stats['failed_tasks'] += 1
         else:
-            status_text.text(f"⚠️ Error checking status: {result['error']}")
-            time.sleep(delay)
-    
-    progress_bar.empty()
-    status_text.text("⏱️ Timeout reached")
-    st.session_state.stats['failed_tasks'] += 1
-    return {"success": False, "error": "Timeout reached"}
-
-
-def save_and_upload_results(task_id, model, prompt, result_urls, tags=""):
-    """Save results to history, upload to Drive, log to Sheets, and add to CSV."""
-    for i, task in enumerate(st.session_state.task_history):
-        if task['id'] == task_id:
-            st.session_state.task_history[i]['status'] = 'success'
-            st.session_state.task_history[i]['results'] = result_urls
-            st.session_state.stats['successful_tasks'] += 1
-            st.session_state.stats['total_images'] += len(result_urls)
-            
-            for j, result_url in enumerate(result_urls):
-                file_name = f"{model.replace('/', '_')}_{task_id}_{j+1}.png"
-                drive_link = ""
-                
-                if st.session_state.authenticated and st.session_state.auto_upload:
-                    upload_info = upload_to_gdrive(result_url, file_name, task_id)
-                    if upload_info:
-                        st.session_state.library_images.insert(0, upload_info)
-                        drive_link = upload_info.get('web_link', '')
-                        st.success(f"✅ Uploaded {file_name} to Google Drive!")
-                
-                if st.session_state.authenticated and st.session_state.auto_log_sheets:
-                    if log_to_sheets(model, prompt, result_url, drive_link, task_id, "success", tags):
-                        st.success(f"📊 Logged to Google Sheets!")
-                
-                add_to_csv_data(model, prompt, result_url, drive_link, task_id, "success", tags)
-            
-            break
+            task['status'] = job['status']
+        
+        changes.append({'task_id': task['id'], 'prompt': task['prompt'], 'old_state': previous_status, 'new_state': task['status']})
+    
+    return changes
+
+def _persisted_items(kind, value):
+    """Split a session value into ``(key, item)`` pairs for row-wise storage."""
+    if kind == 'dict':
+        return [(str(key), item) for key, item in value.items()]
+    if kind == 'list':
+        items = []
+        seen = set()
+        for index, item in enumerate(value):
+            key = item.get('id') if isinstance(item, dict) else None
+            key = str(key) if key is not None and str(key) not in seen else f"#{index}"
+            seen.add(key)
+            items.append((key, item))
+        return items
+    return [('', value)]
+
+def _add_counts(total, delta, sign=1):
+    """Add (or with ``sign=-1`` subtract) the numbers of nested stat dicts; other values keep ``total``'s."""
+    result = dict(total)
+    for key, value in delta.items():
+        if isinstance(value, dict):
+            result[key] = _add_counts(result.get(key) or {}, value, sign)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            result[key] = (result.get(key) or 0) + sign * value
+        else:
+            result.setdefault(key, value)
+    return result
+
+def _item_ordinals(items, known):
+    """Return the stored ``seq`` of every item: known keys keep theirs, new ones are stamped from the clock.
+
+    Items ahead of every known one were inserted at the front and get
+    ordinals above the current time in milliseconds; later ones were appended
+    and get ordinals below its negation. Rows written by different sessions,
+    or before the session connected, therefore sort by when they were added.
+    """
+    now = int(time.time() * 1000)
+    top = max(max(known.values(), default=0), now)
+    bottom = min(min(known.values(), default=0), -now)
+    first_known = next((i for i, (key, _) in enumerate(items) if key in known), len(items))
+    ordinals = {}
+    for i, (key, _) in enumerate(items):
+        if key in known:
+            ordinals[key] = known[key]
+        elif i < first_known:
+            ordinals[key] = top + first_known - i
+        else:
+            bottom -= 1
+            ordinals[key] = bottom
+    return ordinals
+
+def stamp_persisted_items():
+    """Give new items of persisted collections their ordinal, whether or not an account is connected."""
+    ordinals = st.session_state.setdefault('persisted_ordinals', {})
+    for collection, kind in PERSISTED_STATE.items():
+        if kind == 'counters':
+            continue
+        items = _persisted_items(kind, st.session_state.get(collection) or ({} if kind == 'dict' else []))
+        ordinals[collection] = _item_ordinals(items, ordinals.get(collection, {}))
+
+def persistence_profile():
+    """Return the store profile of the connected service account, or None when not connected.
+
+    State is only persisted for a connected account, so sessions of different
+    accounts never see each other's history.
+    """
+    identity = google_identity()
+    return f"{PERSISTENCE_PROFILE}:{identity}" if identity else None
+
+def restore_persisted_state(profile):
+    """Load a profile's persisted collections into the session and seed its change fingerprints.
+
+    Runs lazily, the first time a session is attached to a profile. Items the
+    session created before connecting are kept and written to the profile,
+    placed among the stored items by the ordinal they were stamped with.
+    Counter collections are stored as one row per profile. The job owner ID
+    is stored too, so a reloaded session finds its runner jobs again.
+    """
+    store = get_state_store(STATE_DB_PATH)
+    merge = st.session_state.get('persisted_profile') is None
+    owner = st.session_state.session_owner_id
+    stamped = st.session_state.get('persisted_ordinals', {}) if merge else {}
+    fingerprints = {}
+    ordinals = {}
+    for collection, kind in PERSISTED_STATE.items():
+        rows = store.load(profile, collection)
+        current = st.session_state.get(collection)
+        if kind == 'counters':
+            baseline = {}
+            for _, _, data in rows:
+                baseline = _add_counts(baseline, json.loads(data))
+            if any(key != '' for key, _, _ in rows):
+                # Fold the per-session rows written by earlier versions into the profile row
+                store.apply(profile, collection, [('', 0, json.dumps(baseline))], [key for key, _, _ in rows if key != ''])
+            counts = current or {}
+            if not merge:
+                counts = _add_counts(counts, counts, -1)  # Keep the default keys, drop the previous account's counts
+            st.session_state[collection] = _add_counts(counts, baseline)
+            st.session_state[f"persisted_{collection}_baseline"] = baseline
+            fingerprints[collection] = {}
+            continue
+        
+        fingerprints[collection] = {key: (seq, hash(data)) for key, seq, data in rows}
+        ordinals[collection] = {key: seq for key, seq, _ in rows}
+        if kind == 'list':
+            loaded = [(seq, json.loads(data)) for _, seq, data in rows]
+            if merge and current:
+                loaded_keys = {key for key, _, _ in rows}
+                for key, item in _persisted_items(kind, current):
+                    if key not in loaded_keys:
+                        seq = stamped.get(collection, {}).get(key, 0)
+                        loaded.append((seq, item))
+                        ordinals[collection][key] = seq
+                loaded.sort(key=lambda entry: entry[0], reverse=True)
+            st.session_state[collection] = [item for _, item in loaded]
+        elif kind == 'dict':
+            loaded = {key: json.loads(data) for key, _, data in rows}
+            if merge and current:
+                loaded = {**current, **loaded}
+            st.session_state[collection] = loaded
+        elif rows:
+            st.session_state[collection] = json.loads(rows[0][2])
+    if merge and st.session_state.session_owner_id != owner:
+        # Jobs submitted before connecting move to the profile's owner ID
+        get_job_runner().transfer(owner, st.session_state.session_owner_id)
+    st.session_state.persisted_fingerprints = fingerprints
+    st.session_state.persisted_ordinals = ordinals
+    st.session_state.persisted_profile = profile
+
+def persist_session_state():
+    """Write only the rows of persisted collections that changed since the last call.
+
+    Until an account is connected only new items are stamped with their
+    ordinal; the first call for an account restores its stored state.
+    """
+    stamp_persisted_items()
+    profile = persistence_profile()
+    if profile is None:
+        return
+    if st.session_state.get('persisted_profile') != profile:
+        restore_persisted_state(profile)
+        stamp_persisted_items()  # Dict items merged from before connecting
+    
+    store = get_state_store(STATE_DB_PATH)
+    fingerprints = st.session_state.persisted_fingerprints
+    for collection, kind in PERSISTED_STATE.items():
+        if kind == 'counters':
+            # Add what this session counted since its last write to the profile's row
+            counts = st.session_state.get(collection) or {}
+            baseline_key = f"persisted_{collection}_baseline"
+            baseline = st.session_state.get(baseline_key) or {}
+            if counts != baseline:
+                delta = _add_counts(counts, baseline, -1)
+                store.update(profile, collection, '', lambda data: json.dumps(_add_counts(json.loads(data) if data else {}, delta)))
+                st.session_state[baseline_key] = _add_counts({}, counts)
+            continue
+        
+        previous = fingerprints.setdefault(collection, {})
+        items = _persisted_items(kind, st.session_state.get(collection) or ({} if kind == 'dict' else []))
+        seqs = st.session_state.persisted_ordinals[collection]
+        upserts = []
+        current = {}
+        for key, item in items:
+            data = json.dumps(item, default=str)
+            current[key] = (seqs[key], hash(data))
+            if previous.get(key) != current[key]:
+                upserts.append((key, seqs[key], data))
+        deletes = [key for key in previous if key not in current]
+        if upserts or deletes:
+            store.apply(profile, collection, upserts, deletes)
+            fingerprints[collection] = current
 
 def add_tag_to_image(image_id, tag):
     """Add a tag to an image."""
@@ -876,11 +2197,13 @@ def add_tag_to_image(image_id, tag):
     
     if tag not in st.session_state.tags[image_id]:
         st.session_state.tags[image_id].append(tag)
+        get_metadata_index().add_tag(google_identity(), image_id, tag)
 
 def remove_tag_from_image(image_id, tag):
     """Remove a tag from an image."""
     if image_id in st.session_state.tags and tag in st.session_state.tags[image_id]:
         st.session_state.tags[image_id].remove(tag)
+        get_metadata_index().remove_tag(google_identity(), image_id, tag)
 
 def get_image_tags(image_id):
     """Get all tags for an image."""
@@ -899,13 +2222,39 @@ def remove_from_comparison(image_id):
         img for img in st.session_state.comparison_images if img.get('id') != image_id
     ]
 
+@st.fragment(run_every=TASK_MONITOR_REFRESH_SECONDS)
+def display_task_monitor():
+    """Refresh in-flight tasks on a timer and publish their state changes.
+
+    Runner-owned jobs are only read from the job runner; other tasks are
+    polled by the session poller.
+    """
+    changes = sync_background_jobs() + poll_active_tasks(st.session_state.api_key)
+    
+    for change in changes:
+        icon = {"success": "✅", "fail": "❌"}.get(change['new_state'], "⏳")
+        st.toast(f"{icon} {change['prompt'][:40]}... → {change['new_state']}")
+    
+    active_tasks = [task for task in st.session_state.task_history if task.get('status') in ACTIVE_TASK_STATUSES]
+    if active_tasks:
+        st.info(f"⏳ {len(active_tasks)} task(s) in progress. Status updates automatically.")
+        for task in active_tasks[:10]:
+            st.progress(task.get('progress', 0.0), text=f"{task['model']} - {task['prompt'][:40]}... [{task['status']}]")
+    
+    persist_session_state()
+    if any(change['new_state'] in ("success", "fail") for change in changes):
+        st.rerun()
+
 # Helper function to display a Google Drive image from file_info dictionary
-def display_gdrive_image(file_info, caption="", width=150):
-    """Displays an image from Google Drive file info."""
+def display_gdrive_image(file_info, caption="", width=150, thumbnail=False):
+    """Displays an image from Google Drive file info, as a cached thumbnail when ``thumbnail`` is set."""
     if not st.session_state.service or not file_info or not file_info.get('id'):
         return
     
-    image_bytes = get_gdrive_image_bytes(file_info['id'])
+    if thumbnail:
+        image_bytes = get_gdrive_thumbnail(file_info)
+    else:
+        image_bytes = get_gdrive_image_bytes(file_info['id'], file_info.get('modifiedTime'))
     if image_bytes:
         st.image(image_bytes, caption=caption, use_container_width=True, width=width)
     else:
@@ -984,21 +2333,31 @@ def display_generate_page():
                     if use_library_images:
                         st.markdown("**Select up to 8 images from your library:**")
                         
-                        # Create a grid for image selection
-                        valid_images = [img for img in st.session_state.library_images if img and 'id' in img]
+                        nano_search = st.text_input(
+                            "🔍 Search library (name or prompt)",
+                            key="nano_library_search",
+                            placeholder="Leave empty for the newest images"
+                        )
+                        
+                        # Query the metadata index for the newest matches instead of scanning the whole library
+                        valid_images, _ = get_metadata_index().query(
+                            st.session_state.gdrive_folder_id, search=nano_search, limit=20
+                        )
+                        for img in valid_images:
+                            img['public_image_url'] = f"https://drive.google.com/uc?export=view&id={img['id']}"
                         
                         if valid_images:
                             selected_image_ids = []
                             
                             # Display images in a grid with checkboxes
                             cols_per_row = 4
-                            for i, img in enumerate(valid_images[:20]):  # Show first 20 images
+                            for i, img in enumerate(valid_images):
                                 if i % cols_per_row == 0:
                                     cols = st.columns(cols_per_row)
                                 
                                 with cols[i % cols_per_row]:
                                     # Show thumbnail
-                                    display_gdrive_image(img, width=100)
+                                    display_gdrive_image(img, width=100, thumbnail=True)
                                     
                                     # Checkbox for selection
                                     is_selected = st.checkbox(
@@ -1019,7 +2378,7 @@ def display_generate_page():
                             if selected_image_ids:
                                 st.success(f"✅ {len(selected_image_ids)} image(s) selected")
                         else:
-                            st.info("No images in library. Upload images first!")
+                            st.info("No matching images in library." if nano_search else "No images in library. Upload images first!")
                     else:
                         # Manual URL input
                         st.markdown("**Enter image URLs (one per line):**")
@@ -1118,26 +2477,14 @@ def display_generate_page():
                         "num_inference_steps": num_steps
                     }
                 
-                with st.spinner("Creating task..."):
-                    result = create_task(st.session_state.api_key, model, input_params)
-                
-                if result["success"]:
-                    task_id = result["task_id"]
-                    st.success(f"✅ Task created successfully! Task ID: {task_id}")
-                    
-                    st.session_state.task_history.insert(0, {
-                        "id": task_id,
-                        "model": model,
-                        "prompt": prompt,
-                        "status": "waiting",
-                        "created_at": datetime.now().isoformat(),
-                        "results": [],
-                        "image_inputs": image_input_urls if model == "nano-banana-pro" else []
-                    })
-                    st.session_state.current_task = task_id
-                    st.rerun()
-                else:
-                    st.error(f"❌ Failed to create task: {result['error']}")
+                job_id = submit_background_job(
+                    model,
+                    prompt,
+                    input_params,
+                    extra={"image_inputs": image_input_urls if model == "nano-banana-pro" else []}
+                )
+                st.session_state.current_task = job_id
+                st.rerun()
 
     with tab2:
         st.header("✏️ Image Edit - Qwen Model")
@@ -1232,27 +2579,11 @@ def display_generate_page():
                     "output_format": "png"
                 }
                 
-                with st.spinner("Creating edit task..."):
-                    result = create_task(st.session_state.api_key, "qwen/image-edit", input_params)
-                
-                if result["success"]:
-                    task_id = result["task_id"]
-                    st.success(f"✅ Task created successfully! Task ID: {task_id}")
-                    
-                    st.session_state.task_history.insert(0, {
-                        "id": task_id,
-                        "model": "qwen/image-edit",
-                        "prompt": prompt,
-                        "status": "waiting",
-                        "created_at": datetime.now().isoformat(),
-                        "results": []
-                    })
-                    st.session_state.current_task = task_id
-                    st.session_state.selected_image_for_edit = None
-                    st.session_state.edit_mode = None
-                    st.rerun()
-                else:
-                    st.error(f"❌ Failed to create task: {result['error']}")
+                job_id = submit_background_job("qwen/image-edit", prompt, input_params)
+                st.session_state.current_task = job_id
+                st.session_state.selected_image_for_edit = None
+                st.session_state.edit_mode = None
+                st.rerun()
 
     with tab3:
         st.header("🎨 Image Edit - Seedream V4 Model")
@@ -1336,27 +2667,11 @@ def display_generate_page():
                     "max_images": max_images
                 }
                 
-                with st.spinner("Creating Seedream edit task..."):
-                    result = create_task(st.session_state.api_key, "bytedance/seedream-v4-edit", input_params)
-                
-                if result["success"]:
-                    task_id = result["task_id"]
-                    st.success(f"✅ Task created successfully! Task ID: {task_id}")
-                    
-                    st.session_state.task_history.insert(0, {
-                        "id": task_id,
-                        "model": "bytedance/seedream-v4-edit",
-                        "prompt": prompt,
-                        "status": "waiting",
-                        "created_at": datetime.now().isoformat(),
-                        "results": []
-                    })
-                    st.session_state.current_task = task_id
-                    st.session_state.selected_image_for_edit = None
-                    st.session_state.edit_mode = None
-                    st.rerun()
-                else:
-                    st.error(f"❌ Failed to create task: {result['error']}")
+                job_id = submit_background_job("bytedance/seedream-v4-edit", prompt, input_params)
+                st.session_state.current_task = job_id
+                st.session_state.selected_image_for_edit = None
+                st.session_state.edit_mode = None
+                st.rerun()
 
     with tab4:
         st.header("📤 Upload Your Images")
@@ -1394,7 +2709,8 @@ def display_generate_page():
                     progress_bar = st.progress(0)
                     status_text = st.empty()
                     
-                    success_count = 0
+                    pending_uploads = []
+                    duplicate_uploads = []
                     for idx, uploaded_file in enumerate(uploaded_files):
                         status_text.text(f"Uploading {uploaded_file.name}... ({idx + 1}/{len(uploaded_files)})")
                         
@@ -1406,39 +2722,40 @@ def display_generate_page():
                             
                             image_data = uploaded_file.getvalue()
                             
-                            mime_type = 'image/png'
-                            if uploaded_file.name.lower().endswith(('.jpg', '.jpeg')):
-                                mime_type = 'image/jpeg'
-                            elif uploaded_file.name.lower().endswith('.webp'):
-                                mime_type = 'image/webp'
+                            # Bytes already in the folder are linked to instead of uploaded again
+                            sha256, md5_checksum = content_digests(image_data)
+                            file = find_live_duplicate(st.session_state.service, folder_id, sha256, md5_checksum)
+                            is_duplicate = file is not None
                             
-                            file_metadata = {
-                                'name': uploaded_file.name,
-                                'parents': [folder_id]
-                            }
+                            if not is_duplicate:
+                                mime_type = 'image/png'
+                                if uploaded_file.name.lower().endswith(('.jpg', '.jpeg')):
+                                    mime_type = 'image/jpeg'
+                                elif uploaded_file.name.lower().endswith('.webp'):
+                                    mime_type = 'image/webp'
                             
-                            media = MediaIoBaseUpload(
-                                io.BytesIO(image_data),
-                                mimetype=mime_type,
-                                resumable=True
-                            )
+                                file_metadata = {
+                                    'name': uploaded_file.name,
+                                    'parents': [folder_id]
+                                }
                             
-                            file = st.session_state.service.files().create(
-                                body=file_metadata,
-                                media_body=media,
-                                fields='id, name, webViewLink, webContentLink, mimeType, createdTime, size'
-                            ).execute()
+                                media = MediaIoBaseUpload(
+                                    io.BytesIO(image_data),
+                                    mimetype=mime_type,
+                                    resumable=True
+                                )
                             
-                            file_id = file.get('id')
+                                file = st.session_state.service.files().create(
+                                    body=file_metadata,
+                                    media_body=media,
+                                    fields='id, name, webViewLink, webContentLink, mimeType, createdTime, modifiedTime, size, md5Checksum'
+                                ).execute()
+                                get_metadata_index().record_upload(folder_id, file)
+                                get_metadata_index().record_content_hash(
+                                    folder_id, file.get('id'), sha256, file.get('md5Checksum') or md5_checksum
+                                )
                             
-                            permission = {
-                                'type': 'anyone',
-                                'role': 'reader'
-                            }
-                            st.session_state.service.permissions().create(
-                                fileId=file_id,
-                                body=permission
-                            ).execute()
+                            file_id = file.get('id')
                             
                             public_image_url = f"https://drive.google.com/uc?export=view&id={file_id}"
                             thumbnail_url = f"https://drive.google.com/thumbnail?id={file_id}&sz=w400"
@@ -1464,15 +2781,38 @@ def display_generate_page():
                                 'direct_link': f"https://lh3.googleusercontent.com/d/{file_id}"
                             }
                             
-                            st.session_state.library_images.insert(0, upload_info)
-                            st.session_state.stats['uploaded_images'] = st.session_state.stats.get('uploaded_images', 0) + 1
-                            success_count += 1
+                            if is_duplicate:
+                                duplicate_uploads.append(upload_info)
+                            else:
+                                pending_uploads.append(upload_info)
                             
                         except Exception as e:
                             st.error(f"Error uploading {uploaded_file.name}: {str(e)}")
                         
                         progress_bar.progress((idx + 1) / len(uploaded_files))
                     
+                    success_count = 0
+                    # Reused files are shared again too (granting is idempotent), so their links always work
+                    if pending_uploads or duplicate_uploads:
+                        status_text.text(f"Sharing {len(pending_uploads) + len(duplicate_uploads)} file(s)...")
+                        share_errors = grant_public_read_batch(
+                            st.session_state.service,
+                            [info['id'] for info in pending_uploads + duplicate_uploads]
+                        )
+                        for upload_info in duplicate_uploads:
+                            if share_errors.get(upload_info['id']) is not None:
+                                st.error(f"Error sharing {upload_info['name']}: {str(share_errors[upload_info['id']])}")
+                                continue
+                            st.info(f"ℹ️ {upload_info['name']} is already in your library; reusing the existing file")
+                            success_count += 1
+                        for upload_info in pending_uploads:
+                            if share_errors.get(upload_info['id']) is not None:
+                                st.error(f"Error sharing {upload_info['name']}: {str(share_errors[upload_info['id']])}")
+                                continue
+                            st.session_state.library_images.insert(0, upload_info)
+                            st.session_state.stats['uploaded_images'] = st.session_state.stats.get('uploaded_images', 0) + 1
+                            success_count += 1
+                    
                     progress_bar.empty()
                     status_text.empty()
                     
@@ -1617,15 +2957,114 @@ def display_library_page():
             st.session_state.current_page = "Generate"
             st.rerun()
         return
-
-    valid_images = [img for img in st.session_state.library_images if img and 'name' in img and 'id' in img]
     
-    st.markdown(f"**{len(valid_images)} images** in your library")
+    filter_col1, filter_col2, filter_col3, filter_col4 = st.columns([3, 1, 1, 1])
+    with filter_col1:
+        search_query = st.text_input(
+            "🔍 Search by name or prompt",
+            value=st.session_state.library_search_query,
+            placeholder="Enter search terms...",
+            key="library_search_input"
+        )
+    with filter_col2:
+        sort_by = st.selectbox(
+            "Sort by",
+            list(LIBRARY_SORT_OPTIONS),
+            index=list(LIBRARY_SORT_OPTIONS).index(st.session_state.library_sort_by),
+            format_func=LIBRARY_SORT_OPTIONS.get,
+            key="library_sort_select"
+        )
+    with filter_col3:
+        filter_type = st.selectbox(
+            "Type",
+            list(LIBRARY_FILTER_TYPES),
+            index=list(LIBRARY_FILTER_TYPES).index(st.session_state.library_filter_type),
+            format_func=LIBRARY_FILTER_TYPES.get,
+            key="library_type_select"
+        )
+    with filter_col4:
+        page_size = st.selectbox(
+            "Per page",
+            LIBRARY_GRID_PAGE_SIZES,
+            index=LIBRARY_GRID_PAGE_SIZES.index(st.session_state.library_page_size),
+            key="library_page_size_select"
+        )
+    
+    if (search_query, sort_by, filter_type, page_size) != (
+        st.session_state.library_search_query, st.session_state.library_sort_by,
+        st.session_state.library_filter_type, st.session_state.library_page_size
+    ):
+        st.session_state.library_search_query = search_query
+        st.session_state.library_sort_by = sort_by
+        st.session_state.library_filter_type = filter_type
+        st.session_state.library_page_size = page_size
+        st.session_state.library_page = 1
+    
+    def query_pages(page):
+        # Two pages at once: the second one is only prefetched
+        files, total = get_metadata_index().query(
+            st.session_state.gdrive_folder_id,
+            search=search_query,
+            mime_type=None if filter_type == 'all' else filter_type,
+            sort=sort_by,
+            limit=2 * page_size,
+            offset=(page - 1) * page_size
+        )
+        return [library_file_info(f) for f in files], total
+    
+    current_page = max(1, st.session_state.library_page)
+    page_files, total_images = query_pages(current_page)
+    total_pages = max(1, -(-total_images // page_size))
+    if current_page > total_pages:
+        # Filters shrank the result set below the current page
+        current_page = total_pages
+        page_files, total_images = query_pages(current_page)
+    st.session_state.library_page = current_page
+    page_images = page_files[:page_size]
+    
+    st.markdown(f"**{total_images} images** in your library")
+    
+    if st.session_state.selected_images:
+        sel_col1, sel_col2 = st.columns([3, 1])
+        with sel_col1:
+            st.write(f"**{len(st.session_state.selected_images)} image(s) selected**")
+        with sel_col2:
+            if st.button("🗑️ Delete Selected", use_container_width=True):
+                with st.spinner("Deleting..."):
+                    deleted_ids, errors = delete_gdrive_files(st.session_state.selected_images)
+                st.session_state.library_images = [img for img in st.session_state.library_images if img.get('id') not in deleted_ids]
+                st.session_state.selected_images = [file_id for file_id in st.session_state.selected_images if file_id in errors]
+                for file_id, error in errors.items():
+                    st.error(f"❌ Failed to delete {file_id}: {error}")
+                if deleted_ids:
+                    st.success(f"✅ Deleted {len(deleted_ids)} image(s)")
+                    st.rerun()
+    
+    nav_col1, nav_col2, nav_col3 = st.columns([1, 2, 1])
+    with nav_col1:
+        if st.button("◀️ Previous", disabled=current_page <= 1, use_container_width=True):
+            st.session_state.library_page = current_page - 1
+            st.rerun()
+    with nav_col2:
+        st.markdown(
+            f"<div style='text-align:center;padding-top:6px;'>Page {current_page} of {total_pages}</div>",
+            unsafe_allow_html=True
+        )
+    with nav_col3:
+        if st.button("Next ▶️", disabled=current_page >= total_pages, use_container_width=True):
+            st.session_state.library_page = current_page + 1
+            st.rerun()
+    
+    # Warm the thumbnail cache one page ahead so paging forward renders from disk
+    next_page_images = page_files[page_size:]
+    if next_page_images and st.session_state.credentials:
+        get_thumbnail_prefetcher().prefetch(st.session_state.credentials, next_page_images)
+    
     st.markdown("---")
     
-    cols_per_row = 3
+    cols_per_row = LIBRARY_GRID_COLUMNS
     
-    for i, file_info in enumerate(valid_images):
+    for i, file_info in enumerate(page_images):
         if i % cols_per_row == 0:
             cols = st.columns(cols_per_row)
         
@@ -1637,7 +3076,17 @@ def display_library_page():
             with st.container():
                 st.markdown("<div style='border: 1px solid #ddd; border-radius: 8px; padding: 10px; margin-bottom: 15px;'>", unsafe_allow_html=True)
                 
-                display_gdrive_image(file_info, caption=file_name)
+                display_gdrive_image(file_info, caption=file_name, thumbnail=True)
+                
+                is_selected = st.checkbox(
+                    "Select",
+                    value=file_id in st.session_state.selected_images,
+                    key=f"select_{file_id}"
+                )
+                if is_selected and file_id not in st.session_state.selected_images:
+                    st.session_state.selected_images.append(file_id)
+                elif not is_selected and file_id in st.session_state.selected_images:
+                    st.session_state.selected_images.remove(file_id)
                 
                 edit_col1, edit_col2 = st.columns(2)
                 with edit_col1:
@@ -1676,6 +3125,9 @@ def display_library_page():
                 st.markdown("</div>", unsafe_allow_html=True)
 
 
+# Save what earlier (possibly rerun-aborted) runs changed; the connected account's stored state loads on first use
+persist_session_state()
+
 with st.sidebar:
     st.title("⚙️ Configuration")
     
@@ -1735,16 +3187,77 @@ with st.sidebar:
             on_change=lambda: setattr(st.session_state, 'auto_log_sheets', st.session_state.auto_log_sheets_checkbox)
         )
         
+        st.number_input(
+            "Parallel uploads",
+            min_value=1,
+            max_value=16,
+            value=st.session_state.upload_concurrency,
+            key="upload_concurrency_input",
+            help="How many results of one task are downloaded, uploaded and shared at the same time",
+            on_change=lambda: setattr(st.session_state, 'upload_concurrency', st.session_state.upload_concurrency_input)
+        )
+        
         if st.session_state.spreadsheet_id:
             sheet_url = f"https://docs.google.com/spreadsheets/d/{st.session_state.spreadsheet_id}"
             st.markdown(f"[📊 Open Spreadsheet]({sheet_url})")
         
+        log_buffer = get_log_buffer()
+        pending_rows = log_buffer.pending_count()
+        if pending_rows:
+            st.caption(f"📝 {pending_rows} log row(s) waiting to be written to Sheets")
+            if log_buffer.last_error:
+                st.caption(f"⚠️ {log_buffer.last_error}")
+            if st.button("⏫ Flush Sheets Log", use_container_width=True):
+                log_buffer.flush()
+                st.toast("Flushing queued log rows")
+        
         if st.session_state.gdrive_folder_id:
             folder_url = f"https://drive.google.com/drive/folders/{st.session_state.gdrive_folder_id}"
             st.markdown(f"[📁 Open Drive Folder]({folder_url})")
     
     st.divider()
     
+    st.subheader("🔔 Task Callbacks")
+    
+    st.checkbox(
+        "Receive completion callbacks",
+        value=st.session_state.callback_enabled,
+        key="callback_enabled_checkbox",
+        help="Run a local receiver for KIE.ai callBackUrl notifications and poll only as a fallback",
+        on_change=lambda: setattr(st.session_state, 'callback_enabled', st.session_state.callback_enabled_checkbox)
+    )
+    
+    if st.session_state.callback_enabled:
+        receiver = None
+        try:
+            receiver = start_callback_receiver()
+            st.caption(f"Receiver listening on {CALLBACK_RECEIVER_HOST}:{CALLBACK_RECEIVER_PORT} at `{CALLBACK_PATH}`; "
+                       "the secret token is appended to the callback URL automatically")
+        except OSError as e:
+            st.error(f"❌ Could not start callback receiver: {str(e)}")
+        
+        st.text_input(
+            "Public callback URL",
+            value=st.session_state.callback_public_url,
+            key="callback_public_url_input",
+            placeholder=f"https://your-host.example.com{CALLBACK_PATH}",
+            help="Address at which KIE.ai can reach this receiver",
+            on_change=lambda: setattr(st.session_state, 'callback_public_url', st.session_state.callback_public_url_input)
+        )
+        
+        if receiver and st.button("📨 Send Test Callback", use_container_width=True):
+            test_task_id = f"test_{int(time.time())}"
+            local_url = with_callback_token(f"http://127.0.0.1:{CALLBACK_RECEIVER_PORT}{CALLBACK_TEST_PATH}")
+            sent, detail = send_test_callback(local_url, test_task_id)
+            if sent and receiver.test_store.get(test_task_id):
+                st.success(f"✅ Callback received ({detail})")
+            else:
+                st.error(f"❌ Callback not recorded: {detail}")
+        
+        st.caption(f"📬 Callbacks received: {len(get_completion_store())}")
+    
+    st.divider()
+    
     st.subheader("📁 CSV Management")
     
     col1, col2 = st.columns(2)
@@ -1769,9 +3282,12 @@ with st.sidebar:
             label_visibility="collapsed"
         )
         
-        if csv_upload:
+        # The uploader keeps its file across reruns; import each upload only once
+        upload_key = (csv_upload.name, csv_upload.size, getattr(csv_upload, 'file_id', None)) if csv_upload else None
+        if csv_upload and upload_key not in st.session_state.imported_csv_uploads:
             success, message = load_csv_file(csv_upload)
             if success:
+                st.session_state.imported_csv_uploads.add(upload_key)
                 st.success(message)
             else:
                 st.error(message)
@@ -1841,6 +3357,9 @@ tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
 with tab1:
     display_generate_page()
     
+    if get_active_task_ids():
+        display_task_monitor()
+    
     if st.session_state.task_history:
         st.divider()
         st.subheader("📜 Recent Tasks")
@@ -1857,21 +3376,22 @@ with tab1:
         # Filter tasks
         filtered_tasks = st.session_state.task_history
         if filter_status != "all":
-            filtered_tasks = [t for t in filtered_tasks if t['status'] == filter_status]
+            filtered_tasks = [t for t in filtered_tasks if displayed_task_status(t) == filter_status]
         if filter_model != "all":
             filtered_tasks = [t for t in filtered_tasks if t['model'] == filter_model]
         
         for task in filtered_tasks[:show_count]:
-            with st.expander(f"{task['model']} - {task['prompt'][:50]}... [{task['status'].upper()}]"):
+            status = displayed_task_status(task)
+            with st.expander(f"{task['model']} - {task['prompt'][:50]}... [{status.upper()}]"):
                 col_info1, col_info2 = st.columns(2)
                 
                 with col_info1:
                     st.write(f"**Task ID:** `{task['id']}`")
                     st.write(f"**Model:** {task['model']}")
-                    st.write(f"**Status:** {task['status']}")
+                    st.write(f"**Status:** {status}")
                 
                 with col_info2:
-                    st.write(f"**Timestamp:** {task['timestamp']}")
+                    st.write(f"**Timestamp:** {task.get('timestamp', task.get('created_at', ''))}")
                     if task.get('tags'):
                         st.write(f"**Tags:** {task['tags']}")
                 
@@ -1883,6 +3403,12 @@ with tab1:
                     for idx, url in enumerate(task['results']):
                         with cols[idx % 4]:
                             st.image(url, use_container_width=True)
+                
+                for report in task.get('result_report', []):
+                    timings = " | ".join(f"{step} {seconds:.1f}s" for step, seconds in report['timings'].items())
+                    st.caption(f"📤 {report['file_name']}: {report['status']} in {report['elapsed']:.1f}s" + (f" ({timings})" if timings else ""))
+                    for error in report['errors']:
+                        st.caption(f"⚠️ {error}")
 
 with tab2:
     display_library_page()
@@ -1904,8 +3430,7 @@ with tab3:
             st.write(f"**Spreadsheet ID:** `{st.session_state.spreadsheet_id}`")
         
         with col_sheet2:
-            if st.button("🔄 Refresh Data", use_container_width=True):
-                st.rerun()
+            refresh_sheets = st.button("🔄 Refresh Data", use_container_width=True)
         
         with col_sheet3:
             sheet_url = f"https://docs.google.com/spreadsheets/d/{st.session_state.spreadsheet_id}"
@@ -1913,16 +3438,16 @@ with tab3:
         
         st.divider()
         
-        sheets_data = get_sheets_data()
+        try:
+            df = get_sheets_log_frame(refresh=refresh_sheets)
+        except Exception as e:
+            st.error(f"Error loading sheets data: {str(e)}")
+            df = None
         
-        if sheets_data:
-            st.write(f"**Total Entries:** {len(sheets_data)}")
+        if df is not None and not df.empty:
+            st.write(f"**Total Entries:** {len(df)}")
             
             try:
-                import pandas as pd
-                
-                df = pd.DataFrame(sheets_data, columns=['Timestamp', 'Model', 'Prompt', 'Image URL', 'Drive Link', 'Task ID', 'Status', 'Tags'])
-                
                 # Filters
                 col_f1, col_f2, col_f3 = st.columns(3)
                 with col_f1:
@@ -2100,14 +3625,7 @@ with tab5:
                 st.warning("Maximum 10 prompts allowed per batch")
                 prompts = prompts[:10]
             
-            st.write(f"**Processing {len(prompts)} prompts...**")
-            
-            progress_batch = st.progress(0)
-            status_batch = st.empty()
-            
-            for idx, prompt in enumerate(prompts):
-                status_batch.write(f"**Processing prompt {idx+1}/{len(prompts)}:** {prompt[:50]}...")
-                
+            for prompt in prompts:
                 input_params = {
                     "prompt": prompt,
                     "width": batch_width,
@@ -2115,39 +3633,10 @@ with tab5:
                     "num_inference_steps": batch_steps,
                     "num_images": 1
                 }
-                
-                result = create_task(st.session_state.api_key, batch_model, input_params)
-                
-                if result["success"]:
-                    task_id = result["task_id"]
-                    
-                    st.session_state.task_history.insert(0, {
-                        'id': task_id,
-                        'model': batch_model,
-                        'prompt': prompt,
-                        'timestamp': datetime.now().isoformat(),
-                        'status': 'pending',
-                        'results': []
-                    })
-                    
-                    poll_result = poll_task_until_complete(
-                        st.session_state.api_key,
-                        task_id,
-                        max_attempts=30
-                    )
-                    
-                    if poll_result["success"]:
-                        task_data = poll_result["data"]
-                        result_urls = task_data.get("result", [])
-                        
-                        if result_urls:
-                            save_and_upload_results(task_id, batch_model, prompt, result_urls)
-                            st.success(f"✅ Generated: {prompt[:30]}...")
-                
-                progress_batch.progress((idx + 1) / len(prompts))
+                submit_background_job(batch_model, prompt, input_params)
             
-            st.balloons()
-            st.success(f"🎉 Batch generation complete! Processed {len(prompts)} prompts")
+            st.toast(f"📦 Queued {len(prompts)} batch job(s). Track them on the Generate tab.")
+            st.rerun()
 
 with tab6:
     st.header("ℹ️ About AI Image Editor Pro")
@@ -2286,3 +3775,5 @@ with col_foot2:
     st.caption("Enhanced with Google Sheets & Drive")
 with col_foot3:
     st.caption("v3.0 Complete Edition")
+
+persist_session_state()
@@ -3,7 +3,10 @@ import requests
 import json
 import time
 import io
+import threading
 import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime, timedelta
 from typing import Optional, Dict, List, Any
 import base64
@@ -31,6 +34,8 @@ except Exception:
     st.error("Google API packages missing. Add these to requirements.txt: "
              "google-auth, google-auth-oauthlib, google-auth-httplib2, google-api-python-client")
 
+from shared_services import get_http_session, get_google_client_cache
+
 
 # ============================================================================
 # Streamlit Cloud Configuration
@@ -185,6 +190,12 @@ st.markdown("""
 BASE_URL = "https://api.kie.ai/api/v1/jobs"
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
 
+IMAGE_FETCH_CONNECT_TIMEOUT = 3
+IMAGE_FETCH_READ_TIMEOUT = 5
+IMAGE_FETCH_HEDGE_DELAY = 0.75
+IMAGE_FETCH_WORKERS = 8
+IMAGE_FETCH_MAX_WINNERS = 10000
+
 # ============================================================================
 # Session State Initialization
 # ============================================================================
@@ -238,11 +249,9 @@ init_session_state()
 def authenticate_with_service_account(service_account_json):
     """Authenticate with Google Drive using service account."""
     try:
-        credentials = service_account.Credentials.from_service_account_info(
-            service_account_json,
-            scopes=SCOPES
-        )
-        service = build('drive', 'v3', credentials=credentials)
+        client_cache = get_google_client_cache()
+        credentials = client_cache.credentials_for(service_account_json, SCOPES)
+        service = client_cache.build('drive', 'v3', credentials)
         st.session_state.credentials = credentials
         st.session_state.service = service
         st.session_state.authenticated = True
@@ -294,7 +303,7 @@ def upload_to_gdrive(image_url: str, file_name: str, task_id: str = None):
         if not folder_id:
             return None
         
-        response = requests.get(image_url, timeout=30)
+        response = get_http_session().get(image_url, timeout=30)
         response.raise_for_status()
         image_data = response.content
         
@@ -397,30 +406,121 @@ def delete_gdrive_file(file_id: str):
         st.error(f"Error deleting file: {str(e)}")
         return False
 
-def load_image_with_fallback(file_info):
-    """Try to load image from multiple sources with fallback logic."""
-    original_url = file_info.get('original_url')
-    public_image_url = file_info.get('public_image_url')
-    thumbnail_url = file_info.get('thumbnail_url')
-    direct_link = file_info.get('direct_link')
+class HedgedImageFetcher:
+    """Race an image's candidate URLs and remember which source answers.
+
+    Candidates start ``IMAGE_FETCH_HEDGE_DELAY`` seconds apart, or as soon
+    as an earlier one fails, so a dead or slow link only delays a tile by the
+    hedge delay instead of its full timeout. The first response that decodes
+    as an image wins; the other downloads are cancelled and their
+    connections closed, so a losing fetch does not hold a pool thread until
+    its timeout. The winning source name is remembered per file (for the
+    ``max_winners`` most recent files) and tried first, with a head start, on
+    later loads. Fallback sources,
+    such as low-resolution thumbnails, are only tried once every full-quality
+    source has failed and are never remembered as winners.
+    """
     
-    # For AI-generated images, prioritize original URL (best quality)
-    # For uploaded images, use Google Drive URLs
-    if original_url:
-        urls_to_try = [original_url, public_image_url, direct_link, thumbnail_url]
-    else:
-        urls_to_try = [public_image_url, direct_link, thumbnail_url]
+    def __init__(self, max_workers=IMAGE_FETCH_WORKERS, max_winners=IMAGE_FETCH_MAX_WINNERS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-fetch")
+        self._lock = threading.Lock()
+        self._winners = OrderedDict()
+        self._max_winners = max_winners
     
-    for url in urls_to_try:
-        if url:
-            try:
-                response = requests.get(url, timeout=10)
-                if response.status_code == 200:
-                    return PILImage.open(io.BytesIO(response.content)), url
-            except Exception:
-                continue
+    def _fetch(self, url, cancelled, responses):
+        timeout = (IMAGE_FETCH_CONNECT_TIMEOUT, IMAGE_FETCH_READ_TIMEOUT)
+        with get_http_session().get(url, timeout=timeout, stream=True) as response:
+            responses.append(response)
+            if cancelled.is_set():
+                return None
+            if response.status_code != 200:
+                raise ValueError(f"HTTP {response.status_code}")
+            content = io.BytesIO()
+            for piece in response.iter_content(chunk_size=64 * 1024):
+                if cancelled.is_set():
+                    return None
+                content.write(piece)
+        image = PILImage.open(io.BytesIO(content.getvalue()))
+        image.load()
+        return image
     
-    return None, None
+    def _race(self, candidates):
+        cancelled = threading.Event()
+        responses = []
+        pending = {}
+        try:
+            while candidates or pending:
+                # Each pass starts one more candidate: after the hedge delay or as soon as a fetch failed
+                if candidates:
+                    name, url = candidates.pop(0)
+                    pending[self._pool.submit(self._fetch, url, cancelled, responses)] = (name, url)
+                done, _ = wait(
+                    pending,
+                    timeout=IMAGE_FETCH_HEDGE_DELAY if candidates else None,
+                    return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    name, url = pending.pop(future)
+                    try:
+                        image = future.result()
+                    except Exception:
+                        continue
+                    if image is not None:
+                        return image, name, url
+        finally:
+            cancelled.set()
+            for future in pending:
+                future.cancel()
+            for response in list(responses):
+                # Unblocks a losing fetch that is waiting on a read
+                response.close()
+        return None, None, None
+    
+    def fetch(self, file_key, sources, fallback_sources=()):
+        """Return ``(image, url)`` from the first of ``sources`` that works, or ``(None, None)``.
+
+        ``sources`` and ``fallback_sources`` are ordered lists of
+        ``(source_name, url)`` pairs; the fallbacks only start after all of
+        ``sources`` failed. Without a ``file_key`` no winner is looked up or
+        remembered.
+        """
+        winner = None
+        if file_key is not None:
+            with self._lock:
+                winner = self._winners.get(file_key)
+                if winner is not None:
+                    self._winners.move_to_end(file_key)
+        candidates = [(name, url) for name, url in sources if url]
+        candidates.sort(key=lambda candidate: candidate[0] != winner)
+        
+        image, name, url = self._race(candidates)
+        if image is not None:
+            if file_key is not None:
+                with self._lock:
+                    self._winners[file_key] = name
+                    self._winners.move_to_end(file_key)
+                    while len(self._winners) > self._max_winners:
+                        self._winners.popitem(last=False)
+            return image, url
+        
+        image, _, url = self._race([(name, url) for name, url in fallback_sources if url])
+        return image, url
+
+@st.cache_resource
+def get_image_fetcher():
+    """Return the process-wide hedged image fetcher."""
+    return HedgedImageFetcher()
+
+def load_image_with_fallback(file_info):
+    """Load an image from whichever of its sources answers first."""
+    # For AI-generated images, prioritize original URL (best quality); expired
+    # CDN links are overtaken by the Google Drive URLs after the hedge delay.
+    # The thumbnail is a last resort so it never displaces a full-size image.
+    source_names = ['original_url', 'public_image_url', 'direct_link']
+    sources = [(name, file_info.get(name)) for name in source_names]
+    fallback_sources = [('thumbnail_url', file_info.get('thumbnail_url'))]
+    file_key = file_info.get('file_id') or file_info.get('id') or file_info.get('original_url')
+    return get_image_fetcher().fetch(file_key, sources, fallback_sources)
 
 # ============================================================================
 # API Functions
@@ -442,7 +542,7 @@ def create_task(api_key, model, input_params, callback_url=None):
         payload["callBackUrl"] = callback_url
     
     try:
-        response = requests.post(
+        response = get_http_session().post(
             f"{BASE_URL}/createTask",
             headers=headers,
             json=payload,
@@ -468,7 +568,7 @@ def check_task_status(api_key, task_id):
     }
     
     try:
-        response = requests.get(
+        response = get_http_session().get(
             f"{BASE_URL}/recordInfo",
             headers=headers,
             params={"taskId": task_id},
@@ -1061,7 +1161,7 @@ def display_history_page():
                             st.success("✅ In Drive")
                     
                     try:
-                        img_response = requests.get(result_url, timeout=10)
+                        img_response = get_http_session().get(result_url, timeout=10)
                         st.download_button(
                             label="⬇️ Download",
                             data=img_response.content,
@@ -8,6 +8,11 @@ import numpy as np
 from datetime import datetime, timedelta
 from typing import Optional, Dict, List, Any
 import base64
+import hashlib
+import uuid
+import os
+import sqlite3
+import threading
 
 # Import pandas and plotly for analytics
 try:
@@ -18,9 +23,19 @@ except ImportError:
     px = None
     st.warning("Pandas and Plotly are missing. Install them for enhanced analytics: `pip install pandas plotly`")
 
+# Optional: pyarrow for a compact columnar generation log and Parquet export/import
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
 
 try:
     from PIL import Image as PILImage
+    from PIL import ImageOps
+    from PIL import features as pil_features
 except Exception:
     PILImage = None
     st.error("Pillow is missing. Add 'Pillow' to requirements.txt")
@@ -36,6 +51,13 @@ except Exception:
     st.error("Google API packages missing. Add these to requirements.txt: "
              "google-auth, google-auth-oauthlib, google-auth-httplib2, google-api-python-client")
 
+from shared_services import (
+    IMAGE_CACHE_DIR, get_http_session, get_google_client_cache, get_resolved_resources,
+    is_not_found_error, GenerationLog, get_metadata_index, content_digests, find_live_duplicate,
+    get_library_index, get_image_cache, get_single_flight, download_drive_bytes, get_log_buffer,
+    get_state_store
+)
+
 st.set_page_config(
     page_title="AI Image Studio Pro - Ultimate Edition",
     page_icon="🎨",
@@ -234,9 +256,9 @@ def init_session_state():
         
         # Image Library & Data
         'gdrive_images': [],
-        'gdrive_images_cache': {},  # Cache for image bytes
         'last_library_refresh': None,
-        'csv_data': [],
+        'csv_data': GenerationLog(GENERATION_LOG_COLUMNS, GENERATION_LOG_REQUIRED_COLUMNS),
+        'csv_export_cache': None,
         
         # Task Management
         'task_queue': [], # Not actively used, but kept for structure
@@ -299,6 +321,75 @@ def init_session_state():
         if key not in st.session_state:
             st.session_state[key] = value
 
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+SCOPES = [
+    'https://www.googleapis.com/auth/drive',
+    'https://www.googleapis.com/auth/spreadsheets'
+]
+PUBLIC_READ_PERMISSION = {'type': 'anyone', 'role': 'reader'}
+REFERENCE_FOLDER_NAME = 'Edit_References'
+LIBRARY_FILE_FIELDS = 'id, name, webViewLink, size, createdTime, modifiedTime, description, thumbnailLink, mimeType, md5Checksum, parents, trashed'
+STATE_DB_PATH = os.path.join(IMAGE_CACHE_DIR, "studio_state.sqlite3")
+RESULT_CACHE_PATH = os.path.join(IMAGE_CACHE_DIR, "result_cache.sqlite3")
+RESULT_CACHE_TTL_SECONDS = 24 * 60 * 60
+RESULT_CACHE_MAX_ENTRIES = 500
+PERSISTENCE_PROFILE = os.environ.get("APP_PROFILE", "default")
+# Session keys restored on connect and written back row by row: list, dict, single value or
+# counters (one row per profile that each session adds its changes to)
+PERSISTED_STATE = {
+    'task_history': 'list',
+    'stats': 'counters',
+    'comparison_list': 'list',
+    'projects': 'dict',
+    'workflows': 'dict',
+    'scheduled_tasks': 'list'
+}
+SHEETS_LOG_RANGE = 'Generation_Log!A:I'
+GENERATION_LOG_COLUMNS = ['timestamp', 'model', 'prompt', 'image_url', 'drive_link', 'task_id', 'status', 'tags', 'file_id']
+GENERATION_LOG_REQUIRED_COLUMNS = GENERATION_LOG_COLUMNS[:8]  # file_id is optional so App.py logs import too
+THUMBNAIL_MAX_SIZE = (320, 320)
+THUMBNAIL_FORMAT = 'WEBP'
+THUMBNAIL_QUALITY = 80
+
+# ============================================================================
+# DRIVE RESOURCE LOOKUP
+# ============================================================================
+
+
+def google_identity():
+    """Identity of the connected service account, used to key resolved resources."""
+    return getattr(st.session_state.get('service'), 'cache_identity', None)
+
+
+def get_verified_resource(service, name):
+    """Return the cached ID of a named Drive resource, checked once per session.
+
+    The first lookup in each session confirms the file still exists and is
+    not trashed; otherwise the entry is forgotten and None is returned so the
+    caller resolves the resource again.
+    """
+    resolved = get_resolved_resources()
+    resource_id = resolved.get(google_identity(), name)
+    if not resource_id:
+        return None
+    verified = st.session_state.setdefault('verified_resources', set())
+    if resource_id in verified:
+        return resource_id
+    try:
+        trashed = service.files().get(fileId=resource_id, fields='id, trashed').execute().get('trashed')
+    except Exception as e:
+        if not is_not_found_error(e):
+            return resource_id
+        trashed = True
+    if trashed:
+        resolved.forget(resource_id)
+        return None
+    verified.add(resource_id)
+    return resource_id
+
 # ============================================================================
 # GOOGLE SERVICES AUTHENTICATION
 # ============================================================================
@@ -306,16 +397,12 @@ def init_session_state():
 def authenticate_with_service_account(service_account_json):
     """Authenticate with Google services using service account"""
     try:
-        credentials = service_account.Credentials.from_service_account_info(
-            json.loads(service_account_json),
-            scopes=[
-                'https://www.googleapis.com/auth/drive',
-                'https://www.googleapis.com/auth/spreadsheets'
-            ]
-        )
+        # Credentials and parsed discovery documents are shared by every session using this account
+        client_cache = get_google_client_cache()
+        credentials = client_cache.credentials_for(json.loads(service_account_json), SCOPES)
         
-        drive_service = build('drive', 'v3', credentials=credentials)
-        sheets_service = build('sheets', 'v4', credentials=credentials)
+        drive_service = client_cache.build('drive', 'v3', credentials)
+        sheets_service = client_cache.build('sheets', 'v4', credentials)
         
         st.session_state.authenticated = True
         st.session_state.drive_service = drive_service
@@ -332,6 +419,13 @@ def authenticate_with_service_account(service_account_json):
 
 def create_app_folder():
     """Create or get the AI Image Editor folder in Google Drive"""
+    # Reuse the folder resolved earlier for this service account without querying Drive
+    resolved = get_resolved_resources()
+    cached_id = get_verified_resource(st.session_state.drive_service, 'folder:AI_Image_Editor_Pro')
+    if cached_id:
+        st.session_state.app_folder_id = cached_id
+        return cached_id
+    
     try:
         # Search for existing folder
         query = "name='AI_Image_Editor_Pro' and mimeType='application/vnd.google-apps.folder' and trashed=false"
@@ -346,6 +440,7 @@ def create_app_folder():
         if folders:
             folder_id = folders[0]['id']
             st.session_state.app_folder_id = folder_id
+            resolved.set(google_identity(), 'folder:AI_Image_Editor_Pro', folder_id)
             return folder_id
         
         # Create new folder
@@ -361,6 +456,7 @@ def create_app_folder():
         
         folder_id = folder.get('id')
         st.session_state.app_folder_id = folder_id
+        resolved.set(google_identity(), 'folder:AI_Image_Editor_Pro', folder_id)
         return folder_id
         
     except Exception as e:
@@ -374,11 +470,12 @@ def upload_to_gdrive(image_url: str, file_name: str, task_id: str = None):
             return None, "Not authenticated with Google Drive"
         
         # Download image from URL
-        response = requests.get(image_url, timeout=30)
+        response = get_http_session().get(image_url, timeout=30)
         if response.status_code != 200:
             return None, f"Failed to download image: HTTP {response.status_code}"
         
-        image_bytes = io.BytesIO(response.content)
+        image_data = response.content
+        image_bytes = io.BytesIO(image_data)
         
         # Ensure app folder exists
         if not st.session_state.get('app_folder_id'):
@@ -386,6 +483,14 @@ def upload_to_gdrive(image_url: str, file_name: str, task_id: str = None):
             if not st.session_state.get('app_folder_id'): # Check again if folder creation failed
                 return None, "App folder not found or could not be created"
         
+        # Identical bytes already in the folder are reused instead of stored again
+        sha256, md5_checksum = content_digests(image_data)
+        duplicate = find_live_duplicate(
+            st.session_state.drive_service, st.session_state.app_folder_id, sha256, md5_checksum
+        )
+        if duplicate:
+            return duplicate, None
+        
         # Prepare metadata
         file_metadata = {
             'name': file_name,
@@ -406,8 +511,16 @@ def upload_to_gdrive(image_url: str, file_name: str, task_id: str = None):
         file = st.session_state.drive_service.files().create(
             body=file_metadata,
             media_body=media,
-            fields='id, name, webViewLink, size, createdTime'
+            fields='id, name, description, webViewLink, size, mimeType, createdTime, modifiedTime, md5Checksum'
         ).execute()
+        get_metadata_index().record_content_hash(
+            st.session_state.app_folder_id, file.get('id'), sha256, file.get('md5Checksum') or md5_checksum
+        )
+        
+        # Render the library thumbnail while the image bytes are still at hand
+        thumb_bytes = create_thumbnail(image_data)
+        if thumb_bytes:
+            get_image_cache().put('thumb', google_identity(), file.get('id'), file.get('modifiedTime'), thumb_bytes)
         
         # Update statistics
         st.session_state.stats['uploaded_images'] += 1
@@ -416,10 +529,14 @@ def upload_to_gdrive(image_url: str, file_name: str, task_id: str = None):
         return file, None
         
     except Exception as e:
+        if is_not_found_error(e) and st.session_state.get('app_folder_id'):
+            # The cached folder was deleted; resolve it again on the next upload
+            get_resolved_resources().forget(st.session_state.app_folder_id)
+            st.session_state.app_folder_id = None
         return None, f"Upload failed: {str(e)}"
 
 def list_gdrive_images(folder_id=None, force_refresh=False):
-    """List all images in the Google Drive folder with caching"""
+    """List all images in the Google Drive folder with caching (deltas only after the first full listing)"""
     try:
         if not st.session_state.get('authenticated') or not st.session_state.get('drive_service'):
             return []
@@ -439,18 +556,13 @@ def list_gdrive_images(folder_id=None, force_refresh=False):
                 st.error("App folder not found or could not be created. Cannot list images.")
                 return []
         
-        # Query for image files
-        query = f"'{folder_id}' in parents and trashed=false and (mimeType contains 'image/')"
-        
-        results = st.session_state.drive_service.files().list(
-            q=query,
-            spaces='drive',
-            fields='files(id, name, webViewLink, size, createdTime, description, thumbnailLink)',
-            orderBy='createdTime desc',
-            pageSize=1000
-        ).execute()
-        
-        images = results.get('files', [])
+        # Sync the folder index (full listing once, then changes feed deltas); concurrent
+        # sessions share one sync and each keeps its own copies of the file dicts
+        drive_service = st.session_state.drive_service
+        images = [dict(f) for f in get_single_flight().do(
+            ('library', google_identity(), folder_id),
+            lambda: get_library_index(folder_id, LIBRARY_FILE_FIELDS).sync(drive_service)
+        )]
         
         # Update session state
         st.session_state.gdrive_images = images
@@ -462,45 +574,76 @@ def list_gdrive_images(folder_id=None, force_refresh=False):
         st.error(f"Failed to list images: {str(e)}")
         return []
 
-def get_gdrive_image_bytes(file_id):
-    """Get image bytes from Google Drive with caching"""
+def encode_thumbnail(image):
+    """Downscale a PIL image into WebP (or JPEG when WebP is unavailable) preview bytes."""
+    thumb = ImageOps.exif_transpose(image)
+    thumb.thumbnail(THUMBNAIL_MAX_SIZE)
+    image_format = THUMBNAIL_FORMAT if pil_features.check('webp') else 'JPEG'
+    if image_format == 'JPEG':
+        thumb = thumb.convert('RGB')
+    elif thumb.mode not in ('RGB', 'RGBA'):
+        thumb = thumb.convert('RGBA' if 'A' in thumb.getbands() or 'transparency' in thumb.info else 'RGB')
+    
+    buffered = io.BytesIO()
+    thumb.save(buffered, format=image_format, quality=THUMBNAIL_QUALITY)
+    return buffered.getvalue()
+
+def create_thumbnail(image_bytes):
+    """Return thumbnail bytes for an encoded image, or None if it cannot be decoded."""
+    if PILImage is None:
+        return None
     try:
-        # Check cache first
-        if file_id in st.session_state.gdrive_images_cache:
-            return st.session_state.gdrive_images_cache[file_id]
-        
-        if not st.session_state.get('authenticated') or not st.session_state.get('drive_service'):
-            return None
-        
-        # Download from Drive
-        request = st.session_state.drive_service.files().get_media(fileId=file_id)
-        image_bytes = io.BytesIO()
-        downloader = MediaIoBaseDownload(image_bytes, request)
-        
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-        
-        image_bytes.seek(0)
-        image_data = image_bytes.read()
-        
-        # Cache the result
-        st.session_state.gdrive_images_cache[file_id] = image_data
-        
-        return image_data
+        with PILImage.open(io.BytesIO(image_bytes)) as image:
+            return encode_thumbnail(image)
+    except Exception:
+        return None
+
+def get_gdrive_image_bytes(file_id, modified_time=None):
+    """Get image bytes from Google Drive, served from the shared disk cache after the first fetch"""
+    if not st.session_state.get('authenticated') or not st.session_state.get('drive_service'):
+        return None
+    
+    try:
+        # Served from this account's cache, or downloaded while joining any download already in flight
+        return download_drive_bytes(st.session_state.drive_service, file_id, modified_time, google_identity())
         
     except Exception as e:
         st.error(f"Failed to get image bytes for {file_id}: {str(e)}")
         return None
 
-def display_gdrive_image(file_info, caption="", width=150):
-    """Display an image from Google Drive with error handling"""
+def get_gdrive_thumbnail(file_info):
+    """Return cached thumbnail bytes for a Drive file, rendering them on first use."""
+    if not st.session_state.get('authenticated') or not st.session_state.get('drive_service'):
+        return None
+    
+    file_id = file_info['id']
+    modified_time = file_info.get('modifiedTime')
+    owner = google_identity()
+    cache = get_image_cache()
+    thumb_bytes = cache.get('thumb', owner, file_id, modified_time)
+    if thumb_bytes is not None:
+        return thumb_bytes
+    
+    image_bytes = get_gdrive_image_bytes(file_id, modified_time)
+    if not image_bytes:
+        return None
+    thumb_bytes = create_thumbnail(image_bytes)
+    if thumb_bytes is None:
+        return image_bytes
+    cache.put('thumb', owner, file_id, modified_time, thumb_bytes)
+    return thumb_bytes
+
+def display_gdrive_image(file_info, caption="", width=150, thumbnail=False):
+    """Display an image from Google Drive with error handling, as a cached thumbnail when ``thumbnail`` is set"""
     try:
         if not st.session_state.drive_service or not file_info or not file_info.get('id'):
             st.warning("Unable to display image - missing file info or Drive service")
             return False
         
-        image_bytes = get_gdrive_image_bytes(file_info['id'])
+        if thumbnail:
+            image_bytes = get_gdrive_thumbnail(file_info)
+        else:
+            image_bytes = get_gdrive_image_bytes(file_info['id'], file_info.get('modifiedTime'))
         if image_bytes:
             try:
                 st.image(image_bytes, caption=caption, use_container_width=True, width=width)
@@ -523,9 +666,7 @@ def delete_gdrive_file(file_id):
 
         st.session_state.drive_service.files().delete(fileId=file_id).execute()
         
-        # Clear from cache
-        if file_id in st.session_state.gdrive_images_cache:
-            del st.session_state.gdrive_images_cache[file_id]
+        # Cached bytes for the deleted file are never requested again and age out of the disk cache
         
         # Remove from session state list and refresh (list_gdrive_images handles refresh logic)
         st.session_state.gdrive_images = [img for img in st.session_state.gdrive_images if img['id'] != file_id]
@@ -535,6 +676,85 @@ def delete_gdrive_file(file_id):
     except Exception as e:
         return False, f"Delete failed: {str(e)}"
 
+def get_reference_folder():
+    """Create or get the app subfolder holding published edit reference images.
+
+    A subfolder keeps reference copies out of the library listing, which only
+    covers the app folder's direct children.
+    """
+    resolved = get_resolved_resources()
+    cached_id = get_verified_resource(st.session_state.drive_service, f"folder:{REFERENCE_FOLDER_NAME}")
+    if cached_id:
+        return cached_id
+    
+    parent_id = st.session_state.get('app_folder_id') or create_app_folder()
+    if not parent_id:
+        return None
+    
+    drive = st.session_state.drive_service
+    folders = drive.files().list(
+        q=f"name='{REFERENCE_FOLDER_NAME}' and mimeType='application/vnd.google-apps.folder' and '{parent_id}' in parents and trashed=false",
+        spaces='drive',
+        fields='files(id)',
+        pageSize=1
+    ).execute().get('files', [])
+    if folders:
+        folder_id = folders[0]['id']
+    else:
+        folder_id = drive.files().create(
+            body={
+                'name': REFERENCE_FOLDER_NAME,
+                'mimeType': 'application/vnd.google-apps.folder',
+                'parents': [parent_id]
+            },
+            fields='id'
+        ).execute().get('id')
+    resolved.set(google_identity(), f"folder:{REFERENCE_FOLDER_NAME}", folder_id)
+    return folder_id
+
+def get_reference_image_url(image_bytes, mime_type='image/png', drive_file_id=None):
+    """Return a short public URL for an edit source image, publishing it at most once.
+
+    Images are keyed by the SHA-256 of their bytes per service account and
+    are always published as a copy in the reference folder, so private
+    library files are never shared. Library images (``drive_file_id``) are
+    copied server-side. A remembered copy is checked once per session and
+    published again if it was deleted. Falls back to an inline data URL
+    when Drive is not connected or publishing fails.
+    """
+    name = f"reference:{hashlib.sha256(image_bytes).hexdigest()}"
+    resolved = get_resolved_resources()
+    file_id = None
+    if st.session_state.get('drive_service'):
+        file_id = get_verified_resource(st.session_state.drive_service, name)
+    
+    if not file_id and st.session_state.get('authenticated') and st.session_state.get('drive_service'):
+        drive = st.session_state.drive_service
+        try:
+            folder_id = get_reference_folder()
+            extension = {'image/jpeg': '.jpg', 'image/webp': '.webp'}.get(mime_type, '.png')
+            body = {'name': f"{name.split(':')[1][:16]}{extension}", 'parents': [folder_id]}
+            if drive_file_id:
+                file_id = drive.files().copy(fileId=drive_file_id, body=body, fields='id').execute().get('id')
+            else:
+                file_id = drive.files().create(
+                    body=body,
+                    media_body=MediaIoBaseUpload(io.BytesIO(image_bytes), mimetype=mime_type),
+                    fields='id'
+                ).execute().get('id')
+            drive.permissions().create(fileId=file_id, body=PUBLIC_READ_PERMISSION).execute()
+            resolved.set(google_identity(), name, file_id)
+        except Exception as e:
+            if is_not_found_error(e):
+                # The reference folder was deleted; resolve it again next time
+                resolved.forget(resolved.get(google_identity(), f"folder:{REFERENCE_FOLDER_NAME}"))
+            st.warning(f"Could not publish the reference image to Drive, sending it inline: {str(e)}")
+            file_id = None
+    
+    if file_id:
+        return f"https://drive.google.com/uc?export=download&id={file_id}"
+    return f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode()}"
+
 # ============================================================================
 # GOOGLE SHEETS FUNCTIONS
 # ============================================================================
@@ -544,6 +764,13 @@ def create_or_get_spreadsheet():
     try:
         if not st.session_state.get('authenticated') or not st.session_state.get('drive_service') or not st.session_state.get('sheets_service'):
             return None
+        
+        # Reuse the spreadsheet resolved earlier for this service account without querying Drive
+        resolved = get_resolved_resources()
+        cached_id = get_verified_resource(st.session_state.drive_service, 'spreadsheet:AI_Image_Editor_Pro_Log')
+        if cached_id:
+            st.session_state.spreadsheet_id = cached_id
+            return cached_id
             
         # Search for existing spreadsheet
         query = "name='AI_Image_Editor_Pro_Log' and mimeType='application/vnd.google-apps.spreadsheet' and trashed=false"
@@ -558,6 +785,7 @@ def create_or_get_spreadsheet():
         if sheets:
             spreadsheet_id = sheets[0]['id']
             st.session_state.spreadsheet_id = spreadsheet_id
+            resolved.set(google_identity(), 'spreadsheet:AI_Image_Editor_Pro_Log', spreadsheet_id)
             return spreadsheet_id
         
         # Create new spreadsheet
@@ -604,6 +832,7 @@ def create_or_get_spreadsheet():
                 st.warning(f"Could not move spreadsheet to app folder: {move_err}")
 
         st.session_state.spreadsheet_id = spreadsheet_id
+        resolved.set(google_identity(), 'spreadsheet:AI_Image_Editor_Pro_Log', spreadsheet_id)
         return spreadsheet_id
         
     except Exception as e:
@@ -612,7 +841,7 @@ def create_or_get_spreadsheet():
 
 def log_to_sheets(model: str, prompt: str, image_url: str, drive_link: str = "", 
                   task_id: str = "", status: str = "success", tags: str = "", file_id: str = ""):
-    """Log generation data to Google Sheets"""
+    """Queue generation data for Google Sheets through the write-behind log buffer"""
     try:
         spreadsheet_id = st.session_state.get('spreadsheet_id')
         if not spreadsheet_id:
@@ -624,14 +853,9 @@ def log_to_sheets(model: str, prompt: str, image_url: str, drive_link: str = "",
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
         values = [[timestamp, model, prompt, image_url, drive_link, task_id, status, tags, file_id]]
-        body = {'values': values}
         
-        st.session_state.sheets_service.spreadsheets().values().append(
-            spreadsheetId=spreadsheet_id,
-            range='Generation_Log!A:I',
-            valueInputOption='RAW',
-            body=body
-        ).execute()
+        # Rows are spilled to disk and appended in batches by the buffer's flusher thread
+        get_log_buffer().add(st.session_state.service, spreadsheet_id, SHEETS_LOG_RANGE, values)
         
         return True
     except Exception as e:
@@ -666,6 +890,9 @@ def get_sheets_data():
         return processed_values[1:] if len(processed_values) > 1 else []  # Skip header row
         
     except Exception as e:
+        if is_not_found_error(e) and st.session_state.get('spreadsheet_id'):
+            get_resolved_resources().forget(st.session_state.spreadsheet_id)
+            st.session_state.spreadsheet_id = None
         st.error(f"Failed to get sheets data: {str(e)}")
         return []
 
@@ -690,45 +917,145 @@ def add_to_csv_data(model: str, prompt: str, image_url: str, drive_link: str = "
         'file_id': file_id
     }
     
-    # Add to the global csv_data list in session state
+    # Append to the session's columnar generation log
     st.session_state.csv_data.append(entry)
 
-def export_to_csv():
-    """Export CSV data to downloadable file"""
-    if not st.session_state.csv_data:
+def export_to_csv(file_format="csv"):
+    """Export the generation log as CSV or Parquet bytes.
+
+    The log is append-only, so an export is reused until new rows arrive
+    instead of being re-serialized on every render of the Data page.
+    """
+    log = st.session_state.csv_data
+    if not log:
         return None
     
-    output = io.StringIO()
-    # Ensure fieldnames cover all possible keys that might be in csv_data
-    fieldnames = ['timestamp', 'model', 'prompt', 'image_url', 'drive_link', 'task_id', 'status', 'tags', 'file_id']
-    writer = csv.DictWriter(output, fieldnames=fieldnames)
+    cache_key = (id(log), len(log), file_format)
+    cached = st.session_state.csv_export_cache
+    if cached and cached[0] == cache_key:
+        return cached[1]
     
-    writer.writeheader()
-    writer.writerows(st.session_state.csv_data)
+    output = io.BytesIO()
+    if file_format == "parquet":
+        log.write_parquet(output)
+    else:
+        log.write_csv(output)
     
-    return output.getvalue()
+    data = output.getvalue()
+    st.session_state.csv_export_cache = (cache_key, data)
+    return data
 
 def load_csv_file(uploaded_file):
-    """Load CSV file into session state's csv_data"""
+    """Append a CSV or Parquet generation log to session state's csv_data, streaming it chunk by chunk"""
+    progress_bar = st.progress(0.0, text="Importing...")
+    
+    def on_progress(bytes_read, rows_read):
+        fraction = min(1.0, bytes_read / uploaded_file.size) if uploaded_file.size else 0.0
+        progress_bar.progress(fraction, text=f"Imported {rows_read:,} rows...")
+    
     try:
-        content = uploaded_file.read().decode('utf-8')
-        reader = csv.DictReader(io.StringIO(content))
-        
-        loaded_data = list(reader)
-        # Append loaded data to existing session state data
-        st.session_state.csv_data.extend(loaded_data)
+        if uploaded_file.name.lower().endswith('.parquet'):
+            if pq is None:
+                return False, "Parquet import requires pyarrow (`pip install pyarrow`)"
+            report = st.session_state.csv_data.import_parquet(uploaded_file, on_progress)
+        else:
+            report = st.session_state.csv_data.import_csv(uploaded_file, on_progress)
         
-        return True, len(loaded_data) # Return success status and number of entries loaded
+        return True, report # Return success status and the added/duplicates/invalid counts
     except Exception as e:
         return False, str(e) # Return failure status and error message
+    finally:
+        progress_bar.empty()
 
 # ============================================================================
 # KIE.AI API FUNCTIONS
 # ============================================================================
 
-def create_task(api_key, model, input_params, callback_url=None):
-    """Create a new task using KIE.ai API with updated endpoints"""
+class ResultCache:
+    """SQLite cache of generation results for deterministic requests.
+
+    Entries are keyed by a canonical hash of the endpoint, the payload
+    actually sent and the owner (a hash of the API key plus the connected
+    Drive account), so only requests that pin a seed are stored and one
+    user's results and Drive copies are never served to another. Each entry
+    keeps the API output and, once uploaded, the Drive copies of its images.
+    Entries expire after ``RESULT_CACHE_TTL_SECONDS``, and the least recently
+    used ones beyond ``RESULT_CACHE_MAX_ENTRIES`` are evicted.
+    """
+    
+    def __init__(self, path=RESULT_CACHE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    task_id TEXT,
+                    created_at REAL,
+                    last_used REAL,
+                    output TEXT,
+                    drive_files TEXT
+                )
+            """)
+    
+    @staticmethod
+    def request_key(url, payload, api_key, drive_identity=None):
+        """Return the cache key for a request, or None when its result is not deterministic."""
+        # Prompt upsampling rewrites the prompt server-side, so the seed alone does not pin the result
+        if payload.get('seed') is None or payload.get('promptUpsampling'):
+            return None
+        owner = [hashlib.sha256(api_key.encode('utf-8')).hexdigest(), drive_identity]
+        canonical = json.dumps([url, payload, owner], sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+    
+    def get(self, key):
+        """Return ``(task_id, output, drive_files)`` for a live entry, or None."""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT task_id, output, drive_files FROM results WHERE key = ? AND created_at > ?",
+                (key, now - RESULT_CACHE_TTL_SECONDS)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (now, key))
+        return row[0], json.loads(row[1]), json.loads(row[2] or '[]')
+    
+    def put(self, key, model, task_id, output):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, model, task_id, created_at, last_used, output, drive_files) "
+                "VALUES (?, ?, ?, ?, ?, ?, NULL)",
+                (key, model, task_id, now, now, json.dumps(output))
+            )
+            self._conn.execute("DELETE FROM results WHERE created_at <= ?", (now - RESULT_CACHE_TTL_SECONDS,))
+            self._conn.execute(
+                "DELETE FROM results WHERE key NOT IN (SELECT key FROM results ORDER BY last_used DESC LIMIT ?)",
+                (RESULT_CACHE_MAX_ENTRIES,)
+            )
     
+    def set_drive_files(self, key, drive_files):
+        """Attach the Drive copies uploaded for an entry's images."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE results SET drive_files = ? WHERE key = ?", (json.dumps(drive_files), key)
+            )
+    
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM results")
+
+@st.cache_resource
+def get_result_cache():
+    """Return the process-wide generation result cache."""
+    return ResultCache()
+
+def build_task_request(model, input_params):
+    """Return the KIE.ai endpoint URL and JSON payload for a generation request."""
     # Determine which API endpoint to use based on model
     if 'gpt-4o' in model.lower() or 'gpt4o' in model.lower():
         # Use GPT-4o Image API
@@ -774,13 +1101,40 @@ def create_task(api_key, model, input_params, callback_url=None):
             "model": "flux-kontext-pro"
         }
     
+    return url, payload
+
+def create_task(api_key, model, input_params, callback_url=None, use_cache=False):
+    """Create a new task using KIE.ai API with updated endpoints
+
+    With ``use_cache``, requests with a fixed seed are answered from the result
+    cache when possible; such task data carries ``cached=True`` and the Drive
+    copies stored with the entry. Fresh deterministic results are stored, and
+    their ``cache_key`` is returned so the caller can attach Drive copies.
+    """
+    url, payload = build_task_request(model, input_params)
+    cache_key = ResultCache.request_key(url, payload, api_key, google_identity()) if use_cache else None
+    if cache_key:
+        cached = get_result_cache().get(cache_key)
+        if cached:
+            task_id, output, drive_files = cached
+            return {
+                'id': task_id,
+                'status': 'succeeded',
+                'output': output,
+                'model': model,
+                'created_at': datetime.now().isoformat(),
+                'cached': True,
+                'cache_key': cache_key,
+                'drive_files': drive_files
+            }, None
+    
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
     }
     
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=60)
+        response = get_http_session().post(url, headers=headers, json=payload, timeout=60)
         
         if response.status_code == 200:
             result_data = response.json()
@@ -793,8 +1147,13 @@ def create_task(api_key, model, input_params, callback_url=None):
                 'status': 'succeeded',
                 'output': result_data,
                 'model': model,
-                'created_at': datetime.now().isoformat()
+                'created_at': datetime.now().isoformat(),
+                'cached': False,
+                'cache_key': cache_key
             }
+            # Only real results are cached; error bodies also arrive with HTTP 200
+            if cache_key and isinstance(result_data, dict) and result_data.get('images'):
+                get_result_cache().put(cache_key, model, task_id, result_data)
             
             # Update stats
             st.session_state.stats['total_tasks'] += 1
@@ -837,7 +1196,6 @@ def create_task(api_key, model, input_params, callback_url=None):
         st.session_state.stats['failed_tasks'] += 1
         return None, f"An unexpected error occurred: {str(e)}"
 
-
 def check_task_status(api_key, task_id):
     """Check the status of a task - with new API, tasks complete immediately"""
     # With the new API, tasks are synchronous, so we don't need to poll
@@ -849,7 +1207,6 @@ def check_task_status(api_key, task_id):
         'message': 'Task completed (synchronous API)'
     }, None
 
-
 def poll_task_until_complete(api_key, task_id, max_attempts=60, delay=2):
     """Poll task status until completion - simplified for synchronous API"""
     # With new API endpoints, tasks complete immediately
@@ -864,7 +1221,6 @@ def poll_task_until_complete(api_key, task_id, max_attempts=60, delay=2):
         'status': 'succeeded'
     }, None
 
-
 def save_and_upload_results(task_id, model, prompt, result_urls, tags=""):
     """Save results and automatically upload to Drive if enabled and authenticated"""
     uploaded_files_info = [] # Stores info about successfully uploaded files
@@ -892,6 +1248,9 @@ def save_and_upload_results(task_id, model, prompt, result_urls, tags=""):
                     file_id = file_info.get('id', '')
                     uploaded_files_info.append(file_info) # Store info for display later
                     
+                    # Index the model and prompt so the library can search by them
+                    get_metadata_index().record_upload(st.session_state.app_folder_id, file_info, model, prompt)
+                    
                     # Log to Sheets if logging is successful
                     log_to_sheets(model, prompt, image_url, drive_link, task_id, "success", tags, file_id)
                 else:
@@ -920,6 +1279,172 @@ def save_and_upload_results(task_id, model, prompt, result_urls, tags=""):
 # TAG AND COLLECTION MANAGEMENT
 # ============================================================================
 
+def _persisted_items(kind, value):
+    """Split a session value into ``(key, item)`` pairs for row-wise storage."""
+    if kind == 'dict':
+        return [(str(key), item) for key, item in value.items()]
+    if kind == 'list':
+        items = []
+        seen = set()
+        for index, item in enumerate(value):
+            key = item.get('id') if isinstance(item, dict) else None
+            key = str(key) if key is not None and str(key) not in seen else f"#{index}"
+            seen.add(key)
+            items.append((key, item))
+        return items
+    return [('', value)]
+
+def _add_counts(total, delta, sign=1):
+    """Add (or with ``sign=-1`` subtract) the numbers of nested stat dicts; other values keep ``total``'s."""
+    result = dict(total)
+    for key, value in delta.items():
+        if isinstance(value, dict):
+            result[key] = _add_counts(result.get(key) or {}, value, sign)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            result[key] = (result.get(key) or 0) + sign * value
+        else:
+            result.setdefault(key, value)
+    return result
+
+def _item_ordinals(items, known):
+    """Return the stored ``seq`` of every item: known keys keep theirs, new ones are stamped from the clock.
+
+    Items ahead of every known one were inserted at the front and get
+    ordinals above the current time in milliseconds; later ones were appended
+    and get ordinals below its negation. Rows written by different sessions,
+    or before the session connected, therefore sort by when they were added.
+    """
+    now = int(time.time() * 1000)
+    top = max(max(known.values(), default=0), now)
+    bottom = min(min(known.values(), default=0), -now)
+    first_known = next((i for i, (key, _) in enumerate(items) if key in known), len(items))
+    ordinals = {}
+    for i, (key, _) in enumerate(items):
+        if key in known:
+            ordinals[key] = known[key]
+        elif i < first_known:
+            ordinals[key] = top + first_known - i
+        else:
+            bottom -= 1
+            ordinals[key] = bottom
+    return ordinals
+
+def stamp_persisted_items():
+    """Give new items of persisted collections their ordinal, whether or not an account is connected."""
+    ordinals = st.session_state.setdefault('persisted_ordinals', {})
+    for collection, kind in PERSISTED_STATE.items():
+        if kind == 'counters':
+            continue
+        items = _persisted_items(kind, st.session_state.get(collection) or ({} if kind == 'dict' else []))
+        ordinals[collection] = _item_ordinals(items, ordinals.get(collection, {}))
+
+def persistence_profile():
+    """Return the store profile of the connected service account, or None when not connected.
+
+    State is only persisted for a connected account, so sessions of different
+    accounts never see each other's history.
+    """
+    identity = google_identity()
+    return f"{PERSISTENCE_PROFILE}:{identity}" if identity else None
+
+def restore_persisted_state(profile):
+    """Load a profile's persisted collections into the session and seed its change fingerprints.
+
+    Runs lazily, the first time a session is attached to a profile. Items the
+    session created before connecting are kept and written to the profile,
+    placed among the stored items by the ordinal they were stamped with.
+    Counter collections are stored as one row per profile.
+    """
+    store = get_state_store(STATE_DB_PATH)
+    merge = st.session_state.get('persisted_profile') is None
+    stamped = st.session_state.get('persisted_ordinals', {}) if merge else {}
+    fingerprints = {}
+    ordinals = {}
+    for collection, kind in PERSISTED_STATE.items():
+        rows = store.load(profile, collection)
+        current = st.session_state.get(collection)
+        if kind == 'counters':
+            baseline = {}
+            for _, _, data in rows:
+                baseline = _add_counts(baseline, json.loads(data))
+            if any(key != '' for key, _, _ in rows):
+                # Fold the per-session rows written by earlier versions into the profile row
+                store.apply(profile, collection, [('', 0, json.dumps(baseline))], [key for key, _, _ in rows if key != ''])
+            counts = current or {}
+            if not merge:
+                counts = _add_counts(counts, counts, -1)  # Keep the default keys, drop the previous account's counts
+            st.session_state[collection] = _add_counts(counts, baseline)
+            st.session_state[f"persisted_{collection}_baseline"] = baseline
+            fingerprints[collection] = {}
+            continue
+        
+        fingerprints[collection] = {key: (seq, hash(data)) for key, seq, data in rows}
+        ordinals[collection] = {key: seq for key, seq, _ in rows}
+        if kind == 'list':
+            loaded = [(seq, json.loads(data)) for _, seq, data in rows]
+            if merge and current:
+                loaded_keys = {key for key, _, _ in rows}
+                for key, item in _persisted_items(kind, current):
+                    if key not in loaded_keys:
+                        seq = stamped.get(collection, {}).get(key, 0)
+                        loaded.append((seq, item))
+                        ordinals[collection][key] = seq
+                loaded.sort(key=lambda entry: entry[0], reverse=True)
+            st.session_state[collection] = [item for _, item in loaded]
+        elif kind == 'dict':
+            loaded = {key: json.loads(data) for key, _, data in rows}
+            if merge and current:
+                loaded = {**current, **loaded}
+            st.session_state[collection] = loaded
+        elif rows:
+            st.session_state[collection] = json.loads(rows[0][2])
+    st.session_state.persisted_fingerprints = fingerprints
+    st.session_state.persisted_ordinals = ordinals
+    st.session_state.persisted_profile = profile
+
+def persist_session_state():
+    """Write only the rows of persisted collections that changed since the last call.
+
+    Until an account is connected only new items are stamped with their
+    ordinal; the first call for an account restores its stored state.
+    """
+    stamp_persisted_items()
+    profile = persistence_profile()
+    if profile is None:
+        return
+    if st.session_state.get('persisted_profile') != profile:
+        restore_persisted_state(profile)
+        stamp_persisted_items()  # Dict items merged from before connecting
+    
+    store = get_state_store(STATE_DB_PATH)
+    fingerprints = st.session_state.persisted_fingerprints
+    for collection, kind in PERSISTED_STATE.items():
+        if kind == 'counters':
+            # Add what this session counted since its last write to the profile's row
+            counts = st.session_state.get(collection) or {}
+            baseline_key = f"persisted_{collection}_baseline"
+            baseline = st.session_state.get(baseline_key) or {}
+            if counts != baseline:
+                delta = _add_counts(counts, baseline, -1)
+                store.update(profile, collection, '', lambda data: json.dumps(_add_counts(json.loads(data) if data else {}, delta)))
+                st.session_state[baseline_key] = _add_counts({}, counts)
+            continue
+        
+        previous = fingerprints.setdefault(collection, {})
+        items = _persisted_items(kind, st.session_state.get(collection) or ({} if kind == 'dict' else []))
+        seqs = st.session_state.persisted_ordinals[collection]
+        upserts = []
+        current = {}
+        for key, item in items:
+            data = json.dumps(item, default=str)
+            current[key] = (seqs[key], hash(data))
+            if previous.get(key) != current[key]:
+                upserts.append((key, seqs[key], data))
+        deletes = [key for key in previous if key not in current]
+        if upserts or deletes:
+            store.apply(profile, collection, upserts, deletes)
+            fingerprints[collection] = current
+
 def add_tag_to_image(image_id, tag):
     """Add a tag to an image in session state"""
     if not tag: return # Do nothing if tag is empty
@@ -930,6 +1455,7 @@ def add_tag_to_image(image_id, tag):
     tag = tag.strip().lower() # Normalize tag
     if tag and tag not in st.session_state.tags[image_id]:
         st.session_state.tags[image_id].append(tag)
+        get_metadata_index().add_tag(google_identity(), image_id, tag)
         # Update global tag usage stats
         st.session_state.stats['tags_used'][tag] = st.session_state.stats['tags_used'].get(tag, 0) + 1
         # Update session state to reflect change (important for UI updates)
@@ -939,6 +1465,7 @@ def remove_tag_from_image(image_id, tag):
     """Remove a tag from an image in session state"""
     if image_id in st.session_state.tags and tag in st.session_state.tags[image_id]:
         st.session_state.tags[image_id].remove(tag)
+        get_metadata_index().remove_tag(google_identity(), image_id, tag)
         # Optional: decrement tag usage count if needed for stats, but might be complex if not tracking precisely
         # For simplicity, we'll just remove it from the image's list.
 
@@ -1149,6 +1676,13 @@ def display_generate_page():
                 help="Use a specific seed for reproducible results. 0 generates a random seed."
             )
             input_params_map["seed"] = seed # Update the map
+            
+            use_result_cache = st.checkbox(
+                "♻️ Reuse cached results",
+                value=False,
+                key="use_result_cache",
+                help="With a fixed seed (and prompt upsampling off), an identical request returns the stored images instead of starting a new paid job."
+            )
         
         # Tags input within advanced settings
         tags_input = st.text_input(
@@ -1225,7 +1759,7 @@ def display_generate_page():
             }
             
             # Create the task using the KIE.ai API
-            task_data, error = create_task(api_key, selected_model, current_input_params)
+            task_data, error = create_task(api_key, selected_model, current_input_params, use_cache=use_result_cache)
             
             if error:
                 st.error(f"❌ Generation failed: {error}")
@@ -1245,7 +1779,10 @@ def display_generate_page():
                     st.error("❌ No images were generated by the model.")
                     return # Stop execution if no images are returned
                 
-                st.success(f"🎉 Generated {len(result_urls)} image(s)!")
+                if task_data.get('cached'):
+                    st.success(f"♻️ Returned {len(result_urls)} cached image(s) for this seed - no new job was started")
+                else:
+                    st.success(f"🎉 Generated {len(result_urls)} image(s)!")
                 
                 # Log the task and save/upload results
                 task_id = task_data.get('id', f"task_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}") # Use pseudo-id
@@ -1259,15 +1796,21 @@ def display_generate_page():
                     'status': 'completed', # Initial status is completed
                     'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                     'tags': tags_input.strip(), # Store tags
-                    'result_urls': result_urls # Store URLs in task info
+                    'result_urls': result_urls, # Store URLs in task info
+                    'cached': bool(task_data.get('cached'))
                 }
                 st.session_state.task_history.append(task_info)
                 st.session_state.completed_tasks.append(task_info) # Add to completed list
                 
-                # Save results (to CSV) and upload to Google Drive if enabled
-                uploaded_files_metadata = save_and_upload_results(
-                    task_id, selected_model, prompt.strip(), result_urls, tags_input.strip()
-                )
+                # A cache hit whose images were already copied to Drive is not saved or uploaded again
+                uploaded_files_metadata = task_data.get('drive_files') if task_data.get('cached') else None
+                if not uploaded_files_metadata:
+                    # Save results (to CSV) and upload to Google Drive if enabled
+                    uploaded_files_metadata = save_and_upload_results(
+                        task_id, selected_model, prompt.strip(), result_urls, tags_input.strip()
+                    )
+                    if task_data.get('cache_key') and uploaded_files_metadata:
+                        get_result_cache().set_drive_files(task_data['cache_key'], uploaded_files_metadata)
                 
                 # Display the generated images
                 st.markdown("### 🖼️ Generated Images")
@@ -1283,7 +1826,7 @@ def display_generate_page():
                         # Provide a download button for each image
                         try:
                             # Fetch image content for download button
-                            img_response = requests.get(image_url, timeout=30)
+                            img_response = get_http_session().get(image_url, timeout=30)
                             if img_response.status_code == 200:
                                 st.download_button(
                                     label="💾 Download",
@@ -1359,7 +1902,9 @@ def display_edit_page():
         key="edit_image_source"
     )
     
-    source_image_url = None # URL to be passed to the API
+    source_image_bytes = None # Encoded source image, published as a URL on submit
+    source_mime_type = 'image/png'
+    source_drive_file_id = None # Set when the source is already stored in the library
     original_image_pil = None # PIL Image object for display purposes
     
     # Handle image upload from computer
@@ -1377,14 +1922,9 @@ def display_edit_page():
                 original_image_pil = image.copy() # Store a copy for display
                 st.image(image, caption="Uploaded Image", width=300)
                 
-                # Convert image to base64 data URL for API if model supports it
-                buffered = io.BytesIO()
-                # Ensure image is in RGB format before saving as PNG/JPEG if needed
-                if image.mode != 'RGB':
-                    image = image.convert('RGB')
-                image.save(buffered, format="PNG") # Save as PNG for consistency
-                img_str = base64.b64encode(buffered.getvalue()).decode()
-                source_image_url = f"data:image/png;base64,{img_str}"
+                # The original bytes are sent as-is; no re-encoding is needed for the API
+                source_image_bytes = uploaded_file.getvalue()
+                source_mime_type = uploaded_file.type or 'image/png'
             except Exception as e:
                 st.error(f"Error processing uploaded image: {str(e)}")
     
@@ -1415,21 +1955,16 @@ def display_edit_page():
                     if display_gdrive_image(selected_image_info, caption="Selected Image", width=300):
                         # Construct URL for Google Drive direct download/view link
                         file_id = selected_image_info['id']
-                        # For editing, we need the actual image data, not just a link.
-                        # For models like Seedream/GPT-4o, a base64 data URL is often required.
-                        # Let's fetch the image bytes and convert it.
-                        image_bytes_for_edit = get_gdrive_image_bytes(file_id)
+                        # The library copy is shared in place on submit, so only the bytes for display are needed here
+                        image_bytes_for_edit = get_gdrive_image_bytes(file_id, selected_image_info.get('modifiedTime'))
                         if image_bytes_for_edit:
                             try:
                                 img_pil = PILImage.open(io.BytesIO(image_bytes_for_edit))
                                 original_image_pil = img_pil.copy() # Store for before/after display
                                 
-                                buffered = io.BytesIO()
-                                if img_pil.mode != 'RGB':
-                                    img_pil = img_pil.convert('RGB')
-                                img_pil.save(buffered, format="PNG")
-                                img_str = base64.b64encode(buffered.getvalue()).decode()
-                                source_image_url = f"data:image/png;base64,{img_str}"
+                                source_image_bytes = image_bytes_for_edit
+                                source_mime_type = selected_image_info.get('mimeType') or 'image/png'
+                                source_drive_file_id = file_id
                             except Exception as e:
                                 st.error(f"Could not prepare image for editing from Drive: {str(e)}")
                         else:
@@ -1496,7 +2031,7 @@ def display_edit_page():
     
     # Logic for applying edits
     if edit_btn:
-        if not source_image_url:
+        if not source_image_bytes:
             st.error("❌ Please select or upload a source image before applying edits.")
             return
         
@@ -1506,11 +2041,14 @@ def display_edit_page():
         
         # Start the editing process with a spinner
         with st.spinner("✨ Applying edits to your image..."):
+            # Published once per image and reused by later edits of the same source
+            source_image_url = get_reference_image_url(source_image_bytes, source_mime_type, source_drive_file_id)
+            
             # Prepare input parameters for the editing API call
             # These parameters need to align with the chosen model's API expectations
             input_params = {
                 "prompt": edit_prompt.strip(),
-                "image_urls": [source_image_url], # Use the base64 encoded image data
+                "image_urls": [source_image_url], # Public reference URL (inline data URL only without Drive)
                 "image_resolution": mapped_resolution, # e.g., "hd" or "standard"
                 "aspect_ratio": edit_aspect_ratio_param,
                 "max_images": 1, # Typically editing produces one output
@@ -1560,7 +2098,7 @@ def display_edit_page():
                     
                     # Provide a download button for the edited image
                     try:
-                        img_response = requests.get(result_urls[0], timeout=30)
+                        img_response = get_http_session().get(result_urls[0], timeout=30)
                         if img_response.status_code == 200:
                             st.download_button(
                                 label="💾 Download Edited Image",
@@ -1630,13 +2168,8 @@ def display_library_page():
         st.session_state.search_query = search_query # Update session state
     
     with search_filter_cols[1]:
-        # Dynamically generate tag options based on currently tagged images
-        all_tags_in_session = set()
-        for tags_list in st.session_state.tags.values():
-            all_tags_in_session.update(tags_list)
-        
-        # Ensure "All" is the first option
-        tag_options = ["All"] + sorted(list(all_tags_in_session))
+        # Tag options come from the metadata index (already distinct and sorted)
+        tag_options = ["All"] + get_metadata_index().all_tags(google_identity())
         
         filter_tag = st.selectbox(
             "Filter by Tag",
@@ -1647,49 +2180,38 @@ def display_library_page():
     
     st.divider() # Separator before image display
     
-    # Load images from Google Drive
+    # Sync the library (mirrors Drive changes into the metadata index)
     images = list_gdrive_images()
     
     if not images:
         st.info("📭 Your image library is empty. Start generating images in the 'Generate' tab!")
         return
     
-    # --- Filtering and Sorting Logic ---
-    filtered_images = images # Start with all images
-    
-    # Apply search query filter
-    if search_query:
-        search_lower = search_query.lower()
-        filtered_images = [
-            img for img in filtered_images
-            if search_lower in img.get('name', '').lower() or \
-               search_lower in img.get('description', '').lower() # Search in name and description
-        ]
+    # --- Filtering, Sorting and Pagination via the metadata index ---
+    sort_keys = {"Newest": 'date_desc', "Oldest": 'date_asc', "Name": 'name'}
+    items_per_page = st.session_state.items_per_page # Use value from session state
     
-    # Apply tag filter
-    if filter_tag != "All":
-        filtered_images = [
-            img for img in filtered_images
-            # Check if the selected tag is present in the image's tags
-            if filter_tag in get_image_tags(img.get('id')) 
-        ]
+    def query_page(page):
+        return get_metadata_index().query(
+            st.session_state.app_folder_id,
+            search=search_query,
+            tag=None if filter_tag == "All" else filter_tag,
+            sort=sort_keys[sort_by],
+            limit=items_per_page,
+            offset=(page - 1) * items_per_page,
+            owner=google_identity()
+        )
     
-    # Apply sorting
-    if sort_by == "Oldest":
-        # Sort by creation time, oldest first
-        filtered_images = sorted(filtered_images, key=lambda x: x.get('createdTime', ''))
-    elif sort_by == "Name":
-        # Sort alphabetically by name
-        filtered_images = sorted(filtered_images, key=lambda x: x.get('name', ''))
-    # Default sort is "Newest", which is typically the order returned by Drive API (createdTime desc)
-    
-    # --- Pagination Logic ---
-    total_images = len(filtered_images)
-    items_per_page = st.session_state.items_per_page # Use value from session state
+    page_images, total_images = query_page(st.session_state.current_page)
     
     # Calculate total pages, ensuring at least 1 page if there are images
     total_pages = (total_images + items_per_page - 1) // items_per_page if total_images > 0 else 1
     
+    # Clamp the page if filters shrank the result set below it
+    if st.session_state.current_page > total_pages:
+        st.session_state.current_page = total_pages
+        page_images, total_images = query_page(total_pages)
+    
     # Display pagination controls if more than one page
     if total_pages > 1:
         page_nav_cols = st.columns([1, 2, 1]) # Columns for Previous, Page Info, Next
@@ -1710,11 +2232,6 @@ def display_library_page():
     else:
         st.caption(f"Showing {total_images} image(s)") # Display count if only one page or no images
     
-    # Determine the range of images to display on the current page
-    start_idx = (st.session_state.current_page - 1) * items_per_page
-    end_idx = start_idx + items_per_page
-    page_images = filtered_images[start_idx:end_idx] # Slice the list for the current page
-    
     # --- Display Images based on View Mode ---
     if st.session_state.view_mode == "grid":
         # Grid View Configuration
@@ -1734,7 +2251,7 @@ def display_library_page():
                     
                     with grid_cols[col_idx]: # Place the image and its controls in this column
                         # Display the image using the helper function
-                        if display_gdrive_image(img_data, caption=f"ID: {img_data.get('id', '')[:8]}...", width=250):
+                        if display_gdrive_image(img_data, caption=f"ID: {img_data.get('id', '')[:8]}...", width=250, thumbnail=True):
                             # Display basic image info below the image
                             st.caption(f"**{img_data.get('name', 'Untitled')[:30]}...**" if len(img_data.get('name', '')) > 30 else img_data.get('name', 'Untitled'))
                             st.caption(f"📅 {img_data.get('createdTime', 'N/A')[:10]}") # Show date part of createdTime
@@ -1753,6 +2270,7 @@ def display_library_page():
                                         st.session_state.favorites.remove(img_data['id'])
                                     else:
                                         st.session_state.favorites.append(img_data['id'])
+                                    get_metadata_index().set_favorite(google_identity(), img_data['id'], not is_fav)
                                     st.rerun() # Rerun to update favorite icon state
                             
                             with action_btn_cols[2]:
@@ -1782,7 +2300,7 @@ def display_library_page():
                 list_cols = st.columns([1, 3]) # Two columns: Image thumbnail | Details
                 
                 with list_cols[0]: # Thumbnail column
-                    display_gdrive_image(img_data, width=150) # Display thumbnail
+                    display_gdrive_image(img_data, width=150, thumbnail=True) # Display thumbnail
                 
                 with list_cols[1]: # Details column
                     st.markdown(f"### {img_data.get('name', 'Untitled')}") # Image name
@@ -1811,6 +2329,7 @@ def display_library_page():
                                 st.session_state.favorites.remove(img_data['id'])
                             else:
                                 st.session_state.favorites.append(img_data['id'])
+                            get_metadata_index().set_favorite(google_identity(), img_data['id'], not is_fav)
                             st.rerun()
                     
                     with action_btn_cols[2]:
@@ -2023,7 +2542,7 @@ def display_task_management_page():
                                 st.image(url, caption=f"Result {i+1}", use_container_width=True)
                                 # Download button for each result image
                                 try:
-                                    img_response = requests.get(url, timeout=20)
+                                    img_response = get_http_session().get(url, timeout=20)
                                     if img_response.status_code == 200:
                                         st.download_button(
                                             label=f"Download Result {i+1}",
@@ -2878,18 +3397,22 @@ def display_data_page():
         st.markdown("### Export Your Data")
         
         # --- CSV Export ---
-        st.markdown("#### 📄 Export Generation Log as CSV")
+        st.markdown("#### 📄 Export Generation Log")
+        
+        export_formats = ["CSV", "Parquet"] if pq is not None else ["CSV"]
+        export_format = st.radio("Format", export_formats, horizontal=True, key="csv_export_format")
         
-        csv_data_string = export_to_csv() # Get CSV data from session state
+        csv_data_string = export_to_csv(export_format.lower()) # Serialized only when the log has grown
         
         if csv_data_string:
+            is_parquet = export_format == "Parquet"
             st.download_button(
-                label="💾 Download CSV",
+                label=f"💾 Download {export_format}",
                 data=csv_data_string,
                 # Dynamic filename with current date
-                file_name=f"ai_image_studio_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                mime="text/csv",
-                help="Download all your generation data including prompts, models, and links as a CSV file."
+                file_name=f"ai_image_studio_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{'parquet' if is_parquet else 'csv'}",
+                mime="application/octet-stream" if is_parquet else "text/csv",
+                help="Download all your generation data including prompts, models, and links."
             )
             
             st.caption(f"Total entries available for CSV export: {len(st.session_state.csv_data)}")
@@ -2904,7 +3427,7 @@ def display_data_page():
         
         # Combine all relevant session state data into a single dictionary
         full_data_backup = {
-            'csv_data': st.session_state.csv_data, # Generation log entries
+            'csv_data': list(st.session_state.csv_data.iter_rows()), # Generation log entries
             'stats': st.session_state.stats, # Analytics statistics
             'tags': st.session_state.tags, # Image tags
             'favorites': st.session_state.favorites, # Favorite image IDs
@@ -2931,8 +3454,8 @@ def display_data_page():
         st.markdown("### Import Data")
         
         # --- CSV Import ---
-        st.markdown("#### 📄 Import CSV Generation Log")
-        csv_file_upload = st.file_uploader("Upload CSV file", type=['csv'], key="csv_import_uploader")
+        st.markdown("#### 📄 Import Generation Log (CSV or Parquet)")
+        csv_file_upload = st.file_uploader("Upload CSV or Parquet file", type=['csv', 'parquet'], key="csv_import_uploader")
         
         if csv_file_upload:
             # Button to trigger CSV import
@@ -2940,7 +3463,8 @@ def display_data_page():
                 try:
                     success, result = load_csv_file(csv_file_upload) # Call function to load CSV
                     if success:
-                        st.success(f"✅ Successfully imported {result} entries from CSV!")
+                        st.success(f"✅ Imported {result['added']} new entries "
+                                   f"({result['duplicates']} duplicates and {result['invalid']} invalid rows skipped)")
                     else:
                         st.error(f"❌ CSV import failed: {result}") # Display error message if import fails
                 except Exception as e:
@@ -2980,9 +3504,14 @@ def display_data_page():
                     
                     if 'tags' in backup_data and isinstance(backup_data['tags'], dict):
                         st.session_state.tags.update(backup_data['tags']) # Overwrite or add tags
+                        for image_id, image_tags in backup_data['tags'].items():
+                            for tag in image_tags:
+                                get_metadata_index().add_tag(google_identity(), image_id, tag)
                     
                     if 'favorites' in backup_data and isinstance(backup_data['favorites'], list):
                         st.session_state.favorites.extend(backup_data['favorites'])
+                        for image_id in backup_data['favorites']:
+                            get_metadata_index().set_favorite(google_identity(), image_id)
                         # Ensure unique favorites after extending
                         st.session_state.favorites = list(set(st.session_state.favorites))
 
@@ -3018,7 +3547,7 @@ def display_data_page():
             if st.button("🗑️ Clear CSV Data Entries", type="secondary"):
                 # Add confirmation prompt
                 if st.button("Confirm Clear CSV", key="confirm_clear_csv_button"):
-                    st.session_state.csv_data = [] # Reset CSV data list
+                    st.session_state.csv_data = GenerationLog(GENERATION_LOG_COLUMNS, GENERATION_LOG_REQUIRED_COLUMNS) # Reset the generation log
                     st.success("CSV data cleared.")
                     st.rerun() # Rerun to update UI
         
@@ -3055,11 +3584,18 @@ def display_data_page():
         if st.button("⚠️ Clear ALL App Data (Reset to Defaults)", type="secondary", help="This will reset all application data, including settings, history, projects, and workflows, to their initial state."):
             # Add confirmation prompt for full reset
             if st.button("Confirm Full Reset", key="confirm_full_reset_button"):
+                profile = persistence_profile()
+                identity = google_identity()
                 # Clear all keys from the session state dictionary
                 for key in list(st.session_state.keys()):
                     del st.session_state[key]
-                # Re-initialize session state with default values
+                # Re-initialize session state with default values and drop the persisted copies
                 init_session_state() 
+                if profile:
+                    get_state_store(STATE_DB_PATH).clear(profile)
+                if identity:
+                    get_metadata_index().clear_annotations(identity)
+                get_result_cache().clear()
                 st.success("All app data cleared. Application reset to default settings.")
                 st.rerun() # Rerun to apply default settings
 
@@ -3093,6 +3629,17 @@ def display_settings_page():
             display_folder_id = (folder_id[:20] + "...") if isinstance(folder_id, str) and len(folder_id) > 20 else folder_id
             st.metric("App Folder ID", display_folder_id)
         
+        # Rows still waiting in the write-behind Sheets log buffer
+        log_buffer = get_log_buffer()
+        pending_rows = log_buffer.pending_count()
+        if pending_rows:
+            st.caption(f"📝 {pending_rows} log row(s) waiting to be written to Sheets")
+            if log_buffer.last_error:
+                st.caption(f"⚠️ {log_buffer.last_error}")
+            if st.button("⏫ Flush Sheets Log"):
+                log_buffer.flush()
+                st.toast("Flushing queued log rows")
+        
         # Button to re-authenticate (disconnects current session)
         if st.button("🔄 Re-authenticate / Disconnect", type="secondary"):
             # Clear authentication-related session state variables
@@ -3272,6 +3819,10 @@ def main():
     
     # Initialize session state variables if they don't exist
     init_session_state()
+    
+    # Save what earlier (possibly rerun-aborted) runs changed; the connected
+    # account's stored history, stats, projects and workflows load on first use
+    persist_session_state()
 
     # Apply selected theme (Light, Dark, or System default)
     if st.session_state.theme == 'dark':
@@ -3435,6 +3986,9 @@ def main():
     
     with footer_cols[3]:
         st.caption(f"⚡ {len(st.session_state.active_tasks)} Active Now")
+    
+    # Save this run's changes to the persistent store
+    persist_session_state()
 
 # Entry point for the Streamlit application
 if __name__ == "__main__":
@@ -0,0 +1,1428 @@
+"""Process-wide services shared by the Streamlit apps.
+
+HTTP and Google API client caches, the Drive library and image caches, the
+Sheets write-behind log buffer and the SQLite state stores live here once,
+so every app uses the same implementation. Nothing in this module touches
+session state; anything that depends on an app (OAuth scopes, Drive fields,
+log columns, database paths) is passed in by the caller.
+"""
+
+import atexit
+import csv
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Optional: pyarrow keeps the generation log compact in memory
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Optional: fcntl lets each Sheets log buffer lock the spill file it owns
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# The apps report missing Google packages themselves
+try:
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build_from_document
+    from googleapiclient.http import MediaIoBaseDownload, build_http
+    from google_auth_httplib2 import AuthorizedHttp
+    try:
+        from googleapiclient.discovery_cache import get_static_doc
+    except ImportError:
+        get_static_doc = None
+except Exception:
+    service_account = None
+    build_from_document = None
+    build_http = None
+    MediaIoBaseDownload = None
+    AuthorizedHttp = None
+    get_static_doc = None
+
+HTTP_POOL_CONNECTIONS = 10
+HTTP_POOL_MAXSIZE = 16
+HTTP_RETRY_TOTAL = 3
+HTTP_RETRY_BACKOFF = 0.5
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+IMAGE_CACHE_DIR = os.environ.get(
+    "IMAGE_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "ai_image_editor_pro")
+)
+IMAGE_CACHE_MAX_BYTES = {'thumb': 256 * 1024 * 1024, 'full': 2 * 1024 * 1024 * 1024}
+IMAGE_CACHE_RESCAN_EVERY = 100
+LIBRARY_INDEX_PATH = os.path.join(IMAGE_CACHE_DIR, "library_index.sqlite3")
+RESOLVED_RESOURCES_PATH = os.path.join(IMAGE_CACHE_DIR, "resolved_resources.json")
+LIBRARY_PAGE_SIZE = 1000
+SHEETS_LOG_SPILL_DIR = os.path.join(IMAGE_CACHE_DIR, "sheets_spill")
+SHEETS_LOG_FLUSH_ROWS = 50
+SHEETS_LOG_FLUSH_SECONDS = 10
+SHEETS_LOG_BASE_BACKOFF = 5
+SHEETS_LOG_MAX_BACKOFF = 300
+SHEETS_LOG_ADOPT_INTERVAL = 60
+SHEETS_LOG_SCOPE = 'https://www.googleapis.com/auth/spreadsheets'
+GENERATION_LOG_DICTIONARY_COLUMNS = {'model', 'status', 'tags'}
+GENERATION_LOG_CHUNK_ROWS = 4096
+GENERATION_LOG_PROGRESS_ROWS = 5000
+
+@st.cache_resource
+def get_http_session():
+    """Return the process-wide HTTP session used for KIE.ai and image downloads.
+
+    Connections are pooled and kept alive per host (up to ``HTTP_POOL_MAXSIZE``
+    each), and idempotent requests are retried with exponential backoff on
+    429/5xx. POST requests such as createTask are not retried automatically so
+    a transient error never creates duplicate jobs.
+    """
+    retry = Retry(
+        total=HTTP_RETRY_TOTAL,
+        backoff_factor=HTTP_RETRY_BACKOFF,
+        status_forcelist=HTTP_RETRY_STATUSES,
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+class GoogleClientCache:
+    """Process-wide Google API client factory keyed by service-account identity.
+
+    Credentials are created once per service account JSON and shared by every
+    session that uploads the same file; the identity is a hash of the whole
+    JSON, private key included, so presenting another account's email and
+    key ID is not enough to get its credentials. Discovery documents are
+    loaded and parsed once per API, so building a client costs neither a
+    discovery fetch nor a JSON parse. Each thread gets one authorized HTTP
+    connection per identity, shared by all the clients built on that thread.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._credentials = {}
+        self._documents = {}
+        self._local = threading.local()
+    
+    @staticmethod
+    def identity(service_account_info):
+        canonical = json.dumps(service_account_info, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+    
+    def credentials_for(self, service_account_info, scopes):
+        """Return the shared credentials for a service account JSON dict and OAuth scopes."""
+        identity = self.identity(service_account_info)
+        key = (identity, tuple(scopes))
+        with self._lock:
+            credentials = self._credentials.get(key)
+            if credentials is None:
+                credentials = service_account.Credentials.from_service_account_info(
+                    service_account_info,
+                    scopes=list(scopes)
+                )
+                credentials.cache_identity = identity
+                self._credentials[key] = credentials
+            return credentials
+    
+    def find_credentials(self, identity, scope):
+        """Return cached credentials of an identity that were granted ``scope``, or None."""
+        with self._lock:
+            return next((
+                credentials for (key_identity, scopes), credentials in self._credentials.items()
+                if key_identity == identity and scope in scopes
+            ), None)
+    
+    def _document(self, api, version):
+        key = (api, version)
+        with self._lock:
+            document = self._documents.get(key)
+        if document is None:
+            text = get_static_doc(api, version) if get_static_doc else None
+            if text is None:
+                response = get_http_session().get(
+                    f"https://www.googleapis.com/discovery/v1/apis/{api}/{version}/rest", timeout=30
+                )
+                response.raise_for_status()
+                text = response.text
+            document = json.loads(text)
+            with self._lock:
+                document = self._documents.setdefault(key, document)
+        return document
+    
+    def _thread_http(self, credentials):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        key = getattr(credentials, 'cache_identity', id(credentials))
+        cached = connections.get(key)
+        if cached is None or cached[0] is not credentials:
+            cached = (credentials, AuthorizedHttp(credentials, http=build_http()))
+            connections[key] = cached
+        return cached[1]
+    
+    def build(self, api, version, credentials):
+        """Build a client that uses the calling thread's connection for these credentials."""
+        return build_from_document(self._document(api, version), http=self._thread_http(credentials))
+
+@st.cache_resource
+def get_google_client_cache():
+    """Return the process-wide Google API client cache."""
+    return GoogleClientCache()
+
+class ResolvedResourceCache:
+    """Persistent map of Drive resource IDs resolved per service account.
+
+    Entries are keyed by credentials identity and resource name, so a
+    reconnect or a fresh session reuses the folder and spreadsheet found
+    earlier instead of querying Drive. IDs are not checked up front; callers
+    that get a not-found error from Drive or Sheets call ``forget`` and the
+    next lookup resolves the resource again.
+    """
+    
+    def __init__(self, path=RESOLVED_RESOURCES_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = self._read()
+    
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fh:
+                entries = json.load(fh)
+            return entries if isinstance(entries, dict) else {}
+        except (OSError, ValueError):
+            return {}
+    
+    def _write(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            json.dump(self._entries, fh)
+        os.replace(tmp_path, self.path)
+    
+    def get(self, identity, name):
+        if not identity:
+            return None
+        with self._lock:
+            return self._entries.get(identity, {}).get(name)
+    
+    def set(self, identity, name, resource_id):
+        if not identity or not resource_id:
+            return
+        with self._lock:
+            # Merge with what other processes wrote since this one last read the file
+            self._entries = self._read()
+            self._entries.setdefault(identity, {})[name] = resource_id
+            self._write()
+    
+    def forget(self, resource_id):
+        """Drop every entry that resolved to ``resource_id``."""
+        if not resource_id:
+            return
+        with self._lock:
+            self._entries = self._read()
+            changed = False
+            for resources in self._entries.values():
+                for name in [n for n, rid in resources.items() if rid == resource_id]:
+                    del resources[name]
+                    changed = True
+            if changed:
+                self._write()
+
+@st.cache_resource
+def get_resolved_resources():
+    """Return the process-wide resolved resource cache."""
+    return ResolvedResourceCache()
+
+def is_not_found_error(error):
+    """Whether a googleapiclient error means the resource no longer exists."""
+    return getattr(getattr(error, 'resp', None), 'status', None) in (404, '404')
+
+class GenerationLog:
+    """Append-only, columnar generation log.
+
+    Rows accumulate in a small open chunk of per-column lists and are sealed
+    every ``chunk_rows`` rows into an immutable chunk: a dictionary-encoded
+    Arrow record batch when pyarrow is installed, otherwise a tuple per
+    column. Export streams chunk by chunk, so no per-row dicts are ever built
+    for the whole log. Imports skip rows whose (task_id, image_url) is already
+    logged, using a set of 64-bit hashes built on the first import.
+    """
+    
+    def __init__(self, columns, required_columns=None, chunk_rows=GENERATION_LOG_CHUNK_ROWS):
+        self.columns = list(columns)
+        self.required_columns = list(required_columns if required_columns is not None else columns)
+        self.chunk_rows = chunk_rows
+        self._chunks = []
+        self._sealed_rows = 0
+        self._open = {column: [] for column in self.columns}
+        self._keys = None
+    
+    def __len__(self):
+        return self._sealed_rows + len(self._open['timestamp'])
+    
+    def __bool__(self):
+        return len(self) > 0
+    
+    def append(self, entry):
+        for column in self.columns:
+            value = entry.get(column)
+            self._open[column].append('' if value is None else str(value))
+        if self._keys is not None:
+            key = self._dedupe_key(entry)
+            if key is not None:
+                self._keys.add(key)
+        if len(self._open['timestamp']) >= self.chunk_rows:
+            self._seal()
+    
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+    
+    def _seal(self):
+        rows = len(self._open['timestamp'])
+        if not rows:
+            return
+        if pa is not None:
+            chunk = pa.record_batch(
+                [pa.array(self._open[column], type=pa.string()).dictionary_encode()
+                 if column in GENERATION_LOG_DICTIONARY_COLUMNS else pa.array(self._open[column], type=pa.string())
+                 for column in self.columns],
+                names=self.columns
+            )
+        else:
+            chunk = tuple(tuple(self._open[column]) for column in self.columns)
+        self._chunks.append((rows, chunk))
+        self._sealed_rows += rows
+        self._open = {column: [] for column in self.columns}
+    
+    def _iter_column_chunks(self):
+        """Yield each chunk as a list of per-column sequences, oldest first."""
+        for _, chunk in self._chunks:
+            if pa is not None and isinstance(chunk, pa.RecordBatch):
+                yield [chunk.column(i).cast(pa.string()).to_pylist() if pa.types.is_dictionary(chunk.column(i).type)
+                       else chunk.column(i).to_pylist() for i in range(len(self.columns))]
+            else:
+                yield list(chunk)
+        if self._open['timestamp']:
+            yield [self._open[column] for column in self.columns]
+    
+    def iter_rows(self):
+        """Yield rows as dicts, one chunk at a time."""
+        for columns in self._iter_column_chunks():
+            for values in zip(*columns):
+                yield dict(zip(self.columns, values))
+    
+    def write_csv(self, binary_file):
+        """Stream the log as UTF-8 CSV into a binary file object."""
+        text = io.TextIOWrapper(binary_file, encoding='utf-8', newline='', write_through=True)
+        writer = csv.writer(text)
+        writer.writerow(self.columns)
+        for columns in self._iter_column_chunks():
+            writer.writerows(zip(*columns))
+        text.detach()
+    
+    def write_parquet(self, binary_file):
+        """Stream the log into a Parquet file, one row group per chunk (requires pyarrow)."""
+        schema = pa.schema([(column, pa.string()) for column in self.columns])
+        with pq.ParquetWriter(binary_file, schema) as writer:
+            for columns in self._iter_column_chunks():
+                writer.write_batch(pa.record_batch([pa.array(values, type=pa.string()) for values in columns],
+                                                   schema=schema))
+    
+    @staticmethod
+    def _dedupe_key(entry):
+        task_id = entry.get('task_id') or ''
+        image_url = entry.get('image_url') or ''
+        if not task_id and not image_url:
+            return None
+        digest = hashlib.blake2b(f"{task_id}\x1f{image_url}".encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big')
+    
+    def _dedupe_keys(self):
+        if self._keys is None:
+            task_index = self.columns.index('task_id')
+            url_index = self.columns.index('image_url')
+            keys = set()
+            for columns in self._iter_column_chunks():
+                for task_id, image_url in zip(columns[task_index], columns[url_index]):
+                    key = self._dedupe_key({'task_id': task_id, 'image_url': image_url})
+                    if key is not None:
+                        keys.add(key)
+            self._keys = keys
+        return self._keys
+    
+    def _import_entry(self, entry, report):
+        key = self._dedupe_key(entry)
+        if key is not None and key in self._dedupe_keys():
+            report['duplicates'] += 1
+        else:
+            self.append(entry)
+            report['added'] += 1
+    
+    def import_csv(self, binary_file, on_progress=None):
+        """Stream rows from a CSV file object into the log, decoding it incrementally.
+
+        The header must name every column in ``required_columns``;
+        rows with a different number of fields are skipped as invalid and
+        already-logged rows as duplicates. ``on_progress(bytes_read, rows_read)``
+        is called every ``GENERATION_LOG_PROGRESS_ROWS`` rows. Returns a report
+        with ``added``, ``duplicates`` and ``invalid`` counts.
+        """
+        report = {'added': 0, 'duplicates': 0, 'invalid': 0}
+        text = io.TextIOWrapper(binary_file, encoding='utf-8-sig', newline='')
+        try:
+            reader = csv.reader(text)
+            header = [name.strip() for name in next(reader, [])]
+            missing = [column for column in self.required_columns if column not in header]
+            if missing:
+                raise ValueError(f"CSV is missing required column(s): {', '.join(missing)}")
+            positions = {column: header.index(column) for column in self.columns if column in header}
+            
+            rows_read = 0
+            for row in reader:
+                if not row:
+                    continue
+                rows_read += 1
+                if len(row) != len(header):
+                    report['invalid'] += 1
+                else:
+                    self._import_entry({column: row[i] for column, i in positions.items()}, report)
+                if on_progress and rows_read % GENERATION_LOG_PROGRESS_ROWS == 0:
+                    on_progress(binary_file.tell(), rows_read)
+        finally:
+            text.detach()
+        return report
+    
+    def import_parquet(self, binary_file, on_progress=None):
+        """Stream rows from a Parquet file object batch by batch (requires pyarrow); returns the same report as ``import_csv``."""
+        report = {'added': 0, 'duplicates': 0, 'invalid': 0}
+        parquet_file = pq.ParquetFile(binary_file)
+        names = parquet_file.schema_arrow.names
+        missing = [column for column in self.required_columns if column not in names]
+        if missing:
+            raise ValueError(f"Parquet file is missing required column(s): {', '.join(missing)}")
+        available = [column for column in self.columns if column in names]
+        
+        rows_read = 0
+        for batch in parquet_file.iter_batches(batch_size=self.chunk_rows, columns=available):
+            columns = {name: batch.column(name).cast(pa.string()).to_pylist() for name in available}
+            for i in range(batch.num_rows):
+                self._import_entry({name: columns[name][i] for name in available}, report)
+            rows_read += batch.num_rows
+            if on_progress:
+                on_progress(binary_file.tell(), rows_read)
+        return report
+
+class LibraryMetadataIndex:
+    """SQLite index of library file metadata, tags and favorites.
+
+    Mirrors what the Drive sync index knows about each folder, plus the model
+    and prompt that produced each upload, so library search (FTS5 when the
+    SQLite build has it), tag and favorite filters and date/name sorts run as
+    indexed queries instead of rescanning every file on each rerun. It also
+    maps content hashes to files so uploads of bytes already in a folder can
+    be skipped. Tags and favorites belong to an ``owner`` (the connected
+    account's identity) and are only visible to that owner; without an owner
+    they are neither read nor written.
+    """
+    
+    _FILE_COLUMNS = ('id', 'name', 'description', 'mime_type', 'created_time', 'modified_time',
+                     'web_view_link', 'md5_checksum', 'model', 'prompt')
+    
+    def __init__(self, path=LIBRARY_INDEX_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # Annotations stored before owners were tracked cannot be attributed to an account
+            tag_columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(tags)")}
+            if tag_columns and 'owner' not in tag_columns:
+                self._conn.execute("DROP TABLE tags")
+                self._conn.execute("DROP TABLE IF EXISTS favorites")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    id TEXT PRIMARY KEY,
+                    folder_id TEXT,
+                    name TEXT,
+                    description TEXT,
+                    mime_type TEXT,
+                    created_time TEXT,
+                    modified_time TEXT,
+                    web_view_link TEXT,
+                    model TEXT,
+                    prompt TEXT
+                );
+                CREATE INDEX IF NOT EXISTS files_by_created ON files (folder_id, created_time);
+                CREATE INDEX IF NOT EXISTS files_by_name ON files (folder_id, name COLLATE NOCASE);
+                CREATE TABLE IF NOT EXISTS tags (
+                    owner TEXT,
+                    file_id TEXT,
+                    tag TEXT,
+                    PRIMARY KEY (owner, file_id, tag)
+                );
+                CREATE INDEX IF NOT EXISTS tags_by_tag ON tags (owner, tag, file_id);
+                CREATE TABLE IF NOT EXISTS favorites (
+                    owner TEXT,
+                    file_id TEXT,
+                    PRIMARY KEY (owner, file_id)
+                );
+                CREATE TABLE IF NOT EXISTS content_hashes (
+                    sha256 TEXT,
+                    folder_id TEXT,
+                    file_id TEXT,
+                    md5_checksum TEXT,
+                    PRIMARY KEY (sha256, folder_id)
+                );
+            """)
+            # Indexes created before content hashing lack the Drive checksum column
+            columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(files)")}
+            if 'md5_checksum' not in columns:
+                self._conn.execute("ALTER TABLE files ADD COLUMN md5_checksum TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS files_by_md5 ON files (folder_id, md5_checksum)")
+            try:
+                self._conn.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(name, description, prompt)"
+                )
+                self.full_text = True
+            except sqlite3.OperationalError:
+                self.full_text = False
+    
+    def _reindex_text(self, file_id):
+        if not self.full_text:
+            return
+        row = self._conn.execute(
+            "SELECT rowid, name, description, prompt FROM files WHERE id = ?", (file_id,)
+        ).fetchone()
+        if row is None:
+            return
+        self._conn.execute("DELETE FROM files_fts WHERE rowid = ?", (row['rowid'],))
+        self._conn.execute(
+            "INSERT INTO files_fts (rowid, name, description, prompt) VALUES (?, ?, ?, ?)",
+            (row['rowid'], row['name'] or '', row['description'] or '', row['prompt'] or '')
+        )
+    
+    def _upsert(self, folder_id, f, model=None, prompt=None):
+        self._conn.execute(
+            """
+            INSERT INTO files (id, folder_id, name, description, mime_type, created_time,
+                               modified_time, web_view_link, model, prompt, md5_checksum)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                folder_id = excluded.folder_id,
+                name = excluded.name,
+                description = excluded.description,
+                mime_type = excluded.mime_type,
+                created_time = COALESCE(excluded.created_time, files.created_time),
+                modified_time = excluded.modified_time,
+                web_view_link = COALESCE(excluded.web_view_link, files.web_view_link),
+                model = COALESCE(excluded.model, files.model),
+                prompt = COALESCE(excluded.prompt, files.prompt),
+                md5_checksum = COALESCE(excluded.md5_checksum, files.md5_checksum)
+            """,
+            (f['id'], folder_id, f.get('name'), f.get('description'), f.get('mimeType'),
+             f.get('createdTime'), f.get('modifiedTime'), f.get('webViewLink'), model, prompt,
+             f.get('md5Checksum'))
+        )
+        self._reindex_text(f['id'])
+    
+    def _remove(self, file_ids):
+        for file_id in file_ids:
+            if self.full_text:
+                self._conn.execute(
+                    "DELETE FROM files_fts WHERE rowid = (SELECT rowid FROM files WHERE id = ?)", (file_id,)
+                )
+            self._conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+            self._conn.execute("DELETE FROM tags WHERE file_id = ?", (file_id,))
+            self._conn.execute("DELETE FROM favorites WHERE file_id = ?", (file_id,))
+            self._conn.execute("DELETE FROM content_hashes WHERE file_id = ?", (file_id,))
+    
+    def apply_changes(self, folder_id, upserted, removed_ids=(), replace=False):
+        """Apply a sync's file changes; with ``replace`` files missing from ``upserted`` are dropped."""
+        with self._lock, self._conn:
+            if replace:
+                keep = {f['id'] for f in upserted}
+                existing = [row['id'] for row in self._conn.execute(
+                    "SELECT id FROM files WHERE folder_id = ?", (folder_id,)
+                )]
+                removed_ids = [file_id for file_id in existing if file_id not in keep]
+            self._remove(removed_ids)
+            for f in upserted:
+                self._upsert(folder_id, f)
+    
+    def record_upload(self, folder_id, file_info, model=None, prompt=None):
+        """Index a freshly uploaded file together with the model and prompt that produced it."""
+        with self._lock, self._conn:
+            self._upsert(folder_id, file_info, model=model, prompt=prompt)
+    
+    def record_content_hash(self, folder_id, file_id, sha256, md5_checksum):
+        """Remember which file in a folder holds the bytes with this SHA-256."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO content_hashes (sha256, folder_id, file_id, md5_checksum) VALUES (?, ?, ?, ?)",
+                (sha256, folder_id, file_id, md5_checksum)
+            )
+    
+    def find_duplicate(self, folder_id, sha256, md5_checksum):
+        """Return the indexed file in a folder with the same bytes, or None.
+
+        A SHA-256 match only counts while Drive's ``md5Checksum`` for the file
+        still agrees, so a file whose content changed is not reused. Files
+        uploaded by other clients are found by their Drive checksum alone and
+        their SHA-256 is recorded for next time.
+        """
+        columns = f"f.{', f.'.join(self._FILE_COLUMNS)}"
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                f"""
+                SELECT {columns} FROM content_hashes h JOIN files f ON f.id = h.file_id
+                WHERE h.sha256 = ? AND h.folder_id = ? AND f.folder_id = h.folder_id
+                  AND (f.md5_checksum IS NULL OR f.md5_checksum = ?)
+                """,
+                (sha256, folder_id, md5_checksum)
+            ).fetchone()
+            if row is None:
+                row = self._conn.execute(
+                    f"SELECT {columns} FROM files f WHERE f.folder_id = ? AND f.md5_checksum = ? LIMIT 1",
+                    (folder_id, md5_checksum)
+                ).fetchone()
+                if row is None:
+                    return None
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO content_hashes (sha256, folder_id, file_id, md5_checksum) VALUES (?, ?, ?, ?)",
+                    (sha256, folder_id, row['id'], md5_checksum)
+                )
+        return self._file_info(row)
+    
+    def forget(self, file_ids):
+        """Drop files that no longer exist on Drive, with their hashes and annotations."""
+        with self._lock, self._conn:
+            self._remove(file_ids)
+    
+    def add_tag(self, owner, file_id, tag):
+        if not owner:
+            return
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO tags (owner, file_id, tag) VALUES (?, ?, ?)",
+                               (owner, file_id, tag))
+    
+    def remove_tag(self, owner, file_id, tag):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM tags WHERE owner = ? AND file_id = ? AND tag = ?",
+                               (owner, file_id, tag))
+    
+    def set_favorite(self, owner, file_id, favorite=True):
+        if not owner:
+            return
+        with self._lock, self._conn:
+            if favorite:
+                self._conn.execute("INSERT OR IGNORE INTO favorites (owner, file_id) VALUES (?, ?)",
+                                   (owner, file_id))
+            else:
+                self._conn.execute("DELETE FROM favorites WHERE owner = ? AND file_id = ?", (owner, file_id))
+    
+    def all_tags(self, owner):
+        with self._lock:
+            return [row['tag'] for row in self._conn.execute(
+                "SELECT DISTINCT tag FROM tags WHERE owner = ? ORDER BY tag", (owner,)
+            )]
+    
+    def tag_map(self, owner):
+        """Return the owner's tags as ``{file_id: [tag, ...]}``."""
+        tags = {}
+        with self._lock:
+            for row in self._conn.execute(
+                "SELECT file_id, tag FROM tags WHERE owner = ? ORDER BY file_id, tag", (owner,)
+            ):
+                tags.setdefault(row['file_id'], []).append(row['tag'])
+        return tags
+    
+    def clear_annotations(self, owner):
+        """Drop every tag and favorite of one owner."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM tags WHERE owner = ?", (owner,))
+            self._conn.execute("DELETE FROM favorites WHERE owner = ?", (owner,))
+    
+    def favorite_ids(self, owner):
+        with self._lock:
+            return [row['file_id'] for row in self._conn.execute(
+                "SELECT file_id FROM favorites WHERE owner = ?", (owner,)
+            )]
+    
+    def _match_expression(self, search):
+        # Quote each term so user input is never parsed as FTS syntax; the star makes it a prefix match.
+        terms = [term.replace('"', '""') for term in search.split()]
+        return " ".join(f'"{term}"*' for term in terms)
+    
+    def query(self, folder_id, search="", tag=None, favorites_only=False, mime_type=None,
+              sort='date_desc', limit=None, offset=0, owner=None):
+        """Return ``(files, total)`` for one page of a folder's matching files, in Drive field names.
+
+        The ``tag`` and ``favorites_only`` filters use the annotations of ``owner``.
+        """
+        clauses = ["f.folder_id = ?"]
+        params = [folder_id]
+        if search and search.strip():
+            if self.full_text:
+                clauses.append("f.rowid IN (SELECT rowid FROM files_fts WHERE files_fts MATCH ?)")
+                params.append(self._match_expression(search))
+            else:
+                clauses.append("(f.name LIKE ? OR f.description LIKE ? OR f.prompt LIKE ?)")
+                params.extend([f"%{search.strip()}%"] * 3)
+        if tag:
+            clauses.append("EXISTS (SELECT 1 FROM tags t WHERE t.owner = ? AND t.file_id = f.id AND t.tag = ?)")
+            params.extend([owner, tag])
+        if favorites_only:
+            clauses.append("EXISTS (SELECT 1 FROM favorites v WHERE v.owner = ? AND v.file_id = f.id)")
+            params.append(owner)
+        if mime_type:
+            clauses.append("f.mime_type = ?")
+            params.append(mime_type)
+        where = " AND ".join(clauses)
+        order = {
+            'date_asc': "f.created_time ASC",
+            'name': "f.name COLLATE NOCASE ASC"
+        }.get(sort, "f.created_time DESC")
+        
+        page_sql = f"""
+            SELECT f.{', f.'.join(self._FILE_COLUMNS)}
+            FROM files f WHERE {where} ORDER BY {order} LIMIT ? OFFSET ?
+        """
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM files f WHERE {where}", params).fetchone()[0]
+            rows = self._conn.execute(page_sql, params + [-1 if limit is None else limit, offset]).fetchall()
+        return [self._file_info(row) for row in rows], total
+    
+    @staticmethod
+    def _file_info(row):
+        return {
+            'id': row['id'],
+            'name': row['name'] or '',
+            'description': row['description'] or '',
+            'mimeType': row['mime_type'],
+            'createdTime': row['created_time'],
+            'modifiedTime': row['modified_time'],
+            'webViewLink': row['web_view_link'] or f"https://drive.google.com/file/d/{row['id']}/view",
+            'md5Checksum': row['md5_checksum'],
+            'model': row['model'],
+            'prompt': row['prompt']
+        }
+
+@st.cache_resource
+def get_metadata_index():
+    """Return the process-wide library metadata index."""
+    return LibraryMetadataIndex()
+
+class ContentDigests:
+    """Incremental ``content_digests`` for bytes that arrive in pieces, such as a streamed upload."""
+    
+    def __init__(self):
+        self._sha256 = hashlib.sha256()
+        self._md5 = hashlib.md5()
+    
+    def update(self, piece):
+        self._sha256.update(piece)
+        self._md5.update(piece)
+    
+    def hexdigests(self):
+        return self._sha256.hexdigest(), self._md5.hexdigest()
+
+def content_digests(data):
+    """Return the ``(sha256, md5)`` hex digests used to recognise duplicate uploads."""
+    digests = ContentDigests()
+    digests.update(data)
+    return digests.hexdigests()
+
+def find_live_duplicate(service, folder_id, sha256, md5_checksum):
+    """Return the indexed copy of these bytes in a folder once Drive confirms it, or None.
+
+    Index entries for files that were deleted, trashed or changed on Drive are
+    forgotten, so the caller uploads the bytes again. When Drive cannot be
+    asked, None is returned and the entry is kept.
+    """
+    index = get_metadata_index()
+    duplicate = index.find_duplicate(folder_id, sha256, md5_checksum)
+    if duplicate is None:
+        return None
+    try:
+        live = service.files().get(fileId=duplicate['id'], fields='id,md5Checksum,trashed').execute()
+    except Exception as e:
+        if not is_not_found_error(e):
+            return None
+        live = None
+    if live is None or live.get('trashed') or live.get('md5Checksum') not in (None, md5_checksum):
+        index.forget([duplicate['id']])
+        return None
+    return duplicate
+
+class LibrarySyncIndex:
+    """Local index of the image files in one Drive folder.
+
+    The first sync pages through the whole folder; later syncs apply only the
+    deltas from the Drive changes feed, so refreshing a large library costs a
+    single small request when nothing changed. When a metadata index is
+    given, every sync's changes are mirrored into it.
+    """
+    
+    def __init__(self, folder_id, fields, metadata_index=None):
+        self.folder_id = folder_id
+        self.fields = fields
+        self.metadata_index = metadata_index
+        self.files = {}
+        self.start_page_token = None
+        self.last_synced = None
+        self._lock = threading.Lock()
+    
+    def sync(self, service, full=False):
+        """Bring the index up to date and return its files, newest first."""
+        with self._lock:
+            if full or self.start_page_token is None:
+                self._full_sync(service)
+            else:
+                try:
+                    self._incremental_sync(service)
+                except Exception:
+                    self._full_sync(service)
+            self.last_synced = time.time()
+            return self.sorted_files()
+    
+    def sorted_files(self):
+        return sorted(
+            (dict(f) for f in self.files.values()),
+            key=lambda f: f.get('createdTime', ''),
+            reverse=True
+        )
+    
+    def _full_sync(self, service):
+        # Take the changes token before listing so nothing created meanwhile is missed.
+        start_page_token = service.changes().getStartPageToken().execute().get('startPageToken')
+        files = {}
+        page_token = None
+        while True:
+            response = service.files().list(
+                q=f"'{self.folder_id}' in parents and mimeType contains 'image/' and trashed=false",
+                spaces='drive',
+                fields=f"nextPageToken, files({self.fields})",
+                orderBy='createdTime desc',
+                pageSize=LIBRARY_PAGE_SIZE,
+                pageToken=page_token
+            ).execute()
+            for f in response.get('files', []):
+                files[f['id']] = f
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+        self.files = files
+        self.start_page_token = start_page_token
+        if self.metadata_index is not None:
+            self.metadata_index.apply_changes(self.folder_id, list(files.values()), replace=True)
+    
+    def _incremental_sync(self, service):
+        upserted = {}
+        removed_ids = set()
+        page_token = self.start_page_token
+        while page_token:
+            response = service.changes().list(
+                pageToken=page_token,
+                spaces='drive',
+                fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({self.fields}))",
+                pageSize=LIBRARY_PAGE_SIZE
+            ).execute()
+            for change in response.get('changes', []):
+                f = change.get('file')
+                if (change.get('removed') or not f or f.get('trashed')
+                        or self.folder_id not in f.get('parents', [])
+                        or not f.get('mimeType', '').startswith('image/')):
+                    if self.files.pop(change.get('fileId'), None) is not None:
+                        removed_ids.add(change.get('fileId'))
+                        upserted.pop(change.get('fileId'), None)
+                else:
+                    self.files[f['id']] = f
+                    upserted[f['id']] = f
+                    removed_ids.discard(f['id'])
+            if response.get('newStartPageToken'):
+                self.start_page_token = response['newStartPageToken']
+            page_token = response.get('nextPageToken')
+        if self.metadata_index is not None and (upserted or removed_ids):
+            self.metadata_index.apply_changes(self.folder_id, list(upserted.values()), removed_ids)
+
+@st.cache_resource
+def get_library_index(folder_id, fields):
+    """Return the process-wide library index for a Drive folder, listing ``fields`` of each file."""
+    return LibrarySyncIndex(folder_id, fields, get_metadata_index())
+
+class DiskImageCache:
+    """Size-bounded on-disk cache of Drive image bytes with LRU eviction.
+
+    Entries are keyed by the owning account's identity, Drive file ID and
+    modifiedTime, so an edited file gets a fresh entry and one account never
+    reads bytes cached for another. They are written atomically so that
+    sessions and processes can share one directory. Thumbnails and full-size images live in separate
+    tiers with their own size limits; reads refresh an entry's mtime, which
+    eviction uses as its recency order.
+    """
+    
+    def __init__(self, root=IMAGE_CACHE_DIR, max_bytes=None):
+        self.root = root
+        self.max_bytes = dict(IMAGE_CACHE_MAX_BYTES, **(max_bytes or {}))
+        self._lock = threading.Lock()
+        self._sizes = {}
+        self._puts = {}
+        for tier in self.max_bytes:
+            os.makedirs(os.path.join(root, tier), exist_ok=True)
+            self._sizes[tier] = self._scan(tier)[1]
+            self._puts[tier] = 0
+    
+    def _path(self, tier, owner, file_id, modified_time):
+        key = hashlib.sha256(f"{owner or ''}:{file_id}:{modified_time or ''}".encode('utf-8')).hexdigest()
+        return os.path.join(self.root, tier, key[:2], key)
+    
+    def get(self, tier, owner, file_id, modified_time=None):
+        path = self._path(tier, owner, file_id, modified_time)
+        try:
+            with open(path, 'rb') as fh:
+                data = fh.read()
+        except OSError:
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+    
+    def put(self, tier, owner, file_id, modified_time, data):
+        path = self._path(tier, owner, file_id, modified_time)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as fh:
+            fh.write(data)
+        # An overwritten entry no longer counts towards the tier size
+        try:
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        
+        with self._lock:
+            self._sizes[tier] += len(data) - replaced
+            self._puts[tier] += 1
+            needs_eviction = (self._sizes[tier] > self.max_bytes[tier]
+                              or self._puts[tier] % IMAGE_CACHE_RESCAN_EVERY == 0)
+        if needs_eviction:
+            self.evict(tier)
+    
+    def _scan(self, tier):
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(os.path.join(self.root, tier)):
+            for name in filenames:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((info.st_mtime, info.st_size, path))
+                total += info.st_size
+        return entries, total
+    
+    def evict(self, tier):
+        """Remove least recently used entries until the tier is under 90% of its limit."""
+        with self._lock:
+            entries, total = self._scan(tier)
+            limit = self.max_bytes[tier]
+            if total > limit:
+                for _, size, path in sorted(entries):
+                    if total <= limit * 0.9:
+                        break
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    total -= size
+            self._sizes[tier] = total
+
+@st.cache_resource
+def get_image_cache():
+    """Return the process-wide disk image cache."""
+    return DiskImageCache()
+
+class SingleFlight:
+    """Merge concurrent identical calls into one in-flight call.
+
+    The first caller for a key runs the call; callers that arrive while it is
+    running wait for it and get the same result, or the same exception.
+    Nothing is kept once the call finishes, so this only deduplicates work
+    that overlaps in time and caching stays with the callers.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+    
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event()}
+        
+        if not leader:
+            call['done'].wait()
+            if 'error' in call:
+                raise call['error']
+            if 'result' not in call:
+                return self.do(key, fn)  # The leader was interrupted; run the call again
+            return call['result']
+        
+        try:
+            call['result'] = fn()
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+        return call['result']
+
+@st.cache_resource
+def get_single_flight():
+    """Return the process-wide single-flight group for Drive reads."""
+    return SingleFlight()
+
+def download_drive_bytes(service, file_id, modified_time=None, owner=None):
+    """Return a Drive file's bytes from the disk cache, downloading them on a miss.
+
+    Entries are cached under ``owner``, the identity of the account behind
+    ``service``. Concurrent misses for the same file, from any session or
+    worker, share one download. Does not touch session state and raises on
+    errors.
+    """
+    cache = get_image_cache()
+    image_bytes = cache.get('full', owner, file_id, modified_time)
+    if image_bytes is not None:
+        return image_bytes
+    
+    def download():
+        # A call that finished just before this one joined may have filled the cache
+        cached = cache.get('full', owner, file_id, modified_time)
+        if cached is not None:
+            return cached
+        fh = io.BytesIO()
+        downloader = MediaIoBaseDownload(fh, service.files().get_media(fileId=file_id))
+        done = False
+        while not done:
+            _, done = downloader.next_chunk()
+        data = fh.getvalue()
+        cache.put('full', owner, file_id, modified_time, data)
+        return data
+    
+    return get_single_flight().do(('media', owner, file_id, modified_time), download)
+
+class SheetsLogBuffer:
+    """Write-behind buffer that batches log rows into few Sheets appends.
+
+    Rows are written to a local spill file before they are queued, so
+    nothing is lost while the Sheets write quota is exhausted or the process
+    dies. A daemon thread flushes each spreadsheet/range in one ``append`` once
+    it holds ``flush_rows`` rows or its oldest row is ``flush_seconds`` old,
+    backing off exponentially after failures; whatever is left is flushed at
+    interpreter shutdown. Appends reach the spill file at once but are only
+    fsynced by the flusher, once per tick. Each buffer holds a lock on its own
+    spill file, and spill files nobody holds (left by a dead process, or by an
+    earlier buffer of this process retired after the resource cache was
+    cleared) are adopted on start and periodically, so no row is appended by
+    two flushers. Rows carry the identity of the account that logged them;
+    adopted rows whose account has no cached credentials in this process stay
+    in a parked spill file on disk until a session connects it.
+    ``flushed_rows`` counts rows written so far, so readers can check for them at once.
+    """
+    
+    def __init__(self, spill_dir=SHEETS_LOG_SPILL_DIR, flush_rows=SHEETS_LOG_FLUSH_ROWS,
+                 flush_seconds=SHEETS_LOG_FLUSH_SECONDS):
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.spill_dir = spill_dir
+        self._stem = f"sheets_log_{os.getpid()}_{uuid.uuid4().hex[:12]}"
+        self.spill_path = os.path.join(spill_dir, f"{self._stem}.jsonl")
+        self._lock_path = os.path.join(spill_dir, f"{self._stem}.lock")
+        self.last_error = None
+        self.flushed_rows = 0
+        self._pending = {}
+        self._queued_at = {}
+        self._failures = {}
+        self._retry_at = {}
+        self._credentials = {}
+        self._identities = {}
+        self._services = {}
+        self._unsynced = False
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._retired = threading.Event()
+        self._stopped = False
+        self._next_adoption = time.time() + SHEETS_LOG_ADOPT_INTERVAL
+        os.makedirs(spill_dir, exist_ok=True)
+        self._lock_file = self._take_lock(self._lock_path, blocking=True)
+        self._retire_other_buffers()
+        self._adopt_spill_files()
+        flusher = threading.Thread(target=self._flush_loop, name="sheets-log-flusher", daemon=True)
+        flusher.retire = self._retired
+        flusher.start()
+        atexit.register(self.close)
+    
+    @staticmethod
+    def _take_lock(path, blocking=False):
+        """Return an open handle holding an exclusive lock on ``path``, or None if it is held elsewhere."""
+        if fcntl is None:
+            return None
+        fh = open(path, 'a')
+        try:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            fh.close()
+            return None
+        return fh
+    
+    def _retire_other_buffers(self):
+        # Buffers of this process replaced by a cleared resource cache flush once more and stop
+        for thread in threading.enumerate():
+            retire = getattr(thread, 'retire', None)
+            if thread.name == "sheets-log-flusher" and retire is not None and retire is not self._retired:
+                retire.set()
+    
+    def _can_adopt(self, stem):
+        """Claim the spill file ``stem`` if no live buffer owns it; returns ``(claimed, lock_handle)``."""
+        if fcntl is not None:
+            handle = self._take_lock(os.path.join(self.spill_dir, f"{stem}.lock"))
+            return handle is not None, handle
+        if stem.startswith("sheets_log_parked_"):
+            return True, None
+        # Without file locks, fall back to the owner's PID; this process's files belong to live buffers
+        try:
+            pid = int(stem[len("sheets_log_"):].split('_')[0])
+        except ValueError:
+            return False, None
+        if pid == os.getpid():
+            return False, None
+        try:
+            os.kill(pid, 0)
+            return False, None
+        except ProcessLookupError:
+            return True, None
+        except OSError:
+            return False, None
+    
+    def _resolve_credentials(self, spreadsheet_id, identity):
+        credentials = self._credentials.get(spreadsheet_id)
+        if credentials is None and identity:
+            credentials = get_google_client_cache().find_credentials(identity, SHEETS_LOG_SCOPE)
+        return credentials
+    
+    @staticmethod
+    def _spill_line(spreadsheet_id, range_name, identity, row):
+        return json.dumps({'spreadsheet_id': spreadsheet_id, 'range': range_name, 'identity': identity, 'row': row}) + "\n"
+    
+    @staticmethod
+    def _read_spill(path):
+        entries = []
+        with open(path, 'r', encoding='utf-8') as fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                    entries.append((entry['spreadsheet_id'], entry['range'], entry.get('identity'), entry['row']))
+                except (ValueError, KeyError, TypeError):
+                    continue  # Blank, or cut short by a crash
+        return entries
+    
+    @classmethod
+    def _write_spill(cls, path, entries):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            for entry in entries:
+                fh.write(cls._spill_line(*entry))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, path)
+    
+    def _adopt_spill_files(self):
+        for name in os.listdir(self.spill_dir):
+            # Spill files of other buffers, and ".adopt-" files of a buffer that died while adopting
+            if not name.startswith("sheets_log_") or not (name.endswith(".jsonl") or ".jsonl.adopt-" in name):
+                continue
+            stem = name.split(".jsonl")[0]
+            if stem == self._stem:
+                continue
+            claimed, handle = self._can_adopt(stem)
+            if not claimed:
+                continue
+            try:
+                self._adopt(os.path.join(self.spill_dir, name))
+            except OSError:
+                continue
+            finally:
+                if handle is not None:
+                    # Also when another buffer adopted the file first, so its lock file does not linger
+                    try:
+                        os.remove(os.path.join(self.spill_dir, f"{stem}.lock"))
+                    except OSError:
+                        pass
+                    handle.close()
+        with self._lock:
+            self._rewrite_spill()
+    
+    def _adopt(self, path):
+        """Take over the rows of an unowned spill file that this process can flush; park the rest."""
+        ready, parked = [], []
+        for entry in self._read_spill(path):
+            spreadsheet_id, _, identity, _ = entry
+            (ready if self._resolve_credentials(spreadsheet_id, identity) is not None else parked).append(entry)
+        if not ready:
+            return  # Nothing this process can flush; leave the file for a later pass
+        
+        adopted = f"{self.spill_path}.adopt-{uuid.uuid4().hex[:12]}"
+        os.replace(path, adopted)
+        with self._lock:
+            for spreadsheet_id, range_name, identity, row in ready:
+                if identity:
+                    self._identities.setdefault(spreadsheet_id, identity)
+                self._queue((spreadsheet_id, range_name), [row])
+            self._rewrite_spill()
+        if parked:
+            self._write_spill(os.path.join(self.spill_dir, f"sheets_log_parked_{uuid.uuid4().hex[:12]}.jsonl"), parked)
+        os.remove(adopted)
+    
+    def _queue(self, destination, rows):
+        self._pending.setdefault(destination, []).extend(rows)
+        self._queued_at.setdefault(destination, time.time())
+    
+    def _rewrite_spill(self):
+        self._write_spill(self.spill_path, [
+            (spreadsheet_id, range_name, self._identities.get(spreadsheet_id), row)
+            for (spreadsheet_id, range_name), rows in self._pending.items()
+            for row in rows
+        ])
+        self._unsynced = False
+    
+    def _sync_spill(self):
+        with self._lock:
+            if not self._unsynced:
+                return
+            with open(self.spill_path, 'a', encoding='utf-8') as fh:
+                os.fsync(fh.fileno())
+            self._unsynced = False
+    
+    def add(self, credentials, spreadsheet_id, range_name, rows):
+        """Queue rows for ``range_name`` of a spreadsheet, writing them to the spill file first."""
+        destination = (spreadsheet_id, range_name)
+        identity = getattr(credentials, 'cache_identity', None)
+        with self._lock:
+            self._credentials[spreadsheet_id] = credentials
+            self._identities[spreadsheet_id] = identity
+            with open(self.spill_path, 'a', encoding='utf-8') as fh:
+                for row in rows:
+                    fh.write(self._spill_line(spreadsheet_id, range_name, identity, row))
+            self._unsynced = True
+            self._queue(destination, rows)
+            if len(self._pending[destination]) >= self.flush_rows:
+                self._wakeup.set()
+    
+    def pending_count(self):
+        with self._lock:
+            return sum(len(rows) for rows in self._pending.values())
+    
+    def flush(self):
+        """Ask the flusher to write every queued row now, ignoring thresholds but not backoff."""
+        with self._lock:
+            for destination in self._pending:
+                self._queued_at[destination] = 0
+        self._wakeup.set()
+    
+    def _flush_loop(self):
+        while not self._retired.is_set():
+            self._wakeup.wait(timeout=1)
+            self._wakeup.clear()
+            if time.time() >= self._next_adoption:
+                self._next_adoption = time.time() + SHEETS_LOG_ADOPT_INTERVAL
+                self._adopt_spill_files()
+            self._flush_due()
+            self._sync_spill()
+        self._stop()
+    
+    def _stop(self):
+        # Rows that still fail stay in the spill file and are adopted by the buffer that replaced this one
+        self._flush_due(force=True)
+        with self._flush_lock, self._lock:
+            self._stopped = True
+            if not self._pending:
+                for path in (self.spill_path, self._lock_path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+    
+    def _flush_due(self, force=False):
+        with self._flush_lock:
+            if self._stopped:
+                return
+            now = time.time()
+            with self._lock:
+                due = [
+                    (destination, list(rows), self._resolve_credentials(destination[0], self._identities.get(destination[0])))
+                    for destination, rows in self._pending.items()
+                    if rows and (force or (
+                        now >= self._retry_at.get(destination, 0)
+                        and (len(rows) >= self.flush_rows
+                             or now - self._queued_at.get(destination, now) >= self.flush_seconds)
+                    ))
+                ]
+            for destination, rows, credentials in due:
+                if credentials is None:
+                    continue  # No credentials for the account in this process; retry on a later tick
+                try:
+                    self._append(credentials, destination, rows)
+                except Exception as e:
+                    status = getattr(getattr(e, 'resp', None), 'status', None)
+                    if is_not_found_error(e):
+                        get_resolved_resources().forget(destination[0])
+                    with self._lock:
+                        failures = self._failures.get(destination, 0) + 1
+                        self._failures[destination] = failures
+                        delay = min(SHEETS_LOG_MAX_BACKOFF, SHEETS_LOG_BASE_BACKOFF * 2 ** (failures - 1))
+                        self._retry_at[destination] = time.time() + delay
+                        quota = " (quota exceeded)" if status in (403, 429) else ""
+                        self.last_error = f"{str(e)}{quota}; retrying in {delay:.0f}s"
+                    continue
+                with self._lock:
+                    remaining = self._pending[destination][len(rows):]
+                    if remaining:
+                        self._pending[destination] = remaining
+                        self._queued_at[destination] = time.time()
+                    else:
+                        del self._pending[destination]
+                        self._queued_at.pop(destination, None)
+                    self._failures.pop(destination, None)
+                    self._retry_at.pop(destination, None)
+                    self.flushed_rows += len(rows)
+                    self.last_error = None
+                    self._rewrite_spill()
+    
+    def _append(self, credentials, destination, rows):
+        spreadsheet_id, range_name = destination
+        cached = self._services.get(spreadsheet_id)
+        if cached is None or cached[0] is not credentials:
+            cached = (credentials, get_google_client_cache().build('sheets', 'v4', credentials))
+            self._services[spreadsheet_id] = cached
+        cached[1].spreadsheets().values().append(
+            spreadsheetId=spreadsheet_id,
+            range=range_name,
+            valueInputOption='RAW',
+            insertDataOption='INSERT_ROWS',
+            body={'values': rows}
+        ).execute()
+    
+    def close(self):
+        """Flush whatever is queued; rows that still fail stay in the spill file."""
+        self._flush_due(force=True)
+
+@st.cache_resource
+def get_log_buffer():
+    """Return the process-wide Sheets log buffer."""
+    return SheetsLogBuffer()
+
+class StateStore:
+    """SQLite (WAL) repository for session data that should survive reloads and restarts.
+
+    Every persisted collection is stored row by row under a profile, so a
+    change to one task or project rewrites one row rather than the whole
+    session. List collections keep their order through a per-row ``seq``.
+    """
+    
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    profile TEXT,
+                    collection TEXT,
+                    key TEXT,
+                    seq INTEGER,
+                    data TEXT,
+                    PRIMARY KEY (profile, collection, key)
+                )
+            """)
+    
+    def load(self, profile, collection):
+        """Return ``(key, seq, data)`` rows of a collection, highest ``seq`` first."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT key, seq, data FROM entries WHERE profile = ? AND collection = ? ORDER BY seq DESC",
+                (profile, collection)
+            ).fetchall()
+    
+    def apply(self, profile, collection, upserts, deletes):
+        """Write changed ``(key, seq, data)`` rows and drop deleted keys in one transaction."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM entries WHERE profile = ? AND collection = ? AND key = ?",
+                [(profile, collection, key) for key in deletes]
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (profile, collection, key, seq, data) VALUES (?, ?, ?, ?, ?)",
+                [(profile, collection, key, seq, data) for key, seq, data in upserts]
+            )
+    
+    def update(self, profile, collection, key, change):
+        """Rewrite one row from its stored data in one transaction.
+
+        ``change`` maps the stored data, or None when the row does not exist
+        yet, to the new data.
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT data FROM entries WHERE profile = ? AND collection = ? AND key = ?",
+                (profile, collection, key)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (profile, collection, key, seq, data) VALUES (?, ?, ?, 0, ?)",
+                (profile, collection, key, change(row[0] if row else None))
+            )
+    
+    def clear(self, profile):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries WHERE profile = ?", (profile,))
+
+@st.cache_resource
+def get_state_store(path):
+    """Return the process-wide persistent state store kept at ``path``."""
+    return StateStore(path)